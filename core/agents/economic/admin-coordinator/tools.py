@@ -1,4 +1,24 @@
-from pydantic_ai import Tool
+import asyncio
+import importlib
+from collections.abc import Awaitable, Callable
+from typing import Literal
+from pydantic import BaseModel, Field
+from pydantic_ai import RunContext, Tool
+
+# agenti che il coordinatore può consultare, con il modulo che li avvia
+SUB_AGENTS = {
+    "budgeting": "core.agents.economic.budgeting.run",
+    "finantial-prevision": "core.agents.economic.finantial-prevision.run",
+}
+
+# sotto-agenti in esecuzione insieme per ogni consultazione e tempo massimo complessivo
+MAX_CONCURRENT_SUB_AGENTS = 4
+SUB_AGENTS_DEADLINE_SECONDS = 180
+
+
+class SubAgentRequest(BaseModel):
+    agent: Literal["budgeting", "finantial-prevision"] = Field(..., description="The agent to consult")
+    question: str = Field(..., description="A self-contained question for the agent")
 
 
 def current_time() -> str:
@@ -12,4 +32,64 @@ def current_time() -> str:
     return datetime.now().strftime("%Y-%m-%d")
 
 
+async def fan_out(
+    calls: list[Callable[[], Awaitable]],
+    limit: int = MAX_CONCURRENT_SUB_AGENTS,
+    deadline_seconds: float = SUB_AGENTS_DEADLINE_SECONDS,
+) -> list[dict]:
+    """
+    Esegue le chiamate insieme, al massimo `limit` alla volta, entro una scadenza comune.
+
+    Ogni chiamata restituisce {"output": ...} oppure {"error": ...}: un errore o la scadenza di una
+    chiamata non fanno perdere i risultati delle altre.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + deadline_seconds
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(call: Callable[[], Awaitable]) -> dict:
+        try:
+            async with asyncio.timeout_at(deadline):
+                async with semaphore:
+                    return {"output": await call()}
+        except TimeoutError:
+            return {"error": "Deadline exceeded"}
+        except Exception as e:
+            return {"error": str(e)}
+
+    return await asyncio.gather(*(run(call) for call in calls))
+
+
+def coordinator_tools(team_key: str, organization_id: str | None) -> list[Tool]:
+    """Tool del coordinatore per consultare gli agenti economici in parallelo"""
+
+    async def consult_agents(ctx: RunContext, requests: list[SubAgentRequest]) -> list[dict]:
+        """Ask one or more specialist agents at the same time and get all their answers.
+
+        Put every independent question in a single call: they run concurrently.
+        budgeting: budgets and budget vs actual variance. finantial-prevision: forecasts and scenarios.
+
+        Args:
+            requests (list[SubAgentRequest]): The agents to consult, each with its question
+
+        Returns:
+            list[dict]: for each request the agent, the question and its output or error
+        """
+
+        async def ask(request: SubAgentRequest):
+            agent_startup = importlib.import_module(SUB_AGENTS[request.agent]).agent_startup
+            agent = await agent_startup(team_key, organization_id)
+            # i sotto-agenti contano nell'uso del token del coordinatore
+            result = await agent.run(request.question, usage=ctx.usage)
+            return result.output
+
+        results = await fan_out([lambda request=request: ask(request) for request in requests])
+        return [
+            {"agent": request.agent, "question": request.question, **result}
+            for request, result in zip(requests, results)
+        ]
+
+    return [Tool(consult_agents)]
+
+
 custom_tools = [Tool(current_time)]
@@ -1,4 +1,5 @@
 from pydantic_ai import Tool
+from core.services.financial.budget import get_budget_variance
 
 
 def current_time() -> str:
@@ -12,4 +13,28 @@ def current_time() -> str:
     return datetime.now().strftime("%Y-%m-%d")
 
 
+def budget_tools(organization_id: str) -> list[Tool]:
+    """Tool sul budget dell'organizzazione dell'utente"""
+
+    async def budget_variance(year: int, month: int | None = None) -> dict:
+        """Compare budget and actual values of the reclassified income statement by CEE line.
+
+        Amounts are debit - credit balances: costs are positive, revenues negative.
+        Variance is actual - budget; variancePercentage is relative to the absolute budget.
+
+        Args:
+            year (int): The year to compare
+            month (int | None): The month (1-12), or None for every month of the year
+
+        Returns:
+            dict: one line per CEE line with actual, budget and variance for each month
+        """
+        if month is not None and not 1 <= month <= 12:
+            month = None
+        variance = await get_budget_variance(organization_id, year)
+        return await variance.to_dict(month)
+
+    return [Tool(budget_variance)]
+
+
 custom_tools = [Tool(current_time)]
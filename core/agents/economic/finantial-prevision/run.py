@@ -1,24 +1,20 @@
-from langfuse import Langfuse
 from core.agents.core.config import AgentConfig, OutputConfig
 from pydantic_ai import Agent
 from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
-from settings import settings
-from agents.core.tools import custom_tools
-from agents.generic_tools.tools import global_tools
+from core.settings import settings
+from core.agents.factory import agent_cache, get_openai_provider
+from core.services.prompts import prompt_registry
+from core.agents.core.tools import custom_tools
+from core.agents.generic_tools.tools import global_tools, analytics_tools, what_if_tools
+from .tools import forecast_tools
 
-lang_client = Langfuse(
-    host=settings.model_dump()["requrv_langfuse_host"],
-    public_key=settings.model_dump()["requrv_langfuse_public_key"],
-    secret_key=settings.model_dump()["requrv_langfuse_secret_key"],
-)
 
-
-def agent_startup(team_key: str) -> Agent:
+async def agent_startup(team_key: str, organization_id: str | None = None) -> Agent:
     """Core agent startup function
 
     Args:
         user_id (str): The user ID that called the agent
+        organization_id (str | None): The organization whose data the analytics tools can query
 
     Raises:
         ValueError: User not found
@@ -27,21 +23,29 @@ def agent_startup(team_key: str) -> Agent:
     Returns:
         Agent: The core agent instance
     """
+    prompt = await prompt_registry.get("requrv-hub-core", organization_id)
+    # l'agente viene ricostruito solo se cambia la versione del prompt o alla scadenza della cache
+    return agent_cache.get_or_build(
+        ("finantial-prevision", team_key, organization_id, prompt.version),
+        lambda: _build_agent(team_key, organization_id, prompt.text),
+    )
+
+
+def _build_agent(team_key: str, organization_id: str | None, system_prompt: str) -> Agent:
     config = AgentConfig(
-        system_prompt=lang_client.get_prompt("requrv-hub-core").compile(),
+        system_prompt=system_prompt,
         output_config=OutputConfig(format="plain", json_schema=None),
         qdrant_resources=[],
     )
 
     llm_model = OpenAIModel(
         model_name="requrv-ai",
-        provider=OpenAIProvider(
-            api_key=team_key,
-            base_url=settings.model_dump()["requrv_openai_base_url"],
-        ),
+        provider=get_openai_provider(team_key, settings.requrv_hive_endpoint),
     )
 
     whole_tools = global_tools + custom_tools
+    if organization_id:
+        whole_tools += analytics_tools(organization_id) + what_if_tools(organization_id) + forecast_tools(organization_id)
 
     core_agent = Agent(
         system_prompt=config.system_prompt,
@@ -1,4 +1,10 @@
-from pydantic_ai import Tool
+from pydantic_ai import ModelRetry, Tool
+from core.services.cee_catalog import get_cee_catalog
+from core.services.financial.forecast import forecast_organization
+
+# limiti per le richieste dell'agente: oltre questi valori la risposta non entra nel contesto o è troppo lenta
+_MAX_HORIZON_MONTHS = 36
+_MAX_PATHS = 10000
 
 
 def current_time() -> str:
@@ -12,4 +18,45 @@ def current_time() -> str:
     return datetime.now().strftime("%Y-%m-%d")
 
 
+def forecast_tools(organization_id: str) -> list[Tool]:
+    """Tool di previsione sul conto economico riclassificato dell'organizzazione dell'utente"""
+
+    async def income_statement_forecast(
+        horizon_months: int = 12,
+        cee_code: str | None = None,
+        history_years: int = 3,
+        paths: int = 5000,
+    ) -> dict:
+        """Forecast the reclassified income statement for the next months with Monte Carlo scenarios.
+
+        The baseline comes from Holt-Winters (or linear trend plus seasonality with less than two years
+        of history); P10/P50/P90 bands come from simulated scenarios. Amounts are debit - credit balances:
+        costs are positive, revenues negative. `result` is revenues minus costs for each month.
+
+        Args:
+            horizon_months (int): How many months to forecast after the last month with data (max 36)
+            cee_code (str | None): Only return this CEE line and the lines below it (e.g. "B.7")
+            history_years (int): How many years of history to use
+            paths (int): Number of Monte Carlo scenarios (max 10000)
+
+        Returns:
+            dict: periods, the lines with baseline and percentile bands, and the result bands
+        """
+        try:
+            forecast = await forecast_organization(
+                organization_id,
+                history_years=max(history_years, 1),
+                horizon=min(max(horizon_months, 1), _MAX_HORIZON_MONTHS),
+                paths=min(max(paths, 100), _MAX_PATHS),
+            )
+        except ValueError as e:
+            raise ModelRetry(str(e))
+
+        catalog = await get_cee_catalog()
+        cee_ids = {cee.id for cee in catalog.descendants(cee_code)} if cee_code else None
+        return forecast.to_dict(catalog, cee_ids)
+
+    return [Tool(income_statement_forecast)]
+
+
 custom_tools = [Tool(current_time)]
@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+import httpx
+from pydantic_ai import Agent
+from pydantic_ai.providers.openai import OpenAIProvider
+
+# agenti già costruiti restano validi finché non cambia il prompt: il TTL limita quanto a lungo
+# un agente può sopravvivere a modifiche che non passano dalla chiave (tool, impostazioni)
+AGENT_TTL_SECONDS = 900
+MAX_CACHED_AGENTS = 256
+# un provider per chiave di team: stesso limite degli agenti, che tengono il riferimento al proprio provider
+MAX_CACHED_PROVIDERS = MAX_CACHED_AGENTS
+
+# un solo pool di connessioni verso il modello, condiviso da tutti i provider e quindi da tutti gli agenti
+_http_client: httpx.AsyncClient | None = None
+_providers: OrderedDict[tuple[str, str], OpenAIProvider] = OrderedDict()
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(600, connect=5),
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+        )
+    return _http_client
+
+
+def get_openai_provider(team_key: str, base_url: str) -> OpenAIProvider:
+    """Provider per chiave di team, tutti sullo stesso client HTTP, in una cache LRU limitata"""
+    key = (team_key, base_url)
+    provider = _providers.get(key)
+    if provider is None:
+        provider = _providers[key] = OpenAIProvider(
+            api_key=team_key,
+            base_url=base_url,
+            http_client=get_http_client(),
+        )
+    _providers.move_to_end(key)
+    while len(_providers) > MAX_CACHED_PROVIDERS:
+        _providers.popitem(last=False)
+    return provider
+
+
+class AgentCache:
+    """Cache LRU con scadenza degli agenti costruiti, per chiave (tipo di agente, team, versione del prompt, ...)"""
+
+    def __init__(self, max_size: int = MAX_CACHED_AGENTS, ttl_seconds: float = AGENT_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._agents: OrderedDict[Hashable, tuple[Agent, float]] = OrderedDict()
+
+    def get_or_build(self, key: Hashable, build: Callable[[], Agent]) -> Agent:
+        cached = self._agents.get(key)
+        if cached and cached[1] > time.monotonic():
+            self._agents.move_to_end(key)
+            return cached[0]
+
+        agent = build()
+        self._agents[key] = (agent, time.monotonic() + self.ttl_seconds)
+        self._agents.move_to_end(key)
+        while len(self._agents) > self.max_size:
+            self._agents.popitem(last=False)
+        return agent
+
+    def clear(self):
+        self._agents.clear()
+
+
+agent_cache = AgentCache()
+
@@ -1,61 +1,84 @@
+import textwrap
 from typing import List
-from pydantic import BaseModel
-from pydantic_ai import Tool
-import requests
-from core.settings import settings
-
-
-# Define Pydantic models for the web search response
-class Profile(BaseModel):
-    name: str
-    url: str
-    long_name: str
-    img: str
+from pydantic_ai import ModelRetry, Tool
+from core.services.web_search import WebSearchError, web_search_client
+from core.services.financial.analytics_store import (
+    ANALYTICS_TABLES_DESCRIPTION,
+    AnalyticsQueryError,
+    analytics_store_available,
+    query_analytics,
+)
+from core.services.financial.what_if import run_what_if
+
+
+async def web_search(query: str) -> list[dict]:
+    """Search the web for relevant information to answer user questions
 
+    Args:
+        query (str): The search query
 
-class Result(BaseModel):
-    title: str
-    url: str
-    is_source_local: bool
-    is_source_both: bool
-    description: str
-    profile: Profile
+    Returns:
+        list[dict]: search results
+    """
+    try:
+        return await web_search_client.search(query)
+    except WebSearchError as e:
+        raise ModelRetry(str(e))
 
 
-class WebSearch(BaseModel):
-    type: str
-    results: List[Result]
+def analytics_tools(organization_id: str) -> List[Tool]:
+    """
+    Tool per interrogare in SQL lo store analitico DuckDB dell'organizzazione.
+    Vuoto se l'extra "analytics" non è installato.
+    """
+    if not analytics_store_available():
+        return []
 
+    async def analytics_query(sql: str) -> dict:
+        try:
+            return await query_analytics(organization_id, sql)
+        except AnalyticsQueryError as e:
+            raise ModelRetry(f"Query failed: {e}")
 
-class SearchResponse(BaseModel):
-    type: str
-    web: WebSearch
+    analytics_query.__doc__ = f"""Run a read-only DuckDB SQL query over the organization's accounting data,
+    for aggregations such as costs by CEE line by quarter over several years.
 
-
-def web_search(query: str) -> dict:
-    """Search the web for relevant information to answer user questions
+    Only a single SELECT statement is allowed. Available tables:
+{textwrap.indent(ANALYTICS_TABLES_DESCRIPTION, '    ')}
 
     Args:
-        query (str): The search query
+        sql (str): The SELECT query to run
 
     Returns:
-        str: search results
+        dict: columns, rows and whether the rows were truncated
     """
 
-    response: SearchResponse = requests.get(
-        "https://api.search.brave.com/res/v1/web/search",
-        headers={
-            "X-Subscription-Token": settings.requrv_brave_api_key,
-        },
-        params={
-            "q": query,
-            "count": 5,
-            "country": "it",
-            "search_lang": "it",
-        },
-    ).json()
-
-    return response.model_dump().get("web", {}).get("results", [])
+    return [Tool(analytics_query)]
+
+
+def what_if_tools(organization_id: str) -> List[Tool]:
+    """Tool per simulare scenari sul conto economico dell'organizzazione"""
+
+    async def what_if(year: int, cee_changes: dict[str, float] | None = None, account_changes: dict[str, float] | None = None) -> dict:
+        """Simulate a scenario on the income statement of a year and return the KPIs before and after.
+
+        Each call replaces the previous scenario: pass every change to keep, not only the new ones.
+        Changes are percentages, e.g. {"B.7": 10} raises services costs by 10%.
+
+        Args:
+            year (int): The year of the income statement the scenario starts from
+            cee_changes (dict[str, float] | None): Percentage change per CEE code, applied also to the lines below it
+            account_changes (dict[str, float] | None): Percentage change per chart account code
+
+        Returns:
+            dict: baseline, scenario and delta of each KPI and the CEE lines changed by this call
+        """
+        try:
+            return await run_what_if(organization_id, year, cee_changes, account_changes)
+        except ValueError as e:
+            raise ModelRetry(str(e))
+
+    return [Tool(what_if)]
 
 
 global_tools = [Tool(web_search)]
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from pydantic_ai.mcp import MCPServerStreamableHTTP
 from typing import List, Dict, Optional
 
@@ -19,6 +19,9 @@ class OutputConfig(BaseModel):
 
 
 class McpConfig(BaseModel):
+    # i server MCP sono oggetti di pydantic-ai, non modelli: vengono solo conservati, senza validazione
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     servers: List[MCPServerStreamableHTTP] = Field(
         ..., description="List of MCP servers for retrieval"
     )
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import aclosing
+from queue import Empty
+from fastapi import BackgroundTasks, HTTPException, UploadFile
+from core.services.prisma import prisma
+from prisma.enums import ImportJobPhase
+from core.services.frame_store import FrameWriter, local_frame_path, save_frame
+from .service import (
+    COMPARISON_FRAME_SCHEMA,
+    import_comparison_file,
+    iter_comparison_file_chunks,
+    parse_comparison_file_chunk,
+    prepare_comparison_file_upload,
+)
+
+# il parsing con pandas/openpyxl gira in processi separati così non blocca l'event loop dell'API
+_IMPORT_JOB_WORKERS = 2
+# blocchi già letti in attesa di essere scritti sul db: limita la memoria se il db è più lento del parsing
+_IMPORT_JOB_QUEUE_SIZE = 2
+# attesa massima di un blocco prima di controllare se il worker è ancora vivo
+_IMPORT_JOB_POLL_SECONDS = 1
+
+_process_pool: ProcessPoolExecutor | None = None
+_queue_manager = None
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=_IMPORT_JOB_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def _get_queue_manager():
+    global _queue_manager
+    if _queue_manager is None:
+        _queue_manager = multiprocessing.get_context("spawn").Manager()
+    return _queue_manager
+
+
+def shutdown_import_job_workers():
+    """Chiude il pool di processi e il manager delle code, da chiamare allo spegnimento dell'app"""
+    global _process_pool, _queue_manager
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+    if _queue_manager is not None:
+        _queue_manager.shutdown()
+        _queue_manager = None
+
+
+async def upload_comparison_file_job_service(
+    user_id: str,
+    year: int,
+    file: UploadFile,
+    background_tasks: BackgroundTasks,
+    reimport: bool = False,
+):
+    """
+    Salva il file di confronto e ne pianifica l'import in background.
+
+    Returns:
+        dict: l'id del job da interrogare con `get_import_job_service`
+    """
+    organization_id, media, already_imported = await prepare_comparison_file_upload(user_id, year, file, reimport)
+
+    if already_imported:
+        # file già importato: il job nasce completato e non c'è niente da processare
+        job = await prisma.incomestatementimportjob.create(
+            data={
+                "year": year,
+                "organizationId": organization_id,
+                "mediaId": media.id,
+                "phase": ImportJobPhase.COMPLETED,
+            }
+        )
+        return {"jobId": job.id, "phase": job.phase}
+
+    # l'UploadFile viene chiuso a fine richiesta, quindi il job lavora su una copia locale
+    with tempfile.NamedTemporaryFile(delete=False, prefix="requrv-import-") as local_file:
+        await file.seek(0)
+        shutil.copyfileobj(file.file, local_file)
+
+    try:
+        job = await prisma.incomestatementimportjob.create(
+            data={
+                "year": year,
+                "organizationId": organization_id,
+                "mediaId": media.id,
+            }
+        )
+    except Exception:
+        # senza job nessuno rimuoverebbe la copia locale
+        os.remove(local_file.name)
+        raise
+
+    background_tasks.add_task(
+        run_comparison_file_import_job,
+        job.id,
+        local_file.name,
+        file.content_type,
+    )
+
+    return {"jobId": job.id, "phase": job.phase}
+
+
+async def run_comparison_file_import_job(job_id: str, path: str, content_type: str):
+    """Esegue l'import di un job: parsing nel pool di processi, scrittura sul db nell'event loop"""
+
+    async def on_chunk_imported(rows_processed: int):
+        await prisma.incomestatementimportjob.update(
+            where={"id": job_id},
+            data={"phase": ImportJobPhase.WRITING, "rowsProcessed": rows_processed},
+        )
+
+    try:
+        job = await prisma.incomestatementimportjob.update(
+            where={"id": job_id},
+            data={"phase": ImportJobPhase.PARSING},
+            include={"media": True},
+        )
+        frame_path = local_frame_path(job.mediaId)
+        async with aclosing(_parse_in_worker(path, content_type, frame_path)) as parsed_chunks:
+            await import_comparison_file(
+                job.organizationId,
+                job.year,
+                job.mediaId,
+                parsed_chunks,
+                on_chunk_imported=on_chunk_imported,
+            )
+    except Exception as e:
+        logging.error("Error processing import job %s: %s", job_id, e)
+        await _set_job_phase(job_id, {"phase": ImportJobPhase.FAILED, "errors": {"push": [str(e)]}})
+    else:
+        # i dati sono già importati: se la copia Arrow non si carica l'errore resta nei log
+        await save_frame(job.media, frame_path)
+        await _set_job_phase(job_id, {"phase": ImportJobPhase.COMPLETED})
+    finally:
+        os.remove(path)
+
+
+async def _set_job_phase(job_id: str, data: dict):
+    # se il db non risponde l'errore resta nei log: il background task non ha nessuno a cui rilanciarlo
+    try:
+        await prisma.incomestatementimportjob.update(where={"id": job_id}, data=data)
+    except Exception as e:
+        logging.error("Error updating import job %s: %s", job_id, e)
+
+
+async def get_import_job_service(user_id: str, job_id: str):
+    user = await prisma.user.find_unique(where={"id": user_id}, include={"owner": True})
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    organization_id = user.organizationId if user.organizationId else user.owner.id if user.owner else None
+
+    job = await prisma.incomestatementimportjob.find_first(
+        where={"id": job_id, "organizationId": organization_id}
+    )
+
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+
+    return {
+        "id": job.id,
+        "year": job.year,
+        "phase": job.phase,
+        "rowsProcessed": job.rowsProcessed,
+        "errors": job.errors,
+        "mediaId": job.mediaId,
+        "createdAt": job.createdAt,
+        "updatedAt": job.updatedAt,
+    }
+
+
+async def _parse_in_worker(path: str, content_type: str, frame_path: str):
+    """
+    Legge e normalizza il file in un processo del pool, restituendo i blocchi man mano che sono pronti.
+
+    La coda è limitata, quindi il worker si ferma se la scrittura sul db resta indietro. Se l'import si
+    interrompe, ad esempio al primo errore di scrittura, il worker smette di leggere il file.
+    """
+    manager = _get_queue_manager()
+    queue = manager.Queue(maxsize=_IMPORT_JOB_QUEUE_SIZE)
+    stop = manager.Event()
+    future = asyncio.get_running_loop().run_in_executor(
+        _get_process_pool(), _parse_comparison_file_worker, path, content_type, frame_path, queue, stop
+    )
+
+    finished = False
+    try:
+        while True:
+            parsed_chunk = await _next_parsed_chunk(queue, future)
+            if parsed_chunk is None:
+                finished = True
+                break
+            yield parsed_chunk
+    finally:
+        if not finished:
+            # il worker controlla `stop` prima di ogni blocco; svuoto la coda finché non ha finito così non
+            # resta bloccato su un put, scartando al massimo i blocchi già letti
+            stop.set()
+            try:
+                while await _next_parsed_chunk(queue, future) is not None:
+                    pass
+            except Exception as e:
+                # l'errore che ha interrotto l'import è quello da riportare
+                logging.error("Error stopping import worker: %s", e)
+
+    # rilancia l'eventuale errore di parsing del worker
+    await future
+
+
+async def _next_parsed_chunk(queue, future: asyncio.Future):
+    """
+    Attende il prossimo blocco del worker, o None a fine file.
+
+    Raises:
+        Exception: l'errore del worker se è terminato senza inviare il marcatore di fine, ad esempio
+            perché il processo è stato ucciso (BrokenProcessPool)
+    """
+    while True:
+        try:
+            return await asyncio.to_thread(queue.get, True, _IMPORT_JOB_POLL_SECONDS)
+        except Empty:
+            if not future.done():
+                continue
+        # il marcatore può arrivare tra il timeout e il controllo di `future`
+        try:
+            return queue.get_nowait()
+        except Empty:
+            future.result()
+            raise RuntimeError("Import worker exited without finishing the file")
+
+
+def _parse_comparison_file_worker(path: str, content_type: str, frame_path: str, queue, stop):
+    try:
+        with open(path, "rb") as file_object, FrameWriter(frame_path, COMPARISON_FRAME_SCHEMA) as frame_writer:
+            for chunk in iter_comparison_file_chunks(file_object, content_type):
+                if stop.is_set():
+                    break
+                queue.put(parse_comparison_file_chunk(chunk, frame_writer))
+    finally:
+        queue.put(None)
@@ -1,9 +1,18 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Response, UploadFile, File, Depends, HTTPException, Query
 from authx import TokenPayload
 from core.settings import auth
 from core.services.prisma import prisma
 from prisma.models import User
-from .service import upload_comparison_file_service, get_chart_accounts_service
+from .service import (
+    upload_comparison_file_service,
+    get_chart_accounts_service,
+    get_reclassified_statement_service,
+    get_income_statement_kpis_service,
+    get_year_comparison_service,
+    get_cee_suggestions_service,
+)
+from .jobs import upload_comparison_file_job_service, get_import_job_service
+from .trial_balance import upload_trial_balance_service
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 income_statement_analyser_router = APIRouter(prefix="/income-statement-analyser", tags=["Income Statement Analyser Agent"])
@@ -12,13 +21,53 @@ auth_scheme = HTTPBearer()
 @income_statement_analyser_router.post("/upload-comparison-file")
 async def upload_comparison_file(
     year: int,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    run_in_background: bool = False,
+    reimport: bool = False,
     file: UploadFile = File(...),
     token: HTTPAuthorizationCredentials = Depends(auth_scheme),
     payload: TokenPayload = Depends(auth.access_token_required)
 ):
     user_id = payload.sub
+
+    if run_in_background:
+        response.status_code = 202
+        return await upload_comparison_file_job_service(
+            user_id=user_id, year=year, file=file, background_tasks=background_tasks, reimport=reimport
+        )
     
-    return await upload_comparison_file_service(user_id=user_id, year=year, file=file)
+    return await upload_comparison_file_service(user_id=user_id, year=year, file=file, reimport=reimport)
+
+
+@income_statement_analyser_router.post("/upload-trial-balance")
+async def upload_trial_balance(
+    year: int,
+    month: int,
+    is_previous_year: bool = False,
+    file: UploadFile = File(...),
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)
+):
+    if month < 1 or month > 12:
+        raise HTTPException(status_code=400, detail="Month must be between 1 and 12")
+
+    user_id = payload.sub
+
+    return await upload_trial_balance_service(
+        user_id=user_id, year=year, month=month, file=file, is_previous_year=is_previous_year
+    )
+
+
+@income_statement_analyser_router.get("/jobs/{job_id}")
+async def get_import_job(
+    job_id: str,
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)
+):
+    user_id = payload.sub
+
+    return await get_import_job_service(user_id, job_id)
 
 
 
@@ -27,6 +76,7 @@ async def get_chart_accounts(
     take: int,
     number_page: int,
     include_cee: bool = False,
+    cursor: str | None = None,
     token: HTTPAuthorizationCredentials = Depends(auth_scheme),
     payload: TokenPayload = Depends(auth.access_token_required)
 ):
@@ -37,4 +87,51 @@ async def get_chart_accounts(
     
     user_id = payload.sub
 
-    return await get_chart_accounts_service(user_id, take, number_page, include_cee)
\ No newline at end of file
+    return await get_chart_accounts_service(user_id, take, number_page, include_cee, cursor)
+
+
+@income_statement_analyser_router.get("/reclassified-statement")
+async def get_reclassified_statement(
+    year: int,
+    month: int | None = None,
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)
+):
+    user_id = payload.sub
+
+    return await get_reclassified_statement_service(user_id, year, month)
+
+
+@income_statement_analyser_router.get("/kpis")
+async def get_income_statement_kpis(
+    year: int,
+    month: int | None = None,
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)
+):
+    user_id = payload.sub
+
+    return await get_income_statement_kpis_service(user_id, year, month)
+
+
+@income_statement_analyser_router.get("/year-comparison")
+async def get_year_comparison(
+    years: list[int] | None = Query(None),
+    include_accounts: bool = False,
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)
+):
+    user_id = payload.sub
+
+    return await get_year_comparison_service(user_id, years, include_accounts)
+
+
+@income_statement_analyser_router.get("/cee-suggestions")
+async def get_cee_suggestions(
+    top_k: int = Query(3, ge=1, le=20),
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)
+):
+    user_id = payload.sub
+
+    return await get_cee_suggestions_service(user_id, top_k)
@@ -1,17 +1,18 @@
-from langfuse import Langfuse
-from core.agents.core.config import AgentConfig, OutputConfig, SystemPrompt
+import time
+from core.agents.incomeStatementAnalyser.config import AgentConfig, OutputConfig, SystemPrompt
 from pydantic_ai import Agent
 from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
-from settings import settings
+from core.settings import settings
 from core.services.prisma import prisma
-from agents.core.tools import custom_tools
+from core.agents.factory import agent_cache, get_openai_provider
+from core.services.prompts import prompt_registry
+from core.agents.core.tools import custom_tools
+from core.agents.incomeStatementAnalyser.tools import income_statement_kpi_tools
+from core.agents.generic_tools.tools import analytics_tools
 
-lang_client = Langfuse(
-    host=settings.model_dump()["requrv_langfuse_host"],
-    public_key=settings.model_dump()["requrv_langfuse_public_key"],
-    secret_key=settings.model_dump()["requrv_langfuse_secret_key"],
-)
+# team key e organizzazione dell'utente: cambiano di rado, evitano una query a ogni avvio dell'agente
+_USER_TEAM_TTL_SECONDS = 300
+_user_team_cache: dict[str, tuple[str, str | None, float]] = {}
 
 
 async def agent_startup(user_id: str) -> Agent:
@@ -28,6 +29,21 @@ async def agent_startup(user_id: str) -> Agent:
         Agent: The core agent instance
     """
 
+    team_key, organization_id = await _get_user_team(user_id)
+
+    prompt = await prompt_registry.get("requrv-hub-core", organization_id)
+    # l'agente viene ricostruito solo se cambia la versione del prompt o alla scadenza della cache
+    return agent_cache.get_or_build(
+        ("incomeStatementAnalyser", team_key, organization_id, prompt.version),
+        lambda: _build_agent(team_key, organization_id, prompt.text),
+    )
+
+
+async def _get_user_team(user_id: str) -> tuple[str, str | None]:
+    cached = _user_team_cache.get(user_id)
+    if cached and cached[2] > time.monotonic():
+        return cached[0], cached[1]
+
     actual_user = await prisma.user.find_unique(
         where={"id": user_id}, include={"organization": True}
     )
@@ -39,9 +55,14 @@ async def agent_startup(user_id: str) -> Agent:
     if not team_key:
         raise ValueError("Team key not found")
 
+    _user_team_cache[user_id] = (team_key, actual_user.organizationId, time.monotonic() + _USER_TEAM_TTL_SECONDS)
+    return team_key, actual_user.organizationId
+
+
+def _build_agent(team_key: str, organization_id: str | None, system_prompt: str) -> Agent:
     config = AgentConfig(
         system_prompt=SystemPrompt(
-            prompt=lang_client.get_prompt("requrv-hub-core").compile()
+            prompt=system_prompt
         ),
         output_config=OutputConfig(format="text", json_schema=None),
         qdrant_resources=[],
@@ -49,10 +70,7 @@ async def agent_startup(user_id: str) -> Agent:
 
     llm_model = OpenAIModel(
         model_name="requrv-ai",
-        provider=OpenAIProvider(
-            api_key=team_key,
-            base_url=settings.requrv_hive_endpoint,
-        ),
+        provider=get_openai_provider(team_key, settings.requrv_hive_endpoint),
     )
 
     core_agent = Agent(
@@ -68,7 +86,12 @@ async def agent_startup(user_id: str) -> Agent:
                 else {}
             ),
         },  # Recommended settings https://huggingface.co/Qwen/Qwen3-30B-A3B-Instruct-2507-FP8#best-practices
-        tools=custom_tools,
+        tools=custom_tools
+        + (
+            income_statement_kpi_tools(organization_id) + analytics_tools(organization_id)
+            if organization_id
+            else []
+        ),
         toolsets=(
             config.mcp_config.servers if config.mcp_config else []
         ),  # add toolsets if needed - MCP
@@ -1,18 +1,69 @@
+import base64
+import itertools
 import logging
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import aclosing
+from datetime import datetime, timedelta
+from typing import BinaryIO
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
 from authx import TokenPayload
 from core.settings import auth
 from core.services.prisma import prisma
-from prisma.models import User, Organization 
+from prisma.models import User, Organization, ChartAccount, IncomeStatementConversionTable
 from prisma.enums import AccountType, TypeChartAccount
-from core.modules.media.service import upload_file_to_s3
+from core.modules.media.service import compute_file_sha256, upload_file_to_s3
+from core.services.cee_catalog import get_cee_catalog, invalidate_cee_catalog
+from core.services.cee_suggestions import get_cee_suggestion_index
+from core.services.frame_store import FrameWriter, local_frame_path, save_frame
+from core.services.financial.reclassification import get_reclassified_statement
+from core.services.financial.kpis import get_income_statement_kpis, invalidate_income_statement_kpis
+from core.services.financial.comparison import compare_years
+from core.services.financial.budget import invalidate_budget_variance
+from core.services.financial.what_if import invalidate_what_if_models
+from core.services.response_cache import invalidate_organization_responses
+import openpyxl
 import pandas
+import pyarrow
 
 async def upload_comparison_file_service(
     user_id: str,
     year: int,
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    reimport: bool = False
 ):
+    organization_id, media, already_imported = await prepare_comparison_file_upload(user_id, year, file, reimport)
+
+    if already_imported:
+        return {
+            "message": "File already imported",
+            "incomeStatementConversionTableId": already_imported.id
+        }
+
+    frame_path = local_frame_path(media.id)
+    try: 
+        async with aclosing(_parse_comparison_file_chunks(file.file, file.content_type, frame_path)) as parsed_chunks:
+            await import_comparison_file(organization_id, year, media.id, parsed_chunks)
+    except Exception as e:
+        logging.error("Error uploading or processing file: %s", e)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    # i dati sono già importati: se la copia Arrow non si carica l'errore resta nei log
+    await save_frame(media, frame_path)
+   
+    return {"message": "File uploaded and processed successfully"}
+
+
+async def prepare_comparison_file_upload(user_id: str, year: int, file: UploadFile, reimport: bool = False):
+    """
+    Controlla che l'utente possa caricare il file di confronto e lo salva sul bucket.
+
+    Con `reimport` il file può sostituire una tabella di conversione già esistente. Se lo stesso file
+    (stesso SHA-256) è già stato importato per l'anno indicato non viene caricato né riprocessato.
+
+    Returns:
+        tuple[str, Media, IncomeStatementConversionTable | None]: l'id dell'organizzazione, il media
+        del file e, se il file era già stato importato, la tabella di conversione esistente
+    """
     user: User = await prisma.user.find_unique(where={"id": user_id}, include={"owner": True})
 
     if not user:
@@ -24,137 +75,178 @@ async def upload_comparison_file_service(
     if not organizationId:
         raise HTTPException(status_code=404, detail="Organization not found")
     
+    if file.content_type not in _SUPPORTED_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}")
+
+    sha256 = await compute_file_sha256(file)
+
+    # stesso file già importato per lo stesso anno: riuso media e tabella di conversione esistenti
+    already_imported = await prisma.incomestatementconversiontable.find_first(
+        where={
+            "organizationId": organizationId.id,
+            "years": {"has": year},
+            "media": {"is": {"sha256": sha256}}
+        },
+        include={"media": True}
+    )
+    if already_imported:
+        return organizationId.id, already_imported.media, already_imported
+
     # Questa parte serve per avere un solo file ma con delle piccole modifiche si potrebbe permettere di avere più file, ma come stabilito ora si usa soltanto uno
-    if organizationId.incomeStatementConversionTable:
+    if organizationId.incomeStatementConversionTable and not reimport:
         raise HTTPException(status_code=400, detail=f"Income Statement Conversion Table already exists")
 
     try:
-        media = await upload_file_to_s3(file, who_uploaded_it_user_id=user.id)
+        media = await upload_file_to_s3(file, who_uploaded_it_user_id=user.id, sha256=sha256)
     except Exception as e:
         logging.error("Error uploading file to S3: %s", e)
         raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
-    
-        
-    if file.content_type == "text/csv":
-        df = pandas.read_csv(file.file)
-    elif file.content_type in ["application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "application/vnd.ms-excel"]:
-        df = pandas.read_excel(file.file)
-
-    chart_accounts_cee_to_create: set = []
-    chart_accounts_to_create = []   
-    
-    for index, row in df.iterrows():
-        chart_account_code = str(row.get("Conto")).strip() if row.get("Conto") else None
-        chart_account_description = str(row.get("Descrizione Conto")).strip() if row.get("Descrizione Conto") else None
-        chart_account_type = str(row.get("Tipo")).strip().upper() if row.get("Tipo") else None
-        chart_account_account_type = str(row.get("Valorizzazione")).strip().upper() if row.get("Valorizzazione") else None
-        chart_account_code_debit_cee = str(row.get("DARE Voce")).strip() if row.get("DARE Voce") else None
-        chart_account_description_debit_cee = str(row.get("Descrizione_DARE")).strip() if row.get("Descrizione_DARE") else None
-        chart_account_code_credit_cee = str(row.get("AVERE Voce")).strip() if row.get("AVERE Voce") else None
-        chart_account_description_credit_cee = str(row.get("Descrizione_AVERE")).strip() if row.get("Descrizione_AVERE") else None
- 
-        
-        if chart_account_code_debit_cee not in [item["code"] for item in chart_accounts_cee_to_create]:
-            chart_accounts_cee_to_create.append({
-                "code": chart_account_code_debit_cee,
-                "description": chart_account_description_debit_cee
-            })
-        if chart_account_code_credit_cee not in [item["code"] for item in chart_accounts_cee_to_create]:
-            chart_accounts_cee_to_create.append({
-                "code": chart_account_code_credit_cee,
-                "description": chart_account_description_credit_cee
-            })
-        
-        if chart_account_code not in [item["code"] for item in chart_accounts_to_create]:
-            mapped_type = _map_chart_account_type(chart_account_account_type)
-            mapped_account_type = _map_account_type(chart_account_type)
-
-            if (not chart_account_code_debit_cee and not chart_account_code_credit_cee ) or ( chart_account_code_debit_cee == "nan" and chart_account_code_credit_cee == "nan"):
-                chart_accounts_to_create.append({
-                    "code": chart_account_code,
-                    "description": chart_account_description,
-                    "type": mapped_type,
-                    "accountType": mapped_account_type,
-                    "toConsider": False,  # Impostato a False quando non ci sono codici CEE
-                    "chart_account_code_debit_cee": None,
-                    "chart_account_code_credit_cee": None
-                })
-            else: 
-                chart_accounts_to_create.append({
-                    "code": chart_account_code,
-                    "description": chart_account_description,
-                    "type": mapped_type,
-                    "accountType": mapped_account_type,
-                    "toConsider": True,
-                    "chart_account_code_debit_cee": chart_account_code_debit_cee,
-                    "chart_account_code_credit_cee": chart_account_code_credit_cee
-                })
 
-    
-    try: 
-        async with prisma.tx() as transaction:
-            incomeStatementConversionTable = await transaction.incomestatementconversiontable.create(
-                data={
-                    "years": [year],
-                    "organizationId": user.organizationId if user.organizationId else user.owner.id,
-                    "mediaId": media.id,
-                }
-            )
+    return organizationId.id, media, None
 
-            # qui cerco i chart account cee che esistono già e li toglio da quelli da creare
-            existing_chart_accounts_cee = await transaction.chartaccountcee.find_many(
-                where={
-                    "OR": [
-                        {"code": {"in": [item["code"] for item in chart_accounts_cee_to_create]}}
-                    ]
-                }
-            )
-            chart_accounts_cee_to_create = [item for item in chart_accounts_cee_to_create if item["code"] not in [cee.code for cee in existing_chart_accounts_cee]]
 
-            await transaction.chartaccountcee.create_many(
-                data=chart_accounts_cee_to_create,
-                skip_duplicates=True
+async def import_comparison_file(
+    organization_id: str,
+    year: int,
+    media_id: str,
+    parsed_chunks: AsyncIterator[tuple],
+    on_chunk_imported: Callable[[int], Awaitable[None]] | None = None,
+):
+    """
+    Crea la tabella di conversione e scrive i conti blocco per blocco in un'unica transazione.
+
+    Se l'organizzazione ha già una tabella di conversione il file viene reimportato in modo
+    incrementale con `reimport_comparison_file`.
+
+    Args:
+        parsed_chunks: blocchi `(cee, chart_accounts, rows)` prodotti da `parse_comparison_file_chunk`
+        on_chunk_imported: chiamata dopo ogni blocco con il totale delle righe lette fino a quel momento
+    """
+    existing_conversion_table = await prisma.incomestatementconversiontable.find_first(
+        where={"organizationId": organization_id}
+    )
+    if existing_conversion_table:
+        return await reimport_comparison_file(
+            existing_conversion_table, year, media_id, parsed_chunks, on_chunk_imported
+        )
+
+    async with prisma.tx(timeout=_IMPORT_TRANSACTION_TIMEOUT) as transaction:
+        incomeStatementConversionTable = await transaction.incomestatementconversiontable.create(
+            data={
+                "years": [year],
+                "organizationId": organization_id,
+                "mediaId": media_id,
+            }
+        )
+
+        # il file viene letto a blocchi: in memoria c'è solo il blocco corrente più le mappe dei codici già importati
+        imported_codes = set()
+        cee_id_by_code = {}
+        cee_created = False
+        rows_processed = 0
+        async for chart_accounts_cee_to_create, chart_accounts_to_create, rows in parsed_chunks:
+            cee_created |= await _import_chart_accounts_batch(
+                transaction,
+                incomeStatementConversionTable.id,
+                chart_accounts_cee_to_create,
+                chart_accounts_to_create,
+                imported_codes,
+                cee_id_by_code,
             )
+            rows_processed += rows
+            if on_chunk_imported:
+                await on_chunk_imported(rows_processed)
 
-            chart_accounts_cee_created = await transaction.chartaccountcee.find_many(
-                where={
-                    "OR": [
-                        {"code": {"in": [item["code"] for item in chart_accounts_cee_to_create]}}
-                    ]
-                }
+    if cee_created:
+        invalidate_cee_catalog()
+    invalidate_chart_accounts_total(incomeStatementConversionTable.organizationId)
+    # con la prima tabella di conversione i valori già caricati vengono riclassificati: le risposte salvate non valgono più
+    invalidate_organization_responses(incomeStatementConversionTable.organizationId)
+
+    return incomeStatementConversionTable
+
+
+async def reimport_comparison_file(
+    conversion_table: IncomeStatementConversionTable,
+    year: int,
+    media_id: str,
+    parsed_chunks: AsyncIterator[tuple],
+    on_chunk_imported: Callable[[int], Awaitable[None]] | None = None,
+):
+    """
+    Aggiorna una tabella di conversione esistente confrontando il nuovo file con i conti salvati per `code`.
+
+    Vengono scritte solo le differenze: conti nuovi, conti modificati e conti non più presenti nel file,
+    che vengono eliminati logicamente impostando `deletedAt`. L'anno viene aggiunto a `years`.
+    """
+    async with prisma.tx(timeout=_IMPORT_TRANSACTION_TIMEOUT) as transaction:
+        existing_chart_accounts = await transaction.chartaccount.find_many(
+            where={"incomeStatementConversionTableId": conversion_table.id}
+        )
+        existing_by_code = {chart_account.code: chart_account for chart_account in existing_chart_accounts}
+
+        imported_codes = set()
+        cee_id_by_code = {}
+        cee_created = False
+        rows_processed = 0
+        async for chart_accounts_cee_to_create, chart_accounts_to_import, rows in parsed_chunks:
+            cee_created |= await _reimport_chart_accounts_batch(
+                transaction,
+                conversion_table.id,
+                chart_accounts_cee_to_create,
+                chart_accounts_to_import,
+                imported_codes,
+                cee_id_by_code,
+                existing_by_code,
             )
+            rows_processed += rows
+            if on_chunk_imported:
+                await on_chunk_imported(rows_processed)
 
-        
-
-            await transaction.chartaccount.create_many(
-                data=[
-                    {
-                        "code": item["code"],
-                        "description": item["description"],
-                        "type": item["type"],
-                        "accountType": item["accountType"],
-                        "toConsider": item["toConsider"],
-                        "incomeStatementConversionTableId": incomeStatementConversionTable.id,
-                        "chartAccountCEEdebitId": next((cee.id for cee in chart_accounts_cee_created if cee.code == item["chart_account_code_debit_cee"]), None),
-                        "chartAccountCEEcreditId": next((cee.id for cee in chart_accounts_cee_created if cee.code == item["chart_account_code_credit_cee"]), None)
-                    }
-                    for item in chart_accounts_to_create
-                ],
-                skip_duplicates=True
+        removed_ids = [
+            chart_account.id
+            for code, chart_account in existing_by_code.items()
+            if code not in imported_codes and not chart_account.deletedAt
+        ]
+        if removed_ids:
+            await transaction.chartaccount.update_many(
+                where={"id": {"in": removed_ids}},
+                data={"deletedAt": datetime.now()}
             )
 
-    except Exception as e:
-        logging.error("Error uploading or processing file: %s", e)
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-   
-    return {"message": "File uploaded and processed successfully"}
+        incomeStatementConversionTable = await transaction.incomestatementconversiontable.update(
+            where={"id": conversion_table.id},
+            data={
+                "years": sorted(set(conversion_table.years) | {year}),
+                "mediaId": media_id,
+            }
+        )
+
+    if cee_created:
+        invalidate_cee_catalog()
+    invalidate_chart_accounts_total(incomeStatementConversionTable.organizationId)
+    # i conti possono essere collegati a voci CEE diverse: i KPI salvati non sono più validi
+    await invalidate_income_statement_kpis(incomeStatementConversionTable.organizationId)
+    invalidate_budget_variance(incomeStatementConversionTable.organizationId)
+    invalidate_what_if_models(incomeStatementConversionTable.organizationId)
+    invalidate_organization_responses(incomeStatementConversionTable.organizationId)
+
+    return incomeStatementConversionTable
+
     
 async def get_chart_accounts_service(
     user_id: str,
     take: int, 
     number_page: int,
-    include_cee: bool = False
+    include_cee: bool = False,
+    cursor: str | None = None
 ):
+    """
+    Restituisce una pagina dei conti da considerare dell'organizzazione.
+
+    Con `cursor` (il `nextCursor` della pagina precedente) la paginazione è keyset su (createdAt, id)
+    e `number_page` viene ignorato, così anche le pagine profonde costano come la prima.
+    """
     
     if number_page < 1:
         raise HTTPException(status_code=400, detail="Number Page must be greater than 0")
@@ -172,66 +264,504 @@ async def get_chart_accounts_service(
     if not organizationId:
         raise HTTPException(status_code=404, detail="Organization not found")
     
+    where = {
+        "incomeStatementConversionTable": {
+            "organizationId": organizationId
+        },
+        "toConsider": True,
+        "deletedAt": None
+    }
 
-    total_count = await prisma.chartaccount.count(
-        where={
-            "incomeStatementConversionTable": {
-                "organizationId": organizationId
-            }
-        }
-    )
+    total_count = _get_cached_chart_accounts_total(organizationId)
+    if total_count is None:
+        total_count = await prisma.chartaccount.count(where=where)
+        _chart_accounts_total_cache[organizationId] = (total_count, time.monotonic() + _CHART_ACCOUNTS_TOTAL_TTL_SECONDS)
 
-    chart_accounts = await prisma.chartaccount.find_many(
-        where={
-            "incomeStatementConversionTable": {
-                "organizationId": organizationId
+    if cursor:
+        cursor_created_at, cursor_id = _decode_chart_accounts_cursor(cursor)
+        chart_accounts = await prisma.chartaccount.find_many(
+            where={
+                **where,
+                "OR": [
+                    {"createdAt": {"lt": cursor_created_at}},
+                    {"createdAt": cursor_created_at, "id": {"lt": cursor_id}}
+                ]
             },
-            "toConsider": True
-        },
-        include=
-        {
-            "chartAccountCEEdebit": include_cee,
-            "chartAccountCEEcredit": include_cee
-        },
-        skip=(number_page - 1) * take,
-        take=take,
-        order={
-            "createdAt": "desc"
-        }
-    )
+            take=take,
+            order=[{"createdAt": "desc"}, {"id": "desc"}]
+        )
+    else:
+        chart_accounts = await prisma.chartaccount.find_many(
+            where=where,
+            skip=(number_page - 1) * take,
+            take=take,
+            order=[{"createdAt": "desc"}, {"id": "desc"}]
+        )
+
+    if include_cee:
+        await _attach_chart_accounts_cee(chart_accounts)
 
     return {
         "data": chart_accounts,
-        "total": total_count
+        "total": total_count,
+        "nextCursor": _encode_chart_accounts_cursor(chart_accounts[-1]) if len(chart_accounts) == take and take > 0 else None
     }
 
 
-def _map_chart_account_type(chart_account_type):
+async def get_reclassified_statement_service(user_id: str, year: int, month: int | None = None):
+    if month is not None and not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="Month must be between 1 and 12")
+
+    user: User = await prisma.user.find_unique(where={"id": user_id}, include={"owner": True})
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    organizationId: str = user.organizationId if user.organizationId else user.owner.id if user.owner else None
+
+    if not organizationId:
+        raise HTTPException(status_code=404, detail="Organization not found")
+
+    statement = await get_reclassified_statement(organizationId, year, month)
+
+    return await statement.to_dict()
+
+
+async def get_income_statement_kpis_service(user_id: str, year: int, month: int | None = None):
+    if month is not None and not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="Month must be between 1 and 12")
+
+    user: User = await prisma.user.find_unique(where={"id": user_id}, include={"owner": True})
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    organizationId: str = user.organizationId if user.organizationId else user.owner.id if user.owner else None
+
+    if not organizationId:
+        raise HTTPException(status_code=404, detail="Organization not found")
+
+    return await get_income_statement_kpis(organizationId, year, month)
+
+
+async def get_year_comparison_service(user_id: str, years: list[int] | None = None, include_accounts: bool = False):
+    """
+    Confronto anno su anno. Senza `years` vengono confrontati gli anni della tabella di conversione.
+    """
+    user: User = await prisma.user.find_unique(where={"id": user_id}, include={"owner": True})
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    organizationId: str = user.organizationId if user.organizationId else user.owner.id if user.owner else None
+
+    if not organizationId:
+        raise HTTPException(status_code=404, detail="Organization not found")
+
+    if not years:
+        conversion_table = await prisma.incomestatementconversiontable.find_first(
+            where={"organizationId": organizationId}
+        )
+        years = conversion_table.years if conversion_table else []
+
+    years = sorted(set(years))
+    if len(years) < 2:
+        raise HTTPException(status_code=400, detail="At least two years are required for the comparison")
+
+    return await compare_years(organizationId, years, include_accounts)
+
+
+# conti importati senza codici CEE di DARE/AVERE, che restano fuori dal riclassificato
+_UNMAPPED_CHART_ACCOUNTS_QUERY = """
+SELECT a."id" AS "id", a."code" AS "code", a."description" AS "description"
+FROM "ChartAccount" a
+JOIN "IncomeStatementConversionTable" t ON t."id" = a."incomeStatementConversionTableId"
+WHERE t."organizationId" = $1::uuid
+  AND a."toConsider" = false
+  AND a."deletedAt" IS NULL
+  AND a."chartAccountCEEdebitId" IS NULL
+  AND a."chartAccountCEEcreditId" IS NULL
+ORDER BY a."code"
+"""
+
+
+async def get_cee_suggestions_service(user_id: str, top_k: int = 3):
     """
-    Mappa il tipo di conto dal file xlsx all'enum TypeChartAccount di Prisma
+    Voci CEE candidate per i conti senza mappatura, per similarità delle descrizioni.
     """
-    if not chart_account_type or chart_account_type == "nan":
-        print("Chart account type is None or nan")
+    user: User = await prisma.user.find_unique(where={"id": user_id}, include={"owner": True})
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    organizationId: str = user.organizationId if user.organizationId else user.owner.id if user.owner else None
+
+    if not organizationId:
+        raise HTTPException(status_code=404, detail="Organization not found")
+
+    accounts = await prisma.query_raw(_UNMAPPED_CHART_ACCOUNTS_QUERY, organizationId)
+    index = await get_cee_suggestion_index()
+    suggestions = index.suggest([account["description"] or "" for account in accounts], top_k)
+
+    return [
+        {
+            "chartAccountId": account["id"],
+            "code": account["code"],
+            "description": account["description"],
+            "suggestions": [
+                {
+                    "ceeId": cee_id,
+                    "code": index.catalog.by_id[cee_id].code,
+                    "description": index.catalog.by_id[cee_id].description,
+                    "score": round(score, 4),
+                }
+                for cee_id, score in account_suggestions
+            ],
+        }
+        for account, account_suggestions in zip(accounts, suggestions)
+    ]
+
+
+# totale dei conti per organizzazione: viene invalidato a ogni import, il TTL copre gli import fatti da altri processi
+_CHART_ACCOUNTS_TOTAL_TTL_SECONDS = 300
+_chart_accounts_total_cache: dict[str, tuple[int, float]] = {}
+
+
+def _get_cached_chart_accounts_total(organization_id: str) -> int | None:
+    cached = _chart_accounts_total_cache.get(organization_id)
+    if not cached or cached[1] < time.monotonic():
         return None
-    mapping = {
-        "ATTIVO": TypeChartAccount.ACTIVE,
-        "PASSIVO": TypeChartAccount.PASSIVE,
-        "ATTIVO/PASSIVO": TypeChartAccount.ACTIVE_PASSIVE,
-        "RICAVI": TypeChartAccount.REVENUE,
-        "COSTI": TypeChartAccount.COST
+    return cached[0]
+
+
+def invalidate_chart_accounts_total(organization_id: str):
+    _chart_accounts_total_cache.pop(organization_id, None)
+
+
+def _encode_chart_accounts_cursor(chart_account: ChartAccount) -> str:
+    value = f"{chart_account.createdAt.isoformat()}|{chart_account.id}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def _decode_chart_accounts_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        created_at, chart_account_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), chart_account_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _import_chart_accounts_batch(
+    transaction,
+    conversion_table_id: str,
+    chart_accounts_cee_to_create: list,
+    chart_accounts_to_create: list,
+    imported_codes: set,
+    cee_id_by_code: dict,
+):
+    """
+    Scrive un blocco del file di confronto: crea i CEE mancanti e i conti non ancora importati.
+
+    `imported_codes` e `cee_id_by_code` vengono aggiornati e condivisi tra i blocchi, così i duplicati
+    tra blocchi diversi vengono scartati e ogni CEE viene cercato una sola volta.
+    """
+    cee_created = await _resolve_chart_accounts_cee(transaction, chart_accounts_cee_to_create, cee_id_by_code)
+
+    chart_accounts_to_create = [item for item in chart_accounts_to_create if item["code"] not in imported_codes]
+    if not chart_accounts_to_create:
+        return cee_created
+
+    await transaction.chartaccount.create_many(
+        data=[
+            {
+                **_chart_account_data(item, cee_id_by_code),
+                "code": item["code"],
+                "incomeStatementConversionTableId": conversion_table_id,
+            }
+            for item in chart_accounts_to_create
+        ],
+        skip_duplicates=True
+    )
+    imported_codes.update(item["code"] for item in chart_accounts_to_create)
+
+    return cee_created
+
+
+async def _reimport_chart_accounts_batch(
+    transaction,
+    conversion_table_id: str,
+    chart_accounts_cee_to_create: list,
+    chart_accounts_to_import: list,
+    imported_codes: set,
+    cee_id_by_code: dict,
+    existing_by_code: dict,
+):
+    """
+    Confronta un blocco del file con i conti già salvati e scrive solo le differenze.
+
+    I conti nuovi vengono creati, quelli cambiati (o eliminati in precedenza) aggiornati, quelli
+    identici ignorati. Gli id non cambiano, quindi i ValuesCostsRevenues collegati restano validi.
+    """
+    cee_created = await _resolve_chart_accounts_cee(transaction, chart_accounts_cee_to_create, cee_id_by_code)
+
+    chart_accounts_to_create = []
+    for item in chart_accounts_to_import:
+        if item["code"] in imported_codes:
+            continue
+        imported_codes.add(item["code"])
+
+        data = _chart_account_data(item, cee_id_by_code)
+        existing = existing_by_code.get(item["code"])
+        if not existing:
+            chart_accounts_to_create.append({
+                **data,
+                "code": item["code"],
+                "incomeStatementConversionTableId": conversion_table_id,
+            })
+        elif existing.deletedAt or any(getattr(existing, field) != value for field, value in data.items()):
+            await transaction.chartaccount.update(
+                where={"id": existing.id},
+                data={**data, "deletedAt": None}
+            )
+
+    if chart_accounts_to_create:
+        await transaction.chartaccount.create_many(
+            data=chart_accounts_to_create,
+            skip_duplicates=True
+        )
+
+    return cee_created
+
+
+async def _resolve_chart_accounts_cee(transaction, chart_accounts_cee_to_create: list, cee_id_by_code: dict) -> bool:
+    """
+    Crea i CEE non ancora presenti e aggiunge a `cee_id_by_code` gli id dei codici del blocco.
+
+    I codici vengono risolti prima sul catalogo in memoria, il db viene interrogato solo per quelli mancanti.
+
+    Returns:
+        bool: True se sono stati creati nuovi CEE e quindi il catalogo va invalidato
+    """
+    catalog = await get_cee_catalog()
+    chart_accounts_cee_to_create = [item for item in chart_accounts_cee_to_create if item["code"] not in cee_id_by_code]
+    cee_id_by_code.update({
+        item["code"]: catalog.by_code[item["code"]].id
+        for item in chart_accounts_cee_to_create
+        if item["code"] in catalog.by_code
+    })
+
+    # qui cerco i chart account cee che esistono già e li toglio da quelli da creare
+    chart_accounts_cee_to_create = [item for item in chart_accounts_cee_to_create if item["code"] not in catalog.by_code]
+    cee_codes = [item["code"] for item in chart_accounts_cee_to_create]
+    if not cee_codes:
+        return False
+
+    existing_chart_accounts_cee = await transaction.chartaccountcee.find_many(
+        where={"code": {"in": cee_codes}}
+    )
+    existing_cee_codes = {cee.code for cee in existing_chart_accounts_cee}
+    chart_accounts_cee_to_create = [item for item in chart_accounts_cee_to_create if item["code"] not in existing_cee_codes]
+
+    if chart_accounts_cee_to_create:
+        await transaction.chartaccountcee.create_many(
+            data=chart_accounts_cee_to_create,
+            skip_duplicates=True
+        )
+
+    # mappa code -> id per tutti i CEE (esistenti e appena creati), così la risoluzione è O(1)
+    chart_accounts_cee = await transaction.chartaccountcee.find_many(
+        where={"code": {"in": cee_codes}}
+    )
+    cee_id_by_code.update({cee.code: cee.id for cee in chart_accounts_cee})
+
+    return bool(chart_accounts_cee_to_create)
+
+
+def _chart_account_data(item: dict, cee_id_by_code: dict) -> dict:
+    """
+    Campi di un ChartAccount che dipendono dal file di confronto (escluso il code)
+    """
+    return {
+        "description": item["description"],
+        "type": item["type"],
+        "accountType": item["accountType"],
+        "toConsider": item["toConsider"],
+        "chartAccountCEEdebitId": cee_id_by_code.get(item["chart_account_code_debit_cee"]),
+        "chartAccountCEEcreditId": cee_id_by_code.get(item["chart_account_code_credit_cee"])
     }
-    return mapping.get(chart_account_type)
 
-def _map_account_type(chart_account_account_type):
+
+async def _attach_chart_accounts_cee(chart_accounts: list):
     """
-    Mappa il tipo di account dal file xlsx all'enum AccountType di Prisma
+    Valorizza i CEE di DARE e AVERE dei conti leggendoli dal catalogo in memoria invece che con una join
     """
-    if not chart_account_account_type or chart_account_account_type == "nan":
-        print("Account type is None or nan")
-        return None
-    mapping = {
-        "STATO PATRIMONIALE": AccountType.BALANCE_SHEET,
-        "CONTO ECONOMICO": AccountType.INCOME_STATEMENT, 
-        "CONTI D'ORDINE": AccountType.MEMORANDUM_ACCOUNT
+    catalog = await get_cee_catalog()
+    cee_ids = {
+        cee_id
+        for chart_account in chart_accounts
+        for cee_id in (chart_account.chartAccountCEEdebitId, chart_account.chartAccountCEEcreditId)
+        if cee_id
     }
-    return mapping.get(chart_account_account_type) 
\ No newline at end of file
+    # un CEE creato da un altro processo può non essere ancora nel catalogo: lo ricarico una volta
+    if any(cee_id not in catalog.by_id for cee_id in cee_ids):
+        invalidate_cee_catalog()
+        catalog = await get_cee_catalog()
+
+    for chart_account in chart_accounts:
+        chart_account.chartAccountCEEdebit = catalog.by_id.get(chart_account.chartAccountCEEdebitId)
+        chart_account.chartAccountCEEcredit = catalog.by_id.get(chart_account.chartAccountCEEcreditId)
+
+
+_CSV_CONTENT_TYPE = "text/csv"
+_XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+_XLS_CONTENT_TYPE = "application/vnd.ms-excel"
+_SUPPORTED_CONTENT_TYPES = [_CSV_CONTENT_TYPE, _XLSX_CONTENT_TYPE, _XLS_CONTENT_TYPE]
+
+# righe lette e scritte per volta durante l'import
+_IMPORT_CHUNK_SIZE = 5000
+_IMPORT_TRANSACTION_TIMEOUT = timedelta(minutes=10)
+
+
+def iter_comparison_file_chunks(file_object: BinaryIO, content_type: str, chunk_size: int = _IMPORT_CHUNK_SIZE):
+    """
+    Legge il file di confronto a blocchi di `chunk_size` righe senza caricarlo tutto in memoria.
+
+    Il CSV viene letto con `read_csv(chunksize=...)`, l'XLSX con openpyxl in modalità `read_only`.
+    Il vecchio formato XLS non è leggibile in streaming e viene restituito in un unico blocco.
+
+    Yields:
+        pandas.DataFrame: un blocco di righe con le intestazioni del file
+    """
+    file_object.seek(0)
+
+    if content_type == _CSV_CONTENT_TYPE:
+        yield from pandas.read_csv(file_object, chunksize=chunk_size, dtype=str)
+    elif content_type == _XLSX_CONTENT_TYPE:
+        workbook = openpyxl.load_workbook(file_object, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            for batch in itertools.batched(rows, chunk_size):
+                yield pandas.DataFrame.from_records(batch, columns=header)
+        finally:
+            workbook.close()
+    else:
+        yield pandas.read_excel(file_object)
+
+
+def parse_comparison_file_chunk(df: pandas.DataFrame, frame_writer: FrameWriter | None = None):
+    """
+    Args:
+        frame_writer: se passato, il blocco normalizzato viene aggiunto anche alla copia Arrow del file
+
+    Returns:
+        tuple[list[dict], list[dict], int]: CEE e conti da creare per il blocco e il numero di righe lette
+    """
+    normalized = normalize_comparison_dataframe(df)
+    if frame_writer:
+        frame_writer.write(normalized)
+    chart_accounts_cee_to_create, chart_accounts_to_create = _parse_comparison_dataframe(normalized)
+    return chart_accounts_cee_to_create, chart_accounts_to_create, len(df)
+
+
+async def _parse_comparison_file_chunks(file_object: BinaryIO, content_type: str, frame_path: str):
+    with FrameWriter(frame_path, COMPARISON_FRAME_SCHEMA) as frame_writer:
+        for chunk in iter_comparison_file_chunks(file_object, content_type):
+            yield parse_comparison_file_chunk(chunk, frame_writer)
+
+
+_CHART_ACCOUNT_TYPE_MAPPING = {
+    "ATTIVO": TypeChartAccount.ACTIVE,
+    "PASSIVO": TypeChartAccount.PASSIVE,
+    "ATTIVO/PASSIVO": TypeChartAccount.ACTIVE_PASSIVE,
+    "RICAVI": TypeChartAccount.REVENUE,
+    "COSTI": TypeChartAccount.COST
+}
+
+_ACCOUNT_TYPE_MAPPING = {
+    "STATO PATRIMONIALE": AccountType.BALANCE_SHEET,
+    "CONTO ECONOMICO": AccountType.INCOME_STATEMENT,
+    "CONTI D'ORDINE": AccountType.MEMORANDUM_ACCOUNT
+}
+
+# colonne del file di confronto -> nome interno
+_COMPARISON_FILE_COLUMNS = {
+    "Conto": "code",
+    "Descrizione Conto": "description",
+    "Tipo": "account_type",
+    "Valorizzazione": "type",
+    "DARE Voce": "debit_code",
+    "Descrizione_DARE": "debit_description",
+    "AVERE Voce": "credit_code",
+    "Descrizione_AVERE": "credit_description",
+}
+
+# schema della copia Arrow del file di confronto normalizzato, letta con `open_frame`
+COMPARISON_FRAME_SCHEMA = pyarrow.schema([(column, pyarrow.string()) for column in _COMPARISON_FILE_COLUMNS.values()])
+
+
+def normalize_comparison_dataframe(df: pandas.DataFrame) -> pandas.DataFrame:
+    """
+    Rinomina le colonne del file di confronto con i nomi interni e normalizza i valori come stringhe
+    senza spazi, con NA al posto delle celle vuote e tipo/valorizzazione in maiuscolo.
+    """
+    columns = {}
+    for source, target in _COMPARISON_FILE_COLUMNS.items():
+        if source in df.columns:
+            column = df[source].astype("string").str.strip()
+            columns[target] = column.mask(column.isin(["", "nan"]))
+        else:
+            columns[target] = pandas.Series(pandas.NA, index=df.index, dtype="string")
+    parsed = pandas.DataFrame(columns)
+    parsed["type"] = parsed["type"].str.upper()
+    parsed["account_type"] = parsed["account_type"].str.upper()
+    return parsed
+
+
+def _parse_comparison_dataframe(parsed: pandas.DataFrame):
+    """
+    Trasforma il file di confronto normalizzato in CEE e conti da creare, lavorando per colonne.
+
+    Returns:
+        tuple[list[dict], list[dict]]: i ChartAccountCEE (deduplicati per code) e i ChartAccount
+        (deduplicati per code, mantenendo la prima occorrenza)
+    """
+    debit = parsed[["debit_code", "debit_description"]].set_axis(["code", "description"], axis=1)
+    credit = parsed[["credit_code", "credit_description"]].set_axis(["code", "description"], axis=1)
+    # interleave DARE/AVERE per riga così la prima descrizione trovata vince, come nel file
+    cee = (
+        pandas.concat([debit, credit], keys=[0, 1])
+        .swaplevel()
+        .sort_index(level=0, sort_remaining=True)
+        .dropna(subset=["code"])
+        .drop_duplicates(subset="code", keep="first")
+    )
+
+    accounts = parsed.dropna(subset=["code"]).drop_duplicates(subset="code", keep="first")
+    to_consider = accounts["debit_code"].notna() | accounts["credit_code"].notna()
+    accounts = accounts.assign(
+        type=accounts["type"].map(_CHART_ACCOUNT_TYPE_MAPPING),
+        account_type=accounts["account_type"].map(_ACCOUNT_TYPE_MAPPING),
+        toConsider=to_consider,
+        # senza codici CEE il conto non va considerato e non viene collegato
+        debit_code=accounts["debit_code"].where(to_consider),
+        credit_code=accounts["credit_code"].where(to_consider),
+    )
+
+    chart_accounts_cee_to_create = _records(cee, ["code", "description"], ["code", "description"])
+    chart_accounts_to_create = _records(
+        accounts,
+        ["code", "description", "type", "account_type", "toConsider", "debit_code", "credit_code"],
+        ["code", "description", "type", "accountType", "toConsider", "chart_account_code_debit_cee", "chart_account_code_credit_cee"],
+    )
+    return chart_accounts_cee_to_create, chart_accounts_to_create
+
+
+def _records(df: pandas.DataFrame, columns: list, keys: list) -> list:
+    """
+    Converte le colonne indicate in una lista di dict con i nomi di `keys`, sostituendo NA con None
+    """
+    values = df[columns].astype(object).where(df[columns].notna(), None)
+    return [dict(zip(keys, row)) for row in values.itertuples(index=False, name=None)]
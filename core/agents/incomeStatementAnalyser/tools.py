@@ -1,35 +1,7 @@
-import requests
-from core.settings import settings
-from pydantic import BaseModel
 from pydantic_ai import Tool
 from typing import List
-
-
-# Define Pydantic models for the web search response
-class Profile(BaseModel):
-    name: str
-    url: str
-    long_name: str
-    img: str
-
-
-class Result(BaseModel):
-    title: str
-    url: str
-    is_source_local: bool
-    is_source_both: bool
-    description: str
-    profile: Profile
-
-
-class WebSearch(BaseModel):
-    type: str
-    results: List[Result]
-
-
-class SearchResponse(BaseModel):
-    type: str
-    web: WebSearch
+from core.services.financial.kpis import KPI_FIELDS, get_income_statement_kpis
+from core.agents.generic_tools.tools import web_search
 
 
 def current_time() -> str:
@@ -43,30 +15,27 @@ def current_time() -> str:
     return datetime.now().strftime("%Y-%m-%d")
 
 
-def web_search(query: str) -> dict:
-    """Search the web for relevant information to answer user questions
+def income_statement_kpi_tools(organization_id: str) -> List[Tool]:
+    """Tool per leggere i KPI precalcolati dell'organizzazione dell'utente che usa l'agente"""
 
-    Args:
-        query (str): The search query
+    async def income_statement_kpis(year: int, month: int | None = None) -> list[dict]:
+        """Get the precomputed income statement KPIs (revenue, EBITDA, EBIT, gross margin,
+        margins, cost incidence and month-over-month deltas) for a year or a single month.
 
-    Returns:
-        str: _search results
-    """
+        Args:
+            year (int): The year of the income statement
+            month (int | None): The month (1-12), or None for every month of the year
 
-    response: SearchResponse = requests.get(
-        "https://api.search.brave.com/res/v1/web/search",
-        headers={
-            "X-Subscription-Token": settings.requrv_brave_api_key,
-        },
-        params={
-            "q": query,
-            "count": 5,
-            "country": "it",
-            "search_lang": "it",
-        },
-    ).json()
+        Returns:
+            list[dict]: one row of KPIs per month
+        """
+        kpis = await get_income_statement_kpis(organization_id, year, month)
+        return [
+            {"year": kpi.year, "month": kpi.month, **{field: getattr(kpi, field) for field in KPI_FIELDS}}
+            for kpi in kpis
+        ]
 
-    return response.model_dump().get("web", {}).get("results", [])
+    return [Tool(income_statement_kpis)]
 
 
 custom_tools = [Tool(current_time), Tool(web_search)]
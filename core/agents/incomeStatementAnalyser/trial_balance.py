@@ -0,0 +1,242 @@
+import logging
+from fastapi import UploadFile, HTTPException
+from core.services.prisma import prisma
+from prisma.models import User, Organization
+from core.modules.media.service import upload_file_to_s3
+from core.services.financial.comparison import fill_percentages
+from core.services.financial.rollups import roll_up_historical_balances
+from core.services.financial.budget import invalidate_budget_variance
+from core.services.financial.what_if import invalidate_what_if_models
+from core.services.response_cache import invalidate_organization_responses
+from .service import (
+    _IMPORT_TRANSACTION_TIMEOUT,
+    _SUPPORTED_CONTENT_TYPES,
+    iter_comparison_file_chunks,
+)
+import pandas
+
+# colonne del bilancio di verifica mensile -> nome interno
+_TRIAL_BALANCE_COLUMNS = {
+    "Conto": "code",
+    "Dare": "debit",
+    "Avere": "credit",
+    "Saldo": "balance",
+}
+
+# righe scritte per ogni create_many: 5000 righe x 6 colonne restano sotto il limite di parametri di PostgreSQL
+_TRIAL_BALANCE_CHUNK_SIZE = 5000
+
+# importi interi con il punto come separatore delle migliaia e senza decimali: 1.234, -12.345.678
+_THOUSANDS_ONLY_PATTERN = r"-?\d{1,3}(?:\.\d{3})+"
+
+# codici non trovati restituiti nella risposta, il conteggio è sempre completo
+_MAX_UNKNOWN_CODES_REPORTED = 50
+
+_CHART_ACCOUNT_IDS_QUERY = """
+SELECT a."code" AS "code", a."id" AS "id"
+FROM "ChartAccount" a
+JOIN "IncomeStatementConversionTable" t ON t."id" = a."incomeStatementConversionTableId"
+WHERE t."organizationId" = $1::uuid
+  AND a."deletedAt" IS NULL
+"""
+
+
+async def upload_trial_balance_service(
+    user_id: str,
+    year: int,
+    month: int,
+    file: UploadFile,
+    is_previous_year: bool = False,
+):
+    """
+    Importa il bilancio di verifica di un mese nei ValuesCostsRevenues dell'IncomeStatement (anno, mese).
+
+    Il file viene letto a blocchi, i codici dei conti vengono risolti con una mappa code -> id caricata
+    una sola volta e i valori vengono scritti con `create_many` in un'unica transazione. Se il mese era già
+    stato importato i suoi valori vengono sostituiti.
+    """
+    user: User = await prisma.user.find_unique(where={"id": user_id}, include={"owner": True})
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    organization: Organization = await prisma.organization.find_unique(
+        where={"id": user.organizationId if user.organizationId else user.owner.id}
+    )
+
+    if not organization:
+        raise HTTPException(status_code=404, detail="Organization not found")
+
+    if file.content_type not in _SUPPORTED_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}")
+
+    chart_account_id_by_code = await _load_chart_account_ids(organization.id)
+    if not chart_account_id_by_code:
+        raise HTTPException(status_code=400, detail="Income Statement Conversion Table not found")
+
+    try:
+        media = await upload_file_to_s3(file, who_uploaded_it_user_id=user.id)
+    except Exception as e:
+        logging.error("Error uploading file to S3: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
+
+    try:
+        income_statement, rows_imported, unknown_codes = await import_trial_balance(
+            organization.id,
+            year,
+            month,
+            media.id,
+            iter_comparison_file_chunks(file.file, file.content_type, _TRIAL_BALANCE_CHUNK_SIZE),
+            chart_account_id_by_code,
+            is_previous_year,
+        )
+    except Exception as e:
+        logging.error("Error processing trial balance: %s", e)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    # i totali storicizzati, letti da confronti e KPI, sono aggiornati subito anche per i conti non più presenti
+    try:
+        await roll_up_historical_balances([(organization.id, year, month)])
+    except Exception as e:
+        # le righe nuove restano da storicizzare e vengono riprese dal job periodico
+        logging.error("Error rolling up trial balance: %s", e)
+    # le percentuali del mese importato e dello stesso mese dell'anno dopo dipendono da questi valori
+    try:
+        await fill_percentages(organization.id, [year, year + 1])
+    except Exception as e:
+        # il bilancio è già salvato: le percentuali vengono ricalcolate al prossimo import dello stesso anno
+        logging.error("Error filling percentages after trial balance import: %s", e)
+    invalidate_budget_variance(organization.id, year)
+    invalidate_what_if_models(organization.id)
+    invalidate_organization_responses(organization.id)
+
+    return {
+        "message": "Trial balance imported successfully",
+        "incomeStatementId": income_statement.id,
+        "rowsImported": rows_imported,
+        "unknownCodesCount": len(unknown_codes),
+        "unknownCodes": sorted(unknown_codes)[:_MAX_UNKNOWN_CODES_REPORTED],
+    }
+
+
+async def import_trial_balance(
+    organization_id: str,
+    year: int,
+    month: int,
+    media_id: str,
+    chunks,
+    chart_account_id_by_code: dict[str, str],
+    is_previous_year: bool = False,
+):
+    """
+    Scrive i blocchi del bilancio di verifica nell'IncomeStatement del mese in un'unica transazione.
+
+    Returns:
+        tuple[IncomeStatement, int, set[str]]: l'IncomeStatement, le righe scritte e i codici non trovati
+    """
+    rows_imported = 0
+    unknown_codes = set()
+
+    async with prisma.tx(timeout=_IMPORT_TRANSACTION_TIMEOUT) as transaction:
+        income_statement = await transaction.incomestatement.find_first(
+            where={"organizationId": organization_id, "year": year, "month": month}
+        )
+        if income_statement:
+            # reimport del mese: si sostituiscono solo i valori dello stesso tipo (anno corrente o precedente)
+            await transaction.valuescostsrevenues.delete_many(
+                where={"incomeStatementId": income_statement.id, "isPreviousYear": is_previous_year}
+            )
+            income_statement = await transaction.incomestatement.update(
+                where={"id": income_statement.id}, data={"mediaId": media_id}
+            )
+        else:
+            income_statement = await transaction.incomestatement.create(
+                data={
+                    "year": year,
+                    "month": month,
+                    "organizationId": organization_id,
+                    "mediaId": media_id,
+                }
+            )
+
+        for chunk in chunks:
+            values, chunk_unknown_codes = parse_trial_balance_chunk(chunk, chart_account_id_by_code)
+            unknown_codes |= chunk_unknown_codes
+            if values.empty:
+                continue
+
+            await transaction.valuescostsrevenues.create_many(
+                data=[
+                    {
+                        "incomeStatementId": income_statement.id,
+                        "chartAccountId": chart_account_id,
+                        "debit": debit,
+                        "credit": credit,
+                        "balance": balance,
+                        "isPreviousYear": is_previous_year,
+                    }
+                    for chart_account_id, debit, credit, balance in values.itertuples(index=False, name=None)
+                ]
+            )
+            rows_imported += len(values)
+
+    return income_statement, rows_imported, unknown_codes
+
+
+def parse_trial_balance_chunk(df: pandas.DataFrame, chart_account_id_by_code: dict[str, str]):
+    """
+    Normalizza un blocco del bilancio di verifica e risolve i codici dei conti.
+
+    Le righe con lo stesso codice vengono sommate. Se manca la colonna Saldo viene calcolata come Dare - Avere.
+
+    Returns:
+        tuple[pandas.DataFrame, set[str]]: colonne chartAccountId, debit, credit, balance e i codici non trovati
+    """
+    if "Conto" not in df.columns:
+        raise ValueError("Missing column: Conto")
+
+    code = df["Conto"].astype("string").str.strip()
+    code = code.mask(code.isin(["", "nan"]))
+    debit = _parse_amounts(df.get("Dare"), df.index)
+    credit = _parse_amounts(df.get("Avere"), df.index)
+    balance = _parse_amounts(df.get("Saldo"), df.index) if "Saldo" in df.columns else debit - credit
+
+    parsed = (
+        pandas.DataFrame({"code": code, "debit": debit, "credit": credit, "balance": balance})
+        .dropna(subset=["code"])
+        .groupby("code", sort=False, as_index=False)
+        .sum()
+    )
+    parsed["chartAccountId"] = parsed["code"].map(chart_account_id_by_code)
+
+    unknown = parsed["chartAccountId"].isna()
+    unknown_codes = set(parsed.loc[unknown, "code"])
+    values = parsed.loc[~unknown, ["chartAccountId", "debit", "credit", "balance"]]
+    return values, unknown_codes
+
+
+def _parse_amounts(column: pandas.Series | None, index: pandas.Index) -> pandas.Series:
+    """
+    Converte una colonna di importi in float, accettando sia numeri sia testo nel formato italiano (1.234,56).
+    Il testo senza virgola con gruppi di tre cifre dopo il punto (1.234, 1.234.567) è un importo intero con
+    separatore delle migliaia. Le celle vuote o non numeriche valgono 0.
+    """
+    if column is None:
+        return pandas.Series(0.0, index=index)
+
+    # i numeri letti dall'xlsx sono già float: le regole sul testo valgono solo per le celle di testo
+    textual = column.map(lambda value: isinstance(value, str)).astype(bool)
+    text = column.astype("string").str.strip()
+    italian = textual & (
+        text.str.contains(",", regex=False) | text.str.fullmatch(_THOUSANDS_ONLY_PATTERN)
+    ).fillna(False)
+    text = text.where(
+        ~italian,
+        text.str.replace(".", "", regex=False).str.replace(",", ".", regex=False),
+    )
+    return pandas.to_numeric(text, errors="coerce").fillna(0.0).astype(float)
+
+
+async def _load_chart_account_ids(organization_id: str) -> dict[str, str]:
+    rows = await prisma.query_raw(_CHART_ACCOUNT_IDS_QUERY, organization_id)
+    return {row["code"]: row["id"] for row in rows}
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import aclosing, suppress
+from pydantic_ai import Agent
+from pydantic_ai.agent import AgentRunResult
+from pydantic_ai.messages import (
+    FunctionToolCallEvent,
+    FunctionToolResultEvent,
+    PartDeltaEvent,
+    PartStartEvent,
+    TextPart,
+    TextPartDelta,
+    ToolReturnPart,
+)
+
+# eventi prodotti e non ancora inviati al client: quando la coda è piena l'agente smette di leggere
+# lo stream del modello finché il client non riprende a ricevere
+MAX_BUFFERED_EVENTS = 64
+
+_END = object()
+
+
+async def stream_agent_run(
+    agent: Agent,
+    prompt: str,
+    on_result: Callable[[AgentRunResult], Awaitable[None]] | None = None,
+    **run_kwargs,
+) -> AsyncIterator[dict]:
+    """
+    Esegue l'agente e restituisce man mano i token del testo, le chiamate ai tool con i loro risultati
+    e infine l'output completo. `on_result` riceve il risultato della run prima dell'evento "done",
+    ad esempio per salvare il turno della conversazione.
+
+    Eventi: {"type": "token", "content"}, {"type": "tool_call", "toolCallId", "tool", "args"},
+    {"type": "tool_result", "toolCallId", "tool", "content"}, {"type": "done", "output"}
+    """
+    async with agent.iter(prompt, **run_kwargs) as run:
+        async for node in run:
+            if Agent.is_model_request_node(node):
+                async with node.stream(run.ctx) as request_stream:
+                    async for event in request_stream:
+                        if isinstance(event, PartStartEvent) and isinstance(event.part, TextPart) and event.part.content:
+                            yield {"type": "token", "content": event.part.content}
+                        elif isinstance(event, PartDeltaEvent) and isinstance(event.delta, TextPartDelta):
+                            yield {"type": "token", "content": event.delta.content_delta}
+            elif Agent.is_call_tools_node(node):
+                async with node.stream(run.ctx) as tools_stream:
+                    async for event in tools_stream:
+                        if isinstance(event, FunctionToolCallEvent):
+                            yield {
+                                "type": "tool_call",
+                                "toolCallId": event.part.tool_call_id,
+                                "tool": event.part.tool_name,
+                                "args": event.part.args_as_dict(),
+                            }
+                        elif isinstance(event, FunctionToolResultEvent):
+                            result = event.result
+                            yield {
+                                "type": "tool_result",
+                                "toolCallId": event.tool_call_id,
+                                "tool": result.tool_name,
+                                "content": (
+                                    result.model_response_str()
+                                    if isinstance(result, ToolReturnPart)
+                                    else result.model_response()
+                                ),
+                            }
+        if on_result is not None:
+            await on_result(run.result)
+        yield {"type": "done", "output": run.result.output}
+
+
+async def replay_output(output: str) -> AsyncIterator[dict]:
+    """Eventi di una risposta già pronta, ad esempio dalla cache delle risposte"""
+    yield {"type": "token", "content": output}
+    yield {"type": "done", "output": output, "cached": True}
+
+
+class AgentRunStream:
+    """
+    Esecuzione di un agente in un task separato, con gli eventi in una coda limitata.
+
+    Il task si ferma con `cancel()`, ad esempio quando il client si disconnette, così la generazione
+    abbandonata non continua a occupare il gateway del modello.
+    """
+
+    def __init__(self, events: AsyncIterator[dict], max_buffered_events: int = MAX_BUFFERED_EVENTS):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffered_events)
+        self._task = asyncio.create_task(self._produce(events))
+
+    async def events(self) -> AsyncIterator[dict]:
+        while (event := await self._queue.get()) is not _END:
+            yield event
+
+    def cancel(self):
+        self._task.cancel()
+
+    async def aclose(self):
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+
+    async def _produce(self, events: AsyncIterator[dict]):
+        try:
+            # aclosing: se il task viene annullato mentre attende la coda, lo stream del modello si chiude subito
+            async with aclosing(events):
+                async for event in events:
+                    await self._queue.put(event)
+        except asyncio.CancelledError:
+            self._end({"type": "cancelled"})
+            raise
+        except Exception as e:
+            logging.error("Error running agent: %s", e)
+            self._end({"type": "error", "detail": str(e)})
+        else:
+            await self._queue.put(_END)
+
+    def _end(self, event: dict):
+        # dopo un errore o un annullamento gli eventi non ancora letti possono essere scartati:
+        # conta che il lettore riceva l'evento finale e la fine dello stream
+        while self._queue.qsize() > self._queue.maxsize - 2:
+            self._queue.get_nowait()
+        self._queue.put_nowait(event)
+        self._queue.put_nowait(_END)
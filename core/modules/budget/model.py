@@ -0,0 +1,45 @@
+from typing import Dict, List
+from pydantic import BaseModel, Field
+
+
+class BudgetLineInputDto(BaseModel):
+    cee_code: str = Field(
+        ...,
+        description="The code of the CEE line the budget refers to (e.g. B.7)."
+    )
+    year: int = Field(
+        ...,
+        description="The budget year."
+    )
+    month: int = Field(
+        ...,
+        ge=1,
+        le=12,
+        description="The budget month, from 1 to 12."
+    )
+    amount: float = Field(
+        ...,
+        description="The budgeted amount as debit - credit: costs are positive, revenues negative."
+    )
+
+
+class UpsertBudgetLinesInputDto(BaseModel):
+    lines: List[BudgetLineInputDto] = Field(
+        ...,
+        description="Budget lines to create or update."
+    )
+
+
+class WhatIfInputDto(BaseModel):
+    year: int = Field(
+        ...,
+        description="The year of the income statement the scenario starts from."
+    )
+    cee_changes: Dict[str, float] = Field(
+        default_factory=dict,
+        description="Percentage change per CEE code; a code also applies to the lines below it (B.7 -> B.7.a)."
+    )
+    account_changes: Dict[str, float] = Field(
+        default_factory=dict,
+        description="Percentage change per chart account code."
+    )
@@ -0,0 +1,100 @@
+from typing import Annotated
+from authx import TokenPayload
+from fastapi import APIRouter, Body, Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from core.settings import auth
+from core.services.prisma import prisma
+from core.services.cee_catalog import get_cee_catalog
+from core.services.financial.budget import get_budget_lines, get_budget_variance, upsert_budget_lines
+from core.services.financial.what_if import run_what_if
+from core.modules.budget.model import UpsertBudgetLinesInputDto, WhatIfInputDto
+from prisma.models import User
+
+
+budget_router = APIRouter(prefix="/budget", tags=["budget"])
+auth_scheme = HTTPBearer()
+
+
+async def _get_organization_id(user_id: str) -> str:
+    user: User = await prisma.user.find_unique(where={"id": user_id}, include={"owner": True})
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    organization_id = user.organizationId if user.organizationId else user.owner.id if user.owner else None
+
+    if not organization_id:
+        raise HTTPException(status_code=404, detail="Organization not found")
+
+    return organization_id
+
+
+@budget_router.put("/lines")
+async def upsert_lines(
+    data: Annotated[UpsertBudgetLinesInputDto, Body(embed=True, strict=True)],
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)
+):
+    organization_id = await _get_organization_id(payload.sub)
+
+    catalog = await get_cee_catalog()
+    unknown_codes = sorted({line.cee_code for line in data.lines if line.cee_code not in catalog.by_code})
+    if unknown_codes:
+        raise HTTPException(status_code=400, detail=f"Unknown CEE codes: {', '.join(unknown_codes)}")
+
+    written = await upsert_budget_lines(
+        organization_id,
+        [
+            {
+                "chartAccountCEEId": catalog.by_code[line.cee_code].id,
+                "year": line.year,
+                "month": line.month,
+                "amount": line.amount,
+            }
+            for line in data.lines
+        ],
+    )
+
+    return {"message": "Budget lines saved successfully", "count": written}
+
+
+@budget_router.get("/lines")
+async def get_lines(
+    year: int,
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)
+):
+    organization_id = await _get_organization_id(payload.sub)
+
+    return await get_budget_lines(organization_id, year)
+
+
+@budget_router.get("/variance")
+async def get_variance(
+    year: int,
+    month: int | None = None,
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)
+):
+    if month is not None and not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="Month must be between 1 and 12")
+
+    organization_id = await _get_organization_id(payload.sub)
+
+    variance = await get_budget_variance(organization_id, year)
+
+    return await variance.to_dict(month)
+
+
+@budget_router.post("/what-if")
+async def what_if(
+    data: Annotated[WhatIfInputDto, Body(embed=True, strict=True)],
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)
+):
+    organization_id = await _get_organization_id(payload.sub)
+
+    try:
+        return await run_what_if(organization_id, data.year, data.cee_changes, data.account_changes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,36 @@
+from datetime import datetime
+from pydantic import BaseModel, Field
+
+
+class ChatInputDto(BaseModel):
+    prompt: str = Field(
+        ...,
+        min_length=1,
+        description="The user message for the agent."
+    )
+    conversation_id: str | None = Field(
+        None,
+        description="The conversation the message belongs to; without it the message is answered on its own."
+    )
+
+
+################### OUTPUT #######################
+
+
+class ConversationOutputDto(BaseModel):
+    id: str = Field(..., description="The conversation id.")
+    agent: str = Field(..., description="The agent the conversation belongs to.")
+    title: str | None = Field(None, description="The beginning of the first message of the conversation.")
+    createdAt: datetime
+    updatedAt: datetime
+
+
+class ConversationTurnOutputDto(BaseModel):
+    id: str
+    prompt: str
+    output: str
+    createdAt: datetime
+
+
+class ConversationDetailOutputDto(ConversationOutputDto):
+    turns: list[ConversationTurnOutputDto] = Field(default_factory=list)
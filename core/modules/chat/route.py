@@ -0,0 +1,321 @@
+import asyncio
+import importlib
+import json
+import logging
+from contextlib import aclosing, suppress
+from typing import Annotated
+from authx import RequestToken, TokenPayload
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from pydantic_ai import Agent
+from core.settings import auth
+from core.services.prisma import prisma
+from core.agents.streaming import AgentRunStream, replay_output, stream_agent_run
+from core.services.prompts import PromptNotAvailable, prompt_registry
+from core.services.response_cache import response_cache
+from core.services.conversations import ConversationHistory, ConversationNotFound, conversation_store
+from core.modules.chat.model import (
+    ChatInputDto,
+    ConversationDetailOutputDto,
+    ConversationOutputDto,
+    ConversationTurnOutputDto,
+)
+from prisma.models import User
+
+
+chat_router = APIRouter(prefix="/chat", tags=["chat"])
+auth_scheme = HTTPBearer()
+
+# moduli con `agent_startup` per ogni agente esposto; importati alla prima richiesta
+AGENT_MODULES = {
+    "core": "core.agents.core.run",
+    "income-statement-analyser": "core.agents.incomeStatementAnalyser.run",
+    "admin-coordinator": "core.agents.economic.admin-coordinator.run",
+    "budgeting": "core.agents.economic.budgeting.run",
+    "finantial-prevision": "core.agents.economic.finantial-prevision.run",
+}
+
+# messo in coda dal receiver quando il client si disconnette o invia un messaggio non valido
+_DISCONNECTED = object()
+
+
+async def get_chat_agent(agent_name: str, user_id: str) -> tuple[Agent, str | None]:
+    module_name = AGENT_MODULES.get(agent_name)
+    if not module_name:
+        raise HTTPException(status_code=404, detail="Agent not found")
+
+    user: User = await prisma.user.find_unique(
+        where={"id": user_id}, include={"owner": True, "organization": True}
+    )
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    organization_id = user.organizationId if user.organizationId else user.owner.id if user.owner else None
+    team_key = user.organization.team_key if user.organization else None
+
+    if not team_key:
+        raise HTTPException(status_code=403, detail="Team key not found")
+
+    agent_startup = importlib.import_module(module_name).agent_startup
+    try:
+        if agent_name == "income-statement-analyser":
+            return await agent_startup(user_id), organization_id
+        return await agent_startup(team_key, organization_id), organization_id
+    except PromptNotAvailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        # utente o team key non trovati dall'agente
+        raise HTTPException(status_code=403, detail=str(e))
+
+
+async def get_conversation_history(conversation_id: str | None, user_id: str, agent_name: str) -> ConversationHistory | None:
+    if not conversation_id:
+        return None
+    try:
+        return await conversation_store.history(conversation_id, user_id, agent_name)
+    except ConversationNotFound:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+
+async def start_chat_run(
+    agent_name: str,
+    agent: Agent,
+    organization_id: str | None,
+    prompt: str,
+    history: ConversationHistory | None = None,
+) -> AgentRunStream:
+    """
+    Avvia la risposta a un messaggio.
+
+    In una conversazione l'agente riceve la history limitata dal budget di token e il turno viene salvato
+    prima dell'evento "done". Un messaggio senza conversazione usa la cache delle risposte dell'organizzazione
+    se la stessa domanda, a meno di maiuscole, accenti e punteggiatura, ha già una risposta sugli stessi dati
+    e con lo stesso prompt.
+
+    Raises:
+        HTTPException: 503 se il prompt dell'agente non è disponibile
+    """
+    if history is not None:
+        async def save_turn(result):
+            try:
+                await conversation_store.append_turn(
+                    history, prompt, str(result.output), result.new_messages(), model=agent.model
+                )
+            except Exception as e:
+                logging.error("Error saving conversation turn: %s", e)
+
+        return AgentRunStream(
+            stream_agent_run(agent, prompt, on_result=save_turn, message_history=history.window() or None)
+        )
+
+    if not organization_id:
+        return AgentRunStream(stream_agent_run(agent, prompt))
+
+    try:
+        system_prompt = await prompt_registry.get("requrv-hub-core", organization_id)
+    except PromptNotAvailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    scope = response_cache.scope(agent_name, organization_id, system_prompt.version)
+    output = response_cache.get(scope, prompt)
+    if output is not None:
+        return AgentRunStream(replay_output(output))
+    return AgentRunStream(_cache_output(stream_agent_run(agent, prompt), scope, prompt))
+
+
+@chat_router.post("/{agent_name}/stream")
+async def stream_chat(
+    agent_name: str,
+    data: Annotated[ChatInputDto, Body(embed=True, strict=True)],
+    request: Request,
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)
+):
+    agent, organization_id = await get_chat_agent(agent_name, payload.sub)
+    history = await get_conversation_history(data.conversation_id, payload.sub, agent_name)
+    run = await start_chat_run(agent_name, agent, organization_id, data.prompt, history)
+
+    return StreamingResponse(
+        _sse_events(request, run),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@chat_router.post("/{agent_name}/conversations", status_code=201)
+async def create_conversation(
+    agent_name: str,
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)
+):
+    _, organization_id = await get_chat_agent(agent_name, payload.sub)
+    return {"id": await conversation_store.create(agent_name, payload.sub, organization_id)}
+
+
+@chat_router.get("/conversations")
+async def list_conversations(
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)
+) -> list[ConversationOutputDto]:
+    conversations = await prisma.conversation.find_many(
+        where={"userId": payload.sub},
+        order={"updatedAt": "desc"},
+        take=50,
+    )
+    # prompt di sistema e riassunto restano interni: si restituiscono solo i campi del DTO
+    return [_conversation_output(conversation) for conversation in conversations]
+
+
+@chat_router.get("/conversations/{conversation_id}")
+async def get_conversation(
+    conversation_id: str,
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)
+) -> ConversationDetailOutputDto:
+    conversation = await prisma.conversation.find_unique(
+        where={"id": conversation_id},
+        include={"turns": {"order_by": {"createdAt": "asc"}}},
+    )
+    if not conversation or conversation.userId != payload.sub:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    return ConversationDetailOutputDto(
+        **_conversation_output(conversation).model_dump(),
+        turns=[
+            ConversationTurnOutputDto(id=turn.id, prompt=turn.prompt, output=turn.output, createdAt=turn.createdAt)
+            for turn in conversation.turns or []
+        ],
+    )
+
+
+def _conversation_output(conversation) -> ConversationOutputDto:
+    return ConversationOutputDto(
+        id=conversation.id,
+        agent=conversation.agent,
+        title=conversation.title,
+        createdAt=conversation.createdAt,
+        updatedAt=conversation.updatedAt,
+    )
+
+
+@chat_router.websocket("/{agent_name}/ws")
+async def chat_websocket(websocket: WebSocket, agent_name: str, token: str = Query(...)):
+    """
+    Un messaggio {"prompt": ..., "conversationId": ...} avvia una risposta, inviata come eventi JSON fino a "done", "error"
+    o "cancelled". Durante una risposta qualsiasi messaggio del client, come {"type": "cancel"}, la annulla;
+    se il messaggio contiene un nuovo prompt, la risposta a quel prompt parte subito dopo.
+
+    I messaggi del client vengono letti da un unico task e messi in coda, così nessun messaggio va perso
+    tra la fine di una risposta e l'inizio della successiva.
+    """
+    try:
+        payload = auth.verify_token(RequestToken(token=token, location="headers"), verify_csrf=False)
+    except Exception:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    try:
+        agent, organization_id = await get_chat_agent(agent_name, payload.sub)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "detail": e.detail})
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    except Exception as e:
+        logging.error("Error starting agent %s: %s", agent_name, e)
+        await websocket.send_json({"type": "error", "detail": "Agent not available"})
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        return
+
+    messages: asyncio.Queue = asyncio.Queue()
+    receiver = asyncio.create_task(_receive_messages(websocket, messages))
+    pending = None
+    try:
+        with suppress(WebSocketDisconnect):
+            while True:
+                message = pending if pending is not None else await messages.get()
+                pending = None
+                if message is _DISCONNECTED:
+                    return
+                prompt = message.get("prompt") if isinstance(message, dict) else None
+                if not prompt:
+                    await websocket.send_json({"type": "error", "detail": "Prompt is required"})
+                    continue
+
+                try:
+                    history = await get_conversation_history(message.get("conversationId"), payload.sub, agent_name)
+                    run = await start_chat_run(agent_name, agent, organization_id, prompt, history)
+                except HTTPException as e:
+                    await websocket.send_json({"type": "error", "detail": e.detail})
+                    continue
+                except Exception as e:
+                    logging.error("Error starting chat run for agent %s: %s", agent_name, e)
+                    await websocket.send_json({"type": "error", "detail": "Chat run not available"})
+                    continue
+
+                sender = asyncio.create_task(_send_events(websocket, run))
+                interrupt = asyncio.create_task(messages.get())
+                try:
+                    await asyncio.wait({sender, interrupt}, return_when=asyncio.FIRST_COMPLETED)
+                    if interrupt.done():
+                        # cancel o disconnessione: la generazione si ferma e il sender invia "cancelled"
+                        run.cancel()
+                        pending = interrupt.result()
+                        if pending is _DISCONNECTED:
+                            return
+                        await sender
+                        if not (isinstance(pending, dict) and pending.get("prompt")):
+                            pending = None
+                    else:
+                        sender.result()
+                finally:
+                    # annullare un get della coda non consuma messaggi: restano per il turno successivo
+                    interrupt.cancel()
+                    sender.cancel()
+                    await run.aclose()
+    finally:
+        receiver.cancel()
+
+
+async def _receive_messages(websocket: WebSocket, messages: asyncio.Queue):
+    try:
+        while True:
+            messages.put_nowait(await websocket.receive_json())
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logging.error("Error receiving chat message: %s", e)
+    finally:
+        messages.put_nowait(_DISCONNECTED)
+
+
+async def _cache_output(events, scope: tuple, prompt: str):
+    async with aclosing(events):
+        async for event in events:
+            if event["type"] == "done" and isinstance(event["output"], str):
+                response_cache.put(scope, prompt, event["output"])
+            yield event
+
+
+async def _send_events(websocket: WebSocket, run: AgentRunStream):
+    # send_json attende che il client riceva: se il client rallenta si riempie la coda e l'agente si ferma
+    async for event in run.events():
+        await websocket.send_json(event)
+
+
+async def _sse_events(request: Request, run: AgentRunStream):
+    watcher = asyncio.create_task(_cancel_on_disconnect(request, run))
+    try:
+        async for event in run.events():
+            yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+    finally:
+        watcher.cancel()
+        await run.aclose()
+
+
+async def _cancel_on_disconnect(request: Request, run: AgentRunStream):
+    """Annulla la generazione appena il client chiude la connessione, anche durante una chiamata ai tool"""
+    while not await request.is_disconnected():
+        await asyncio.sleep(1)
+    run.cancel()
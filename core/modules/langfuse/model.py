@@ -34,6 +34,21 @@ class UpdateLangfuseInputDto(BaseModel):
         min_length=3
     )
    
+class PromptVersionPinInputDto(BaseModel):
+    """
+    Data Transfer Object for pinning a prompt version for the organization.
+    """
+    name: str = Field(
+        ...,
+        description="The Langfuse prompt name.",
+        example="requrv-hub-core"
+    )
+    version: int | None = Field(
+        None,
+        ge=1,
+        description="The prompt version to use; null removes the pin and uses the latest production version."
+    )
+
 ################### OUTPUT #######################
 
 
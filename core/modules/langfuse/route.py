@@ -4,7 +4,8 @@ from authx import TokenPayload
 from fastapi import APIRouter, Depends, HTTPException, Body
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from core.settings import auth
-from core.modules.langfuse.model import CreateLangfuseInputDto, UpdateLangfuseInputDto
+from core.modules.langfuse.model import CreateLangfuseInputDto, UpdateLangfuseInputDto, PromptVersionPinInputDto
+from core.services.prompts import prompt_registry
 
 from core.services.prisma import prisma
 
@@ -162,6 +163,54 @@ async def get_langfuse_configuration(
     }
 
 
+@langfuse_router.put("/prompt-pins")
+async def set_prompt_version_pin(
+    data: Annotated[PromptVersionPinInputDto, Body(embed=True, strict=True)],
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)):
+    user_id = payload.sub
+
+    user = await prisma.user.find_unique(where={"id": user_id}, include={"owner": True})
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not user.owner:
+        raise HTTPException(status_code=403, detail="User does not have permission to pin prompt versions")
+
+    where = {"organizationId_name": {"organizationId": user.owner.id, "name": data.name}}
+    if data.version is None:
+        await prisma.promptversionpin.delete_many(where={"organizationId": user.owner.id, "name": data.name})
+    else:
+        await prisma.promptversionpin.upsert(
+            where=where,
+            data={
+                "create": {"organizationId": user.owner.id, "name": data.name, "version": data.version},
+                "update": {"version": data.version},
+            },
+        )
+    prompt_registry.set_pin(user.owner.id, data.name, data.version)
+
+    return True
+
+@langfuse_router.get("/prompt-pins")
+async def get_prompt_version_pins(
+    token: HTTPAuthorizationCredentials = Depends(auth_scheme),
+    payload: TokenPayload = Depends(auth.access_token_required)):
+    user_id = payload.sub
+
+    user = await prisma.user.find_unique(where={"id": user_id}, include={"owner": True})
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    organization_id = user.organizationId if user.organizationId else user.owner.id if user.owner else None
+
+    if not organization_id:
+        raise HTTPException(status_code=404, detail="Organization not found")
+
+    return await prisma.promptversionpin.find_many(where={"organizationId": organization_id})
+
+
 def _mask(value):
     if not value or len(value) <= 4:
         return '*' * 10 + value[-4:] if value else None
@@ -1,3 +1,4 @@
+import hashlib
 import logging
 from fastapi import HTTPException, UploadFile
 from core.settings import settings
@@ -43,8 +44,27 @@ def create_presigned_url(object_key, expiration=3600):
     return response
 
 
-async def upload_file_to_s3(file: UploadFile, who_uploaded_it_user_id: str = None):
+async def compute_file_sha256(file: UploadFile, chunk_size: int = 1024 * 1024) -> str:
+    """Compute the SHA-256 of an uploaded file reading it in chunks, then rewind it
+
+    :param file: the uploaded file
+    :param chunk_size: bytes read per iteration
+    :return: the hex digest
+    """
+    digest = hashlib.sha256()
+    await file.seek(0)
+    while chunk := await file.read(chunk_size):
+        digest.update(chunk)
+    await file.seek(0)
+
+    return digest.hexdigest()
+
+
+async def upload_file_to_s3(file: UploadFile, who_uploaded_it_user_id: str = None, sha256: str = None):
     """Upload a file to an S3 bucket"""
+    if sha256 is None:
+        sha256 = await compute_file_sha256(file)
+
     try: 
         async with prisma.tx() as transaction:
             # generazione del file key
@@ -58,20 +78,20 @@ async def upload_file_to_s3(file: UploadFile, who_uploaded_it_user_id: str = Non
                     "size": file.size,
                     "type": file.content_type,
                     "whoUploadedItUserId": who_uploaded_it_user_id,
+                    "sha256": sha256,
                     # Add other necessary fields
                 }
             )
 
-            file_object = await file.read()
-
+            # il body viene passato come file object così boto3 lo invia a blocchi senza leggerlo tutto in memoria
+            await file.seek(0)
             s3_client.put_object(
-                Body=file_object,
+                Body=file.file,
                 Bucket=settings.model_dump()["requrv_aws_bucket"],
                 Key=file_key,
                 ContentType=file.content_type,
             )
-
-            pass
+            await file.seek(0)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
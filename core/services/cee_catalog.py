@@ -0,0 +1,102 @@
+import asyncio
+from prisma.models import ChartAccountCEE
+from core.services.prisma import prisma
+
+CEE_CODE_SEPARATOR = "."
+
+
+class CeeCodeNode:
+    """Nodo del prefix tree dei codici CEE: B -> B.7 -> B.7.a"""
+
+    def __init__(self, code: str | None = None):
+        self.code = code
+        self.cee: ChartAccountCEE | None = None
+        self.children: dict[str, "CeeCodeNode"] = {}
+
+    def walk(self):
+        """Restituisce i CEE del nodo e di tutti i suoi discendenti"""
+        if self.cee:
+            yield self.cee
+        for child in self.children.values():
+            yield from child.walk()
+
+
+class CeeCatalog:
+    """
+    Copia in memoria del catalogo ChartAccountCEE, indicizzata per id, per code e per gerarchia dei codici.
+    """
+
+    def __init__(self, chart_accounts_cee: list[ChartAccountCEE]):
+        self.by_id: dict[str, ChartAccountCEE] = {}
+        self.by_code: dict[str, ChartAccountCEE] = {}
+        self.root = CeeCodeNode()
+
+        for cee in chart_accounts_cee:
+            self.by_id[cee.id] = cee
+            self.by_code[cee.code] = cee
+            self._node(cee.code, create=True).cee = cee
+
+    def _node(self, code: str, create: bool = False) -> CeeCodeNode | None:
+        node = self.root
+        segments = [segment.strip() for segment in code.split(CEE_CODE_SEPARATOR)]
+        for depth, segment in enumerate(segments):
+            child = node.children.get(segment)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[segment] = CeeCodeNode(CEE_CODE_SEPARATOR.join(segments[: depth + 1]))
+            node = child
+        return node
+
+    def descendants(self, code: str) -> list[ChartAccountCEE]:
+        """
+        CEE con codice uguale a `code` o sotto di esso nella gerarchia (B.7 -> B.7, B.7.a, B.7.b, ...)
+        """
+        node = self._node(code)
+        return list(node.walk()) if node else []
+
+    def ancestors(self, code: str) -> list[ChartAccountCEE]:
+        """
+        CEE che contengono `code` nella gerarchia, dal più generale al più specifico (B.7.a -> B, B.7)
+        """
+        ancestors = []
+        node = self.root
+        for segment in code.split(CEE_CODE_SEPARATOR)[:-1]:
+            node = node.children.get(segment.strip())
+            if node is None:
+                break
+            if node.cee:
+                ancestors.append(node.cee)
+        return ancestors
+
+
+_catalog: CeeCatalog | None = None
+_catalog_version = 0
+_catalog_lock = asyncio.Lock()
+
+
+async def get_cee_catalog() -> CeeCatalog:
+    """
+    Restituisce il catalogo CEE, caricandolo dal db solo alla prima richiesta o dopo un'invalidazione.
+    """
+    global _catalog
+    if _catalog is not None:
+        return _catalog
+
+    async with _catalog_lock:
+        if _catalog is not None:
+            return _catalog
+
+        version = _catalog_version
+        catalog = CeeCatalog(await prisma.chartaccountcee.find_many())
+        # se il catalogo è stato invalidato durante il caricamento questa copia potrebbe essere già vecchia
+        if version == _catalog_version:
+            _catalog = catalog
+        return catalog
+
+
+def invalidate_cee_catalog():
+    """Da chiamare dopo ogni scrittura sulla tabella ChartAccountCEE"""
+    global _catalog, _catalog_version
+    _catalog = None
+    _catalog_version += 1
@@ -0,0 +1,140 @@
+import re
+import unicodedata
+from functools import lru_cache
+from itertools import chain
+import numpy
+import pandas
+from core.services.cee_catalog import CeeCatalog, get_cee_catalog
+
+# lunghezze dei char n-gram: abbastanza corti da reggere abbreviazioni e refusi nelle descrizioni dei conti
+NGRAM_SIZES = (3, 4)
+
+# righe di descrizioni trasformate in vettori densi per volta: limita la memoria della moltiplicazione
+_BATCH_SIZE = 2048
+
+_NOT_ALPHANUMERIC = re.compile(r"[^a-z0-9]+")
+
+
+class CeeSuggestionIndex:
+    """
+    Indice TF-IDF a char n-gram delle descrizioni delle voci CEE foglia (quelle su cui si mappano i conti).
+
+    Il vocabolario è quello del catalogo: gli n-gram delle descrizioni dei conti che non compaiono in
+    nessuna voce non possono contribuire alla similarità e contano solo nella norma del vettore.
+    """
+
+    def __init__(self, catalog: CeeCatalog):
+        self.catalog = catalog
+        self.cee = [
+            cee for cee in catalog.by_id.values()
+            if cee.description and len(catalog.descendants(cee.code)) == 1
+        ]
+
+        documents = [_ngrams(f"{cee.code} {cee.description}") for cee in self.cee]
+        self.vocabulary: dict[str, int] = {}
+        for grams in documents:
+            for gram in grams:
+                self.vocabulary.setdefault(gram, len(self.vocabulary))
+
+        self._vocabulary_index = pandas.Index(list(self.vocabulary))
+
+        counts = numpy.zeros((len(self.cee), len(self.vocabulary)), dtype=numpy.float32)
+        for row, grams in enumerate(documents):
+            numpy.add.at(counts[row], [self.vocabulary[gram] for gram in grams], 1)
+
+        # idf smussato come in scikit-learn: ln((1 + n) / (1 + df)) + 1
+        document_frequency = (counts > 0).sum(axis=0)
+        self.idf = (numpy.log((1 + len(self.cee)) / (1 + document_frequency)) + 1).astype(numpy.float32)
+        # gli n-gram fuori vocabolario pesano come quelli presenti in un solo documento
+        self.unknown_idf = numpy.float32(numpy.log((1 + len(self.cee)) / 2) + 1)
+
+        weights = _sublinear(counts) * self.idf
+        # trasposta (vocabolario, voci) già normalizzata: lo score è il prodotto scalare
+        self.matrix = numpy.ascontiguousarray((weights / _norms(weights)[:, None]).T)
+
+    def suggest(self, descriptions: list[str], top_k: int = 3) -> list[list[tuple[str, float]]]:
+        """
+        Le `top_k` voci CEE più simili a ogni descrizione, con la similarità del coseno (0-1).
+
+        Le descrizioni sono vettorizzate e confrontate a blocchi, una moltiplicazione di matrici per blocco.
+        """
+        if not self.cee:
+            return [[] for _ in descriptions]
+        top_k = max(1, min(top_k, len(self.cee)))
+        suggestions = []
+        for start in range(0, len(descriptions), _BATCH_SIZE):
+            scores = self._vectorize(descriptions[start:start + _BATCH_SIZE]) @ self.matrix
+            best = numpy.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            best_scores = numpy.take_along_axis(scores, best, axis=1)
+            order = numpy.argsort(-best_scores, axis=1)
+            best = numpy.take_along_axis(best, order, axis=1)
+            best_scores = numpy.take_along_axis(best_scores, order, axis=1)
+            suggestions.extend(
+                [(self.cee[column].id, float(score)) for column, score in zip(columns, row_scores) if score > 0]
+                for columns, row_scores in zip(best.tolist(), best_scores.tolist())
+            )
+        return suggestions
+
+    def _vectorize(self, descriptions: list[str]) -> numpy.ndarray:
+        """
+        Vettori TF-IDF normalizzati delle descrizioni. Gli n-gram fuori vocabolario ricevono colonne
+        temporanee oltre il vocabolario: servono per la norma e vengono scartati nella matrice restituita.
+        """
+        size = len(self.vocabulary)
+        grams = [_ngrams(description or "") for description in descriptions]
+        rows = numpy.repeat(numpy.arange(len(descriptions)), [len(row_grams) for row_grams in grams])
+        grams = list(chain.from_iterable(grams))
+
+        columns = self._vocabulary_index.get_indexer(grams).astype(numpy.int64)
+        unknown = columns < 0
+        unknown_columns, unknown_grams = pandas.factorize(numpy.array(grams, dtype=object)[unknown])
+        columns[unknown] = size + unknown_columns
+
+        width = size + len(unknown_grams)
+        cells, counts = numpy.unique(rows * width + columns, return_counts=True)
+        cell_rows, cell_columns = numpy.divmod(cells, width)
+        known = cell_columns < size
+        weights = _sublinear(counts.astype(numpy.float32))
+        weights *= numpy.where(known, self.idf[numpy.minimum(cell_columns, size - 1)], self.unknown_idf)
+        norms = numpy.sqrt(numpy.bincount(cell_rows, weights=weights * weights, minlength=len(descriptions)))
+
+        vectors = numpy.zeros((len(descriptions), size), dtype=numpy.float32)
+        vectors[cell_rows[known], cell_columns[known]] = weights[known] / norms[cell_rows[known]]
+        return vectors
+
+
+_index: CeeSuggestionIndex | None = None
+
+
+async def get_cee_suggestion_index() -> CeeSuggestionIndex:
+    """Indice del catalogo CEE corrente, ricostruito solo quando il catalogo viene ricaricato"""
+    global _index
+    catalog = await get_cee_catalog()
+    if _index is None or _index.catalog is not catalog:
+        _index = CeeSuggestionIndex(catalog)
+    return _index
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode()
+    return _NOT_ALPHANUMERIC.sub(" ", text).strip()
+
+
+def _ngrams(text: str) -> list[str]:
+    return list(chain.from_iterable(map(_word_ngrams, _normalize(text).split())))
+
+
+@lru_cache(maxsize=65536)
+def _word_ngrams(word: str) -> tuple[str, ...]:
+    """Char n-gram di una parola, con uno spazio ai bordi per distinguere inizio e fine parola"""
+    word = f" {word} "
+    return tuple(word[position:position + size] for size in NGRAM_SIZES for position in range(len(word) - size + 1))
+
+
+def _sublinear(counts: numpy.ndarray) -> numpy.ndarray:
+    return numpy.log1p(counts, dtype=numpy.float32)
+
+
+def _norms(matrix: numpy.ndarray) -> numpy.ndarray:
+    norms = numpy.linalg.norm(matrix, axis=1)
+    return numpy.where(norms > 0, norms, 1)
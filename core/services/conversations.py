@@ -0,0 +1,300 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from litellm import token_counter
+from prisma import Json
+from pydantic_ai import Agent
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelMessagesTypeAdapter,
+    ModelRequest,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+from core.services.prisma import prisma
+
+# token della history (riassunto + turni) inviata al modello a ogni turno, indipendente dalla lunghezza
+# della conversazione
+HISTORY_TOKEN_BUDGET = 6000
+# oltre il budget i turni più vecchi vengono riassunti finché i turni rimasti scendono sotto questa soglia
+COMPACTION_TARGET_TOKENS = HISTORY_TOKEN_BUDGET // 2
+# turni più recenti mai compattati, perché il modello veda sempre lo scambio immediatamente precedente
+MIN_RECENT_TURNS = 2
+SUMMARY_MAX_TOKENS = 800
+MAX_CACHED_CONVERSATIONS = 512
+TITLE_MAX_LENGTH = 80
+
+SUMMARY_INSTRUCTIONS = (
+    "You compact the history of a conversation between a user and a financial assistant. "
+    "Merge the previous summary (if any) with the new exchanges into a single summary in the language "
+    "of the conversation. Keep figures, periods, accounts, decisions and open questions exactly as stated; "
+    f"drop greetings and repetitions. Answer with the summary only, in at most {SUMMARY_MAX_TOKENS // 2} words."
+)
+
+
+class ConversationNotFound(Exception):
+    pass
+
+
+@dataclass
+class StoredTurn:
+    id: str
+    tokens: int
+    messages: list[ModelMessage]
+
+
+@dataclass
+class ConversationHistory:
+    """Stato in memoria di una conversazione: prompt di sistema, riassunto e turni non compattati"""
+
+    conversation_id: str
+    updated_at: datetime
+    title: str | None
+    system_prompt: str | None
+    summary: str | None
+    summary_tokens: int
+    turns: list[StoredTurn] = field(default_factory=list)
+
+    @property
+    def pending_tokens(self) -> int:
+        return sum(turn.tokens for turn in self.turns)
+
+    def window(self) -> list[ModelMessage]:
+        """
+        Messaggi da passare come `message_history`: prompt di sistema, riassunto e i turni più recenti
+        che stanno nel budget. Vuota per una conversazione nuova, così l'agente usa il suo prompt di sistema.
+        """
+        if not self.turns:
+            return []
+
+        budget = HISTORY_TOKEN_BUDGET - self.summary_tokens
+        start = len(self.turns)
+        while start > 0 and budget - self.turns[start - 1].tokens >= 0:
+            start -= 1
+            budget -= self.turns[start].tokens
+
+        head = [SystemPromptPart(content=self.system_prompt)] if self.system_prompt else []
+        if self.summary:
+            head.append(SystemPromptPart(content=f"Summary of the earlier conversation:\n{self.summary}"))
+        messages: list[ModelMessage] = [ModelRequest(parts=head)] if head else []
+        for turn in self.turns[start:]:
+            messages.extend(turn.messages)
+        return messages
+
+
+class ConversationStore:
+    """
+    Conversazioni degli agenti su db, con la history di ogni turno limitata a `HISTORY_TOKEN_BUDGET` token.
+
+    Quando i turni non compattati superano il budget, i più vecchi vengono riassunti in background e
+    sostituiti dal riassunto: la dimensione del prompt, e con essa latenza e consumo di token, resta
+    costante anche nelle conversazioni lunghe.
+
+    I turni già deserializzati restano in memoria; la copia è valida finché `updatedAt` della conversazione
+    non cambia, quindi anche le modifiche fatte da altri processi vengono viste al turno successivo.
+    """
+
+    def __init__(self, max_cached: int = MAX_CACHED_CONVERSATIONS):
+        self.max_cached = max_cached
+        self._histories: OrderedDict[str, ConversationHistory] = OrderedDict()
+        self._compacting: dict[str, asyncio.Task] = {}
+
+    async def create(self, agent: str, user_id: str, organization_id: str | None) -> str:
+        conversation = await prisma.conversation.create(
+            data={
+                "agent": agent,
+                "user": {"connect": {"id": user_id}},
+                **({"organization": {"connect": {"id": organization_id}}} if organization_id else {}),
+            }
+        )
+        return conversation.id
+
+    async def history(self, conversation_id: str, user_id: str, agent: str) -> ConversationHistory:
+        """
+        Raises:
+            ConversationNotFound: se la conversazione non esiste, è di un altro utente o di un altro agente
+        """
+        conversation = await prisma.conversation.find_unique(where={"id": conversation_id})
+        if not conversation or conversation.userId != user_id or conversation.agent != agent:
+            raise ConversationNotFound(f"Conversation {conversation_id} not found")
+
+        cached = self._histories.get(conversation_id)
+        if cached and cached.updated_at == conversation.updatedAt:
+            self._histories.move_to_end(conversation_id)
+            return cached
+
+        turns = await prisma.conversationturn.find_many(
+            where={"conversationId": conversation_id, "compacted": False},
+            order={"createdAt": "asc"},
+        )
+        history = ConversationHistory(
+            conversation_id=conversation_id,
+            updated_at=conversation.updatedAt,
+            title=conversation.title,
+            system_prompt=conversation.systemPrompt,
+            summary=conversation.summary,
+            summary_tokens=conversation.summaryTokens,
+            turns=[
+                StoredTurn(
+                    id=turn.id,
+                    tokens=turn.tokens,
+                    messages=ModelMessagesTypeAdapter.validate_python(turn.messages),
+                )
+                for turn in turns
+            ],
+        )
+        self._remember(history)
+        return history
+
+    async def append_turn(
+        self, history: ConversationHistory, prompt: str, output: str, messages: list[ModelMessage], model=None
+    ):
+        """
+        Salva un turno con i suoi messaggi (`result.new_messages()`) e, se la history supera il budget,
+        avvia la compattazione in background con il modello indicato.
+        """
+        system_prompt, messages = _split_system_prompt(messages)
+        tokens = count_message_tokens(messages)
+
+        async with prisma.tx() as transaction:
+            turn = await transaction.conversationturn.create(
+                data={
+                    "conversationId": history.conversation_id,
+                    "prompt": prompt,
+                    "output": output,
+                    "messages": Json(ModelMessagesTypeAdapter.dump_python(messages, mode="json")),
+                    "tokens": tokens,
+                }
+            )
+            # updatedAt cambia a ogni turno: invalida le copie in memoria degli altri processi
+            data = {"updatedAt": datetime.now(timezone.utc)}
+            if system_prompt and not history.system_prompt:
+                data["systemPrompt"] = system_prompt
+            if not history.title:
+                data["title"] = _title(prompt)
+            conversation = await transaction.conversation.update(where={"id": history.conversation_id}, data=data)
+
+        if system_prompt and not history.system_prompt:
+            history.system_prompt = system_prompt
+        history.title = conversation.title
+        history.turns.append(StoredTurn(id=turn.id, tokens=tokens, messages=messages))
+        history.updated_at = conversation.updatedAt
+        self._remember(history)
+
+        if model is not None and history.pending_tokens > HISTORY_TOKEN_BUDGET - history.summary_tokens:
+            self._schedule_compaction(history, model)
+
+    def _schedule_compaction(self, history: ConversationHistory, model):
+        task = self._compacting.get(history.conversation_id)
+        if task is None or task.done():
+            self._compacting[history.conversation_id] = asyncio.create_task(self._compact(history, model))
+
+    async def _compact(self, history: ConversationHistory, model):
+        # i turni più vecchi fino a riportare i restanti sotto la soglia, lasciando sempre gli ultimi
+        compacted: list[StoredTurn] = []
+        remaining = history.pending_tokens
+        for turn in history.turns[:-MIN_RECENT_TURNS]:
+            if remaining <= COMPACTION_TARGET_TOKENS:
+                break
+            compacted.append(turn)
+            remaining -= turn.tokens
+        if not compacted:
+            return
+
+        try:
+            transcript = "\n\n".join(_turn_transcript(turn.messages) for turn in compacted)
+            summarizer = Agent(
+                model,
+                system_prompt=SUMMARY_INSTRUCTIONS,
+                model_settings={"temperature": 0.2, "max_tokens": SUMMARY_MAX_TOKENS},
+            )
+            result = await summarizer.run(
+                f"Previous summary:\n{history.summary or '(none)'}\n\nNew exchanges:\n{transcript}"
+            )
+            summary = result.output
+            summary_tokens = count_tokens(summary)
+
+            compacted_ids = {turn.id for turn in compacted}
+            async with prisma.tx() as transaction:
+                await transaction.conversationturn.update_many(
+                    where={"id": {"in": list(compacted_ids)}}, data={"compacted": True}
+                )
+                conversation = await transaction.conversation.update(
+                    where={"id": history.conversation_id},
+                    data={"summary": summary, "summaryTokens": summary_tokens},
+                )
+        except Exception as e:
+            # la history resta valida: finché la compattazione non riesce la finestra esclude i turni più vecchi
+            logging.error("Error compacting conversation %s: %s", history.conversation_id, e)
+            return
+
+        history.summary = summary
+        history.summary_tokens = summary_tokens
+        history.turns = [turn for turn in history.turns if turn.id not in compacted_ids]
+        history.updated_at = conversation.updatedAt
+
+    def _remember(self, history: ConversationHistory):
+        self._histories[history.conversation_id] = history
+        self._histories.move_to_end(history.conversation_id)
+        while len(self._histories) > self.max_cached:
+            self._histories.popitem(last=False)
+
+
+def count_tokens(text: str) -> int:
+    return token_counter(text=text) if text else 0
+
+
+def count_message_tokens(messages: list[ModelMessage]) -> int:
+    return count_tokens("\n".join(_part_text(part) for message in messages for part in message.parts))
+
+
+def _title(prompt: str) -> str:
+    title = " ".join(prompt.split())
+    return title if len(title) <= TITLE_MAX_LENGTH else title[: TITLE_MAX_LENGTH - 1].rstrip() + "…"
+
+
+def _split_system_prompt(messages: list[ModelMessage]) -> tuple[str | None, list[ModelMessage]]:
+    """
+    Separa il prompt di sistema, presente solo nel primo turno, dai messaggi: viene salvato una volta sulla
+    conversazione e rimesso in testa alla finestra, così non si perde quando il primo turno viene compattato.
+    """
+    system_parts: list[str] = []
+    stripped: list[ModelMessage] = []
+    for message in messages:
+        if isinstance(message, ModelRequest):
+            system_parts.extend(part.content for part in message.parts if isinstance(part, SystemPromptPart))
+            parts = [part for part in message.parts if not isinstance(part, SystemPromptPart)]
+            if not parts:
+                continue
+            message = ModelRequest(parts=parts, instructions=message.instructions)
+        stripped.append(message)
+    return ("\n\n".join(system_parts) or None), stripped
+
+
+def _part_text(part) -> str:
+    if isinstance(part, ToolCallPart):
+        return f"{part.tool_name} {part.args_as_json_str()}"
+    if isinstance(part, ToolReturnPart):
+        return part.model_response_str()
+    content = getattr(part, "content", "")
+    return content if isinstance(content, str) else str(content)
+
+
+def _turn_transcript(messages: list[ModelMessage]) -> str:
+    # al riassunto servono le domande e le risposte; i risultati dei tool sono già riflessi nelle risposte
+    lines = []
+    for message in messages:
+        for part in message.parts:
+            if isinstance(part, UserPromptPart) and isinstance(part.content, str):
+                lines.append(f"User: {part.content}")
+            elif isinstance(part, TextPart) and part.content:
+                lines.append(f"Assistant: {part.content}")
+    return "\n".join(lines)
+
+
+conversation_store = ConversationStore()
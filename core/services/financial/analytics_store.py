@@ -0,0 +1,298 @@
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+import pandas
+import pyarrow
+import pyarrow.parquet
+from core.services.cee_catalog import get_cee_catalog
+from core.services.prisma import prisma
+from core.settings import settings
+from core.services.financial.reclassification import BALANCE_SQL
+
+try:
+    import duckdb
+except ImportError:  # extra "analytics" non installato: lo store non è disponibile
+    duckdb = None
+
+# righe massime restituite da una query, per non riempire il contesto dell'agente
+MAX_QUERY_ROWS = 5000
+
+_MANIFEST_FILE = "manifest.json"
+
+# impronta dei valori di ogni mese, compresi quelli dell'anno precedente: se cambia il mese va riesportato
+_MONTH_FINGERPRINTS_QUERY = """
+SELECT s."year" AS "year",
+       s."month" AS "month",
+       MAX(v."updatedAt")::text AS "updatedAt",
+       COUNT(v."id")::int AS "rows"
+FROM "IncomeStatement" s
+JOIN "ValuesCostsRevenues" v ON v."incomeStatementId" = s."id"
+WHERE s."organizationId" = $1::uuid
+GROUP BY s."year", s."month"
+"""
+
+_CHART_ACCOUNTS_FINGERPRINT_QUERY = """
+SELECT MAX(a."updatedAt")::text AS "updatedAt", COUNT(a."id")::int AS "rows"
+FROM "ChartAccount" a
+JOIN "IncomeStatementConversionTable" t ON t."id" = a."incomeStatementConversionTableId"
+WHERE t."organizationId" = $1::uuid
+"""
+
+_MONTH_VALUES_QUERY = f"""
+SELECT s."year" AS "year",
+       s."month" AS "month",
+       v."chartAccountId" AS "chart_account_id",
+       v."debit" AS "debit",
+       v."credit" AS "credit",
+       {BALANCE_SQL} AS "balance",
+       v."isPreviousYear" AS "is_previous_year"
+FROM "ValuesCostsRevenues" v
+JOIN "IncomeStatement" s ON s."id" = v."incomeStatementId"
+WHERE s."organizationId" = $1::uuid
+  AND s."year" = $2
+  AND s."month" = $3
+"""
+
+_CHART_ACCOUNTS_QUERY = """
+SELECT a."id" AS "id",
+       a."code" AS "code",
+       a."description" AS "description",
+       a."type"::text AS "type",
+       a."accountType"::text AS "account_type",
+       a."toConsider" AS "to_consider",
+       a."chartAccountCEEdebitId" AS "debit_cee_id",
+       a."chartAccountCEEcreditId" AS "credit_cee_id",
+       a."deletedAt" IS NOT NULL AS "deleted"
+FROM "ChartAccount" a
+JOIN "IncomeStatementConversionTable" t ON t."id" = a."incomeStatementConversionTableId"
+WHERE t."organizationId" = $1::uuid
+"""
+
+VALUES_SCHEMA = pyarrow.schema([
+    ("year", pyarrow.int32()),
+    ("month", pyarrow.int32()),
+    ("chart_account_id", pyarrow.string()),
+    ("debit", pyarrow.float64()),
+    ("credit", pyarrow.float64()),
+    ("balance", pyarrow.float64()),
+    ("is_previous_year", pyarrow.bool_()),
+])
+
+CHART_ACCOUNTS_SCHEMA = pyarrow.schema([
+    ("id", pyarrow.string()),
+    ("code", pyarrow.string()),
+    ("description", pyarrow.string()),
+    ("type", pyarrow.string()),
+    ("account_type", pyarrow.string()),
+    ("to_consider", pyarrow.bool_()),
+    ("debit_cee_id", pyarrow.string()),
+    ("credit_cee_id", pyarrow.string()),
+    ("deleted", pyarrow.bool_()),
+])
+
+CEE_SCHEMA = pyarrow.schema([
+    ("id", pyarrow.string()),
+    ("code", pyarrow.string()),
+    ("description", pyarrow.string()),
+])
+
+# descrizione delle tabelle interrogabili, usata anche nella docstring del tool dell'agente
+ANALYTICS_TABLES_DESCRIPTION = """
+values_costs_revenues(year, month, chart_account_id, debit, credit, balance, is_previous_year):
+    monthly values per account; balance is debit - credit (costs positive, revenues negative)
+chart_accounts(id, code, description, type, account_type, to_consider, debit_cee_id, credit_cee_id, deleted)
+chart_accounts_cee(id, code, description): CEE lines, codes are hierarchical (B, B.7, B.7.a)
+""".strip()
+
+
+class AnalyticsStoreUnavailable(Exception):
+    pass
+
+
+class AnalyticsQueryError(Exception):
+    pass
+
+
+def analytics_store_available() -> bool:
+    return duckdb is not None
+
+
+class _OrganizationStore:
+    """Connessione DuckDB in memoria con le tabelle caricate dagli snapshot Parquet di un'organizzazione"""
+
+    def __init__(self, directory: str, version: str):
+        self.version = version
+        self.connection = duckdb.connect(":memory:")
+        for table, (pattern, schema) in _snapshot_tables(directory).items():
+            if glob.glob(pattern):
+                self.connection.execute(f"CREATE TABLE {table} AS SELECT * FROM read_parquet('{pattern}')")
+            else:
+                # organizzazione senza dati: la tabella esiste comunque, vuota
+                self.connection.from_arrow(schema.empty_table()).create(table)
+        # le query arrivano dall'agente: dopo il caricamento niente accesso a file o rete e configurazione bloccata
+        self.connection.execute("SET enable_external_access = false")
+        self.connection.execute("SET lock_configuration = true")
+
+    def query(self, sql: str, max_rows: int) -> dict:
+        try:
+            statements = self.connection.extract_statements(sql)
+        except duckdb.Error as e:
+            raise AnalyticsQueryError(str(e))
+        if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+            raise AnalyticsQueryError("Only a single SELECT statement is allowed")
+
+        # ogni query usa un proprio cursore: la connessione può servire più thread insieme
+        cursor = self.connection.cursor()
+        try:
+            result = cursor.execute(sql)
+            columns = [column[0] for column in result.description]
+            rows = result.fetchmany(max_rows + 1)
+        except duckdb.Error as e:
+            raise AnalyticsQueryError(str(e))
+        finally:
+            cursor.close()
+
+        return {
+            "columns": columns,
+            "rows": [list(row) for row in rows[:max_rows]],
+            "truncated": len(rows) > max_rows,
+        }
+
+
+_stores: dict[str, _OrganizationStore] = {}
+_store_locks: dict[str, asyncio.Lock] = {}
+
+
+async def refresh_analytics_snapshot(organization_id: str) -> str:
+    """
+    Aggiorna gli snapshot Parquet dell'organizzazione riesportando solo i mesi e le tabelle cambiate.
+
+    Returns:
+        str: versione dello snapshot, cambia solo se è stato riscritto qualcosa
+    """
+    directory = _organization_dir(organization_id)
+    manifest = _read_manifest(directory)
+    months = manifest.get("months", {})
+    changed = False
+
+    fingerprints = {
+        f"{row['year']}-{row['month']:02d}": [row["updatedAt"], row["rows"]]
+        for row in await prisma.query_raw(_MONTH_FINGERPRINTS_QUERY, organization_id)
+    }
+    for key in months.keys() - fingerprints.keys():
+        _remove(os.path.join(directory, "values", f"{key}.parquet"))
+        changed = True
+    for key, fingerprint in fingerprints.items():
+        if months.get(key) == fingerprint:
+            continue
+        year, month = map(int, key.split("-"))
+        rows = await prisma.query_raw(_MONTH_VALUES_QUERY, organization_id, year, month)
+        await asyncio.to_thread(_write_parquet, rows, VALUES_SCHEMA, os.path.join(directory, "values", f"{key}.parquet"))
+        changed = True
+
+    chart_accounts_fingerprint = (await prisma.query_raw(_CHART_ACCOUNTS_FINGERPRINT_QUERY, organization_id))[0]
+    chart_accounts_fingerprint = [chart_accounts_fingerprint["updatedAt"], chart_accounts_fingerprint["rows"]]
+    if manifest.get("chartAccounts") != chart_accounts_fingerprint:
+        rows = await prisma.query_raw(_CHART_ACCOUNTS_QUERY, organization_id)
+        await asyncio.to_thread(_write_parquet, rows, CHART_ACCOUNTS_SCHEMA, os.path.join(directory, "chart_accounts.parquet"))
+        changed = True
+
+    # il catalogo CEE è già in memoria: lo snapshot viene riscritto solo se il suo contenuto è cambiato
+    catalog = await get_cee_catalog()
+    rows = sorted(
+        ({"id": cee.id, "code": cee.code, "description": cee.description} for cee in catalog.by_id.values()),
+        key=lambda row: row["id"],
+    )
+    cee_fingerprint = hashlib.sha256(json.dumps(rows).encode()).hexdigest()
+    if manifest.get("cee") != cee_fingerprint:
+        await asyncio.to_thread(_write_parquet, rows, CEE_SCHEMA, os.path.join(directory, "chart_accounts_cee.parquet"))
+        changed = True
+
+    if changed or "version" not in manifest:
+        manifest = {
+            "version": datetime.now().isoformat(),
+            "months": fingerprints,
+            "chartAccounts": chart_accounts_fingerprint,
+            "cee": cee_fingerprint,
+        }
+        _write_manifest(directory, manifest)
+
+    return manifest["version"]
+
+
+async def query_analytics(organization_id: str, sql: str, max_rows: int = MAX_QUERY_ROWS) -> dict:
+    """
+    Esegue una query SQL di sola lettura sullo store analitico dell'organizzazione.
+
+    Prima della query gli snapshot vengono aggiornati se i dati su Postgres sono cambiati; la query gira
+    in un thread su DuckDB e non tocca il database.
+
+    Raises:
+        AnalyticsStoreUnavailable: se duckdb non è installato
+        AnalyticsQueryError: se la query non è una singola SELECT o fallisce
+    """
+    if not analytics_store_available():
+        raise AnalyticsStoreUnavailable("Install the 'analytics' extra to enable the analytics store")
+
+    lock = _store_locks.setdefault(organization_id, asyncio.Lock())
+    async with lock:
+        version = await refresh_analytics_snapshot(organization_id)
+        store = _stores.get(organization_id)
+        if store is None or store.version != version:
+            store = await asyncio.to_thread(_OrganizationStore, _organization_dir(organization_id), version)
+            _stores[organization_id] = store
+
+    return await asyncio.to_thread(store.query, sql, max_rows)
+
+
+def _store_dir() -> str:
+    directory = settings.requrv_analytics_store_dir or os.path.join(tempfile.gettempdir(), "requrv-analytics")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _organization_dir(organization_id: str) -> str:
+    directory = os.path.join(_store_dir(), organization_id)
+    os.makedirs(os.path.join(directory, "values"), exist_ok=True)
+    return directory
+
+
+def _snapshot_tables(directory: str) -> dict[str, tuple[str, pyarrow.Schema]]:
+    return {
+        "values_costs_revenues": (os.path.join(directory, "values", "*.parquet"), VALUES_SCHEMA),
+        "chart_accounts": (os.path.join(directory, "chart_accounts.parquet"), CHART_ACCOUNTS_SCHEMA),
+        "chart_accounts_cee": (os.path.join(directory, "chart_accounts_cee.parquet"), CEE_SCHEMA),
+    }
+
+
+def _write_parquet(rows: list[dict], schema: pyarrow.Schema, path: str):
+    df = pandas.DataFrame.from_records(rows, columns=schema.names)
+    table = pyarrow.Table.from_pandas(df, schema=schema, preserve_index=False)
+    partial_path = path + ".partial"
+    pyarrow.parquet.write_table(table, partial_path)
+    os.replace(partial_path, path)
+
+
+def _read_manifest(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, _MANIFEST_FILE)) as manifest_file:
+            return json.load(manifest_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_manifest(directory: str, manifest: dict):
+    partial_path = os.path.join(directory, _MANIFEST_FILE + ".partial")
+    with open(partial_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(partial_path, os.path.join(directory, _MANIFEST_FILE))
+
+
+def _remove(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
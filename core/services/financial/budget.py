@@ -0,0 +1,188 @@
+import time
+from dataclasses import dataclass
+import numpy
+import pandas
+from core.services.cee_catalog import get_cee_catalog
+from core.services.prisma import prisma
+from core.services.response_cache import invalidate_organization_responses
+from core.services.financial.reclassification import (
+    MONTHS,
+    account_balances_from_rows,
+    resolve_cee_ids,
+)
+
+# Saldi effettivi e budget dello stesso anno in un'unica query. Gli effettivi sono i saldi mensili per conto
+# dei totali storicizzati, come in `_ACCOUNT_BALANCES_QUERY`, così la voce DARE/AVERE scelta dal segno è la
+# stessa del conto economico riclassificato e dei KPI. Le righe di budget hanno le stesse colonne, con la voce
+# CEE come voce di DARE, così passano dalla stessa `resolve_cee_ids`.
+_VARIANCE_QUERY = """
+SELECT 'actual' AS "source",
+       m."year" AS "year",
+       m."month" AS "month",
+       m."chartAccountId" AS "chartAccountId",
+       m."balance" AS "balance",
+       a."chartAccountCEEdebitId" AS "debitCeeId",
+       a."chartAccountCEEcreditId" AS "creditCeeId"
+FROM "HistoricalMonthlyBalance" m
+JOIN "ChartAccount" a ON a."id" = m."chartAccountId"
+WHERE m."organizationId" = $1::uuid
+  AND m."year" = $2
+  AND a."toConsider" = true
+  AND a."deletedAt" IS NULL
+UNION ALL
+SELECT 'budget' AS "source",
+       b."year" AS "year",
+       b."month" AS "month",
+       NULL AS "chartAccountId",
+       b."amount" AS "balance",
+       b."chartAccountCEEId" AS "debitCeeId",
+       NULL AS "creditCeeId"
+FROM "BudgetLine" b
+WHERE b."organizationId" = $1::uuid
+  AND b."year" = $2
+"""
+
+_UPSERT_BUDGET_LINES_QUERY = """
+INSERT INTO "BudgetLine" ("id", "organizationId", "chartAccountCEEId", "year", "month", "amount", "createdAt", "updatedAt")
+SELECT gen_random_uuid(), $1::uuid, l."chartAccountCEEId", l."year", l."month", l."amount", now(), now()
+FROM unnest($2::uuid[], $3::int[], $4::int[], $5::float8[]) AS l("chartAccountCEEId", "year", "month", "amount")
+ON CONFLICT ("organizationId", "chartAccountCEEId", "year", "month") DO UPDATE
+SET "amount" = EXCLUDED."amount",
+    "updatedAt" = now()
+"""
+
+# la varianza di un anno resta in cache per la durata di una conversazione con l'agente; viene invalidata
+# quando cambiano budget o valori, il TTL copre le modifiche fatte da altri processi
+_VARIANCE_CACHE_TTL_SECONDS = 600
+_variance_cache: dict[tuple[str, int], tuple["BudgetVariance", float]] = {}
+
+
+@dataclass
+class BudgetVariance:
+    """
+    Budget ed effettivo per voce CEE e mese (gennaio = 0), con la stessa convenzione di segno del
+    conto economico riclassificato (DARE - AVERE). La varianza è effettivo - budget.
+    """
+
+    organization_id: str
+    year: int
+    cee_ids: list[str]
+    actual: numpy.ndarray
+    budget: numpy.ndarray
+
+    @property
+    def variance(self) -> numpy.ndarray:
+        return self.actual - self.budget
+
+    @property
+    def variance_percentage(self) -> numpy.ndarray:
+        budget = numpy.abs(self.budget)
+        return numpy.divide(self.variance * 100, budget, out=numpy.full(budget.shape, numpy.nan), where=budget != 0)
+
+    async def to_dict(self, month: int | None = None) -> dict:
+        catalog = await get_cee_catalog()
+        columns = slice(month - 1, month) if month else slice(None)
+        actual = self.actual[:, columns]
+        budget = self.budget[:, columns]
+        variance = self.variance[:, columns]
+        percentage = self.variance_percentage[:, columns]
+        percentage = numpy.where(numpy.isnan(percentage), None, percentage)
+
+        lines = []
+        for index, cee_id in enumerate(self.cee_ids):
+            cee = catalog.by_id.get(cee_id)
+            lines.append({
+                "ceeId": cee_id,
+                "code": cee.code if cee else None,
+                "description": cee.description if cee else None,
+                "actual": actual[index].tolist(),
+                "budget": budget[index].tolist(),
+                "variance": variance[index].tolist(),
+                "variancePercentage": percentage[index].tolist(),
+                "totalActual": float(actual[index].sum()),
+                "totalBudget": float(budget[index].sum()),
+                "totalVariance": float(variance[index].sum()),
+            })
+        return {
+            "organizationId": self.organization_id,
+            "year": self.year,
+            "months": [month] if month else list(range(1, MONTHS + 1)),
+            "lines": sorted(lines, key=lambda line: line["code"] or ""),
+        }
+
+
+async def compute_budget_variance(organization_id: str, year: int) -> BudgetVariance:
+    """Budget ed effettivo di un anno con un'unica query, allineati per voce CEE con una bincount"""
+    rows = await prisma.query_raw(_VARIANCE_QUERY, organization_id, year)
+    is_budget = numpy.array([row["source"] == "budget" for row in rows], dtype=bool)
+    balances = account_balances_from_rows(rows)
+
+    cee_codes, cee_ids = pandas.factorize(resolve_cee_ids(balances), use_na_sentinel=True)
+    index = cee_codes * MONTHS + balances.months - 1
+    mapped = cee_codes >= 0
+    size = len(cee_ids) * MONTHS
+
+    def totals(mask: numpy.ndarray) -> numpy.ndarray:
+        return numpy.bincount(index[mask], weights=balances.balances[mask], minlength=size).reshape(len(cee_ids), MONTHS)
+
+    return BudgetVariance(
+        organization_id=organization_id,
+        year=year,
+        cee_ids=list(cee_ids),
+        actual=totals(mapped & ~is_budget),
+        budget=totals(mapped & is_budget),
+    )
+
+
+async def get_budget_variance(organization_id: str, year: int) -> BudgetVariance:
+    """Varianza budget/effettivo dell'anno, dalla cache se calcolata da poco"""
+    cached = _variance_cache.get((organization_id, year))
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    variance = await compute_budget_variance(organization_id, year)
+    _variance_cache[(organization_id, year)] = (variance, time.monotonic() + _VARIANCE_CACHE_TTL_SECONDS)
+    return variance
+
+
+def invalidate_budget_variance(organization_id: str, year: int | None = None):
+    """Da chiamare quando cambiano i budget o i valori dell'organizzazione; senza `year` vale per tutti gli anni"""
+    for key in list(_variance_cache):
+        if key[0] == organization_id and (year is None or key[1] == year):
+            _variance_cache.pop(key, None)
+
+
+async def upsert_budget_lines(organization_id: str, lines: list[dict]) -> int:
+    """
+    Inserisce o aggiorna le righe di budget in un'unica istruzione.
+
+    Args:
+        lines: dict con `chartAccountCEEId`, `year`, `month` e `amount`
+
+    Returns:
+        int: numero di righe scritte
+    """
+    # una sola riga per (voce, anno, mese): ON CONFLICT non può aggiornare la stessa riga due volte
+    lines = list({(line["chartAccountCEEId"], line["year"], line["month"]): line for line in lines}.values())
+    if not lines:
+        return 0
+
+    written = await prisma.execute_raw(
+        _UPSERT_BUDGET_LINES_QUERY,
+        organization_id,
+        [line["chartAccountCEEId"] for line in lines],
+        [line["year"] for line in lines],
+        [line["month"] for line in lines],
+        [float(line["amount"]) for line in lines],
+    )
+    for year in {line["year"] for line in lines}:
+        invalidate_budget_variance(organization_id, year)
+    invalidate_organization_responses(organization_id)
+    return written
+
+
+async def get_budget_lines(organization_id: str, year: int):
+    return await prisma.budgetline.find_many(
+        where={"organizationId": organization_id, "year": year},
+        order=[{"month": "asc"}],
+    )
@@ -0,0 +1,170 @@
+from dataclasses import dataclass
+import numpy
+import pandas
+from core.services.cee_catalog import get_cee_catalog
+from core.services.prisma import prisma
+from core.services.financial.reclassification import (
+    BALANCE_SQL,
+    AccountBalances,
+    load_account_balances,
+    resolve_cee_ids,
+)
+from core.services.financial.rollups import load_yearly_account_balances
+
+# Percentuale di variazione di ogni valore rispetto allo stesso conto e mese dell'anno precedente. Il valore
+# precedente è quello dell'IncomeStatement dell'anno prima; se manca si usa la colonna dell'anno precedente
+# (isPreviousYear) importata nello stesso IncomeStatement. Senza un valore precedente diverso da zero vale 0.
+# `updatedAt` non viene toccato: la percentuale è un dato derivato e non deve far ricalcolare i KPI.
+_FILL_PERCENTAGES_QUERY = f"""
+WITH current_values AS (
+    SELECT v."id", s."year", s."month", v."chartAccountId", {BALANCE_SQL} AS "balance"
+    FROM "ValuesCostsRevenues" v
+    JOIN "IncomeStatement" s ON s."id" = v."incomeStatementId"
+    WHERE s."organizationId" = $1::uuid
+      AND s."year" = ANY($2::int[])
+      AND v."isPreviousYear" = false
+),
+previous_year_values AS (
+    SELECT s."year" + 1 AS "year", s."month", v."chartAccountId", SUM({BALANCE_SQL}) AS "balance"
+    FROM "ValuesCostsRevenues" v
+    JOIN "IncomeStatement" s ON s."id" = v."incomeStatementId"
+    WHERE s."organizationId" = $1::uuid
+      AND s."year" + 1 = ANY($2::int[])
+      AND v."isPreviousYear" = false
+    GROUP BY s."year", s."month", v."chartAccountId"
+),
+previous_column_values AS (
+    SELECT s."year", s."month", v."chartAccountId", SUM({BALANCE_SQL}) AS "balance"
+    FROM "ValuesCostsRevenues" v
+    JOIN "IncomeStatement" s ON s."id" = v."incomeStatementId"
+    WHERE s."organizationId" = $1::uuid
+      AND s."year" = ANY($2::int[])
+      AND v."isPreviousYear" = true
+    GROUP BY s."year", s."month", v."chartAccountId"
+),
+percentages AS (
+    SELECT c."id",
+           CASE
+               WHEN COALESCE(p."balance", pc."balance", 0) = 0 THEN 0
+               ELSE (c."balance" - COALESCE(p."balance", pc."balance")) / ABS(COALESCE(p."balance", pc."balance")) * 100
+           END AS "percentage"
+    FROM current_values c
+    LEFT JOIN previous_year_values p USING ("year", "month", "chartAccountId")
+    LEFT JOIN previous_column_values pc USING ("year", "month", "chartAccountId")
+)
+UPDATE "ValuesCostsRevenues" v
+SET "percentage" = p."percentage"
+FROM percentages p
+WHERE v."id" = p."id"
+  AND v."percentage" IS DISTINCT FROM p."percentage"
+"""
+
+
+@dataclass
+class YearComparison:
+    """
+    Saldi annuali allineati per riga (voce CEE o conto) e per anno, con le variazioni tra anni consecutivi.
+
+    `amounts` ha una riga per chiave e una colonna per anno di `years`; `deltas` e `percentages` hanno una
+    colonna per ogni coppia di anni consecutivi. Le percentuali sono NaN se il valore precedente è zero.
+    """
+
+    years: list[int]
+    keys: numpy.ndarray
+    amounts: numpy.ndarray
+
+    @property
+    def deltas(self) -> numpy.ndarray:
+        return numpy.diff(self.amounts, axis=1)
+
+    @property
+    def percentages(self) -> numpy.ndarray:
+        previous = numpy.abs(self.amounts[:, :-1])
+        return numpy.divide(
+            self.deltas * 100, previous, out=numpy.full(previous.shape, numpy.nan), where=previous != 0
+        )
+
+    def rows(self, key_name: str) -> list[dict]:
+        deltas = self.deltas.tolist()
+        percentages = numpy.where(numpy.isnan(self.percentages), None, self.percentages).tolist()
+        return [
+            {
+                key_name: key,
+                "years": dict(zip(self.years, amounts)),
+                "deltas": [
+                    {"from": previous_year, "to": year, "absolute": delta, "percentage": percentage}
+                    for previous_year, year, delta, percentage in zip(self.years, self.years[1:], row_deltas, row_percentages)
+                ],
+            }
+            for key, amounts, row_deltas, row_percentages in zip(
+                self.keys.tolist(), self.amounts.tolist(), deltas, percentages
+            )
+        ]
+
+
+def align_by_year(keys: numpy.ndarray, years: numpy.ndarray, values: numpy.ndarray, compared_years: list[int]) -> YearComparison:
+    """
+    Somma `values` per (chiave, anno) allineando le chiavi per ordinamento: `numpy.unique` ordina le chiavi
+    una volta sola e l'indice inverso posiziona ogni valore nella sua riga, senza join per chiave.
+    I valori senza chiave o di anni non richiesti vengono ignorati.
+    """
+    compared = numpy.asarray(sorted(compared_years), dtype=numpy.int64)
+    year_index = numpy.searchsorted(compared, years)
+    valid = (year_index < len(compared)) & (compared[numpy.minimum(year_index, len(compared) - 1)] == years)
+    valid &= pandas.notna(keys)
+
+    unique_keys, key_index = numpy.unique(keys[valid].astype(str), return_inverse=True)
+    amounts = numpy.bincount(
+        key_index * len(compared) + year_index[valid],
+        weights=values[valid],
+        minlength=len(unique_keys) * len(compared),
+    ).reshape(len(unique_keys), len(compared))
+
+    return YearComparison(years=compared.tolist(), keys=unique_keys, amounts=amounts)
+
+
+async def compare_years(organization_id: str, years: list[int], include_accounts: bool = False) -> dict:
+    """
+    Confronto tra due o più anni per voce CEE e, se richiesto, per conto.
+
+    Le voci CEE partono dai totali mensili storicizzati, perché la voce di ogni conto dipende dal segno del
+    saldo del mese; i conti dai totali annuali storicizzati.
+    """
+    balances: AccountBalances = await load_account_balances(organization_id, sorted(years))
+
+    lines = align_by_year(resolve_cee_ids(balances), balances.years, balances.balances, years)
+    catalog = await get_cee_catalog()
+    line_rows = lines.rows("ceeId")
+    for row in line_rows:
+        cee = catalog.by_id.get(row["ceeId"])
+        row["code"] = cee.code if cee else None
+        row["description"] = cee.description if cee else None
+
+    comparison = {
+        "organizationId": organization_id,
+        "years": lines.years,
+        "lines": sorted(line_rows, key=lambda row: row["code"] or ""),
+    }
+    if include_accounts:
+        yearly = pandas.DataFrame.from_records(
+            await load_yearly_account_balances(organization_id, sorted(years)),
+            columns=["year", "chartAccountId", "balance"],
+        )
+        accounts = align_by_year(
+            yearly["chartAccountId"].to_numpy(dtype=object),
+            yearly["year"].to_numpy(dtype=numpy.int64),
+            yearly["balance"].to_numpy(dtype=numpy.float64),
+            years,
+        )
+        comparison["accounts"] = accounts.rows("chartAccountId")
+    return comparison
+
+
+async def fill_percentages(organization_id: str, years: list[int]) -> int:
+    """
+    Aggiorna in blocco `ValuesCostsRevenues.percentage` per gli anni indicati con un'unica istruzione SQL.
+
+    Returns:
+        int: numero di valori aggiornati
+    """
+    return await prisma.execute_raw(_FILL_PERCENTAGES_QUERY, organization_id, years)
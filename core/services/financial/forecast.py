@@ -0,0 +1,291 @@
+from dataclasses import dataclass
+import numpy
+import pandas
+from core.services.cee_catalog import CeeCatalog
+from core.services.prisma import prisma
+from core.services.financial.reclassification import (
+    MONTHS,
+    AccountBalances,
+    load_account_balances,
+    resolve_cee_ids,
+)
+
+PERCENTILES = [10, 50, 90]
+
+# smoothing di Holt-Winters additivo: livello, trend e stagionalità
+_ALPHA = 0.3
+_BETA = 0.05
+_GAMMA = 0.2
+
+
+@dataclass
+class MonthlyHistory:
+    """Storico mensile riclassificato: una riga per voce CEE, una colonna per mese da `start` in poi"""
+
+    cee_ids: list[str]
+    start: tuple[int, int]
+    amounts: numpy.ndarray
+
+
+@dataclass
+class Forecast:
+    """
+    Previsione per voce CEE: `baseline` ha forma (voci, mesi), `bands` (percentili, voci, mesi).
+    `total_bands` sono i percentili del risultato (ricavi - costi) di ogni mese, calcolati sugli scenari.
+    """
+
+    cee_ids: list[str]
+    periods: list[tuple[int, int]]
+    baseline: numpy.ndarray
+    bands: numpy.ndarray
+    total_bands: numpy.ndarray
+    paths: int
+
+    def to_dict(self, catalog: CeeCatalog, cee_ids: set[str] | None = None) -> dict:
+        periods = [f"{year}-{month:02d}" for year, month in self.periods]
+        lines = []
+        for index, cee_id in enumerate(self.cee_ids):
+            if cee_ids is not None and cee_id not in cee_ids:
+                continue
+            cee = catalog.by_id.get(cee_id)
+            lines.append({
+                "ceeId": cee_id,
+                "code": cee.code if cee else None,
+                "description": cee.description if cee else None,
+                "baseline": self.baseline[index].round(2).tolist(),
+                **{f"p{percentile}": self.bands[i, index].round(2).tolist() for i, percentile in enumerate(PERCENTILES)},
+            })
+        return {
+            "periods": periods,
+            "paths": self.paths,
+            "lines": sorted(lines, key=lambda line: line["code"] or ""),
+            "result": {f"p{percentile}": self.total_bands[i].round(2).tolist() for i, percentile in enumerate(PERCENTILES)},
+        }
+
+
+def monthly_history(balances: AccountBalances, years: list[int]) -> MonthlyHistory:
+    """
+    Aggrega i saldi per voce CEE e mese su più anni con un'unica bincount, con lo stesso ordine delle voci
+    per tutti gli anni (a differenza di `reclassify`, che lavora su un anno per volta).
+    """
+    years = sorted(years)
+    cee_codes, cee_ids = pandas.factorize(resolve_cee_ids(balances), use_na_sentinel=True)
+    periods = len(years) * MONTHS
+    period_index = (balances.years - years[0]) * MONTHS + balances.months - 1
+    mapped = (cee_codes >= 0) & (period_index >= 0) & (period_index < periods)
+
+    amounts = numpy.bincount(
+        cee_codes[mapped] * periods + period_index[mapped],
+        weights=balances.balances[mapped],
+        minlength=len(cee_ids) * periods,
+    ).reshape(len(cee_ids), periods)
+    return MonthlyHistory(cee_ids=list(cee_ids), start=(years[0], 1), amounts=amounts)
+
+
+def fit_linear_seasonal(history: numpy.ndarray, horizon: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Trend lineare ai minimi quadrati più stagionalità additiva mensile, per tutte le voci insieme.
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray]: previsione (voci, horizon) e residui (voci, mesi di storico)
+    """
+    lines, length = history.shape
+    t = numpy.arange(length, dtype=numpy.float64)
+    t_centered = t - t.mean()
+    slope = (history - history.mean(axis=1, keepdims=True)) @ t_centered / (t_centered @ t_centered)
+    intercept = history.mean(axis=1) - slope * t.mean()
+    trend = intercept[:, None] + slope[:, None] * t
+
+    seasonal = _seasonal_indices(history - trend, length)
+    fitted = trend + seasonal[:, numpy.arange(length) % MONTHS]
+
+    future = numpy.arange(length, length + horizon, dtype=numpy.float64)
+    forecast = intercept[:, None] + slope[:, None] * future + seasonal[:, (length + numpy.arange(horizon)) % MONTHS]
+    return forecast, history - fitted
+
+
+def fit_holt_winters(history: numpy.ndarray, horizon: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Holt-Winters additivo (ETS A,A,A) con parametri fissi. Il ciclo è sui mesi di storico, le voci sono
+    aggiornate tutte insieme come array. Servono almeno due anni di storico per inizializzare la stagionalità.
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray]: previsione (voci, horizon) ed errori a un passo (voci, mesi)
+    """
+    lines, length = history.shape
+    first_year = history[:, :MONTHS]
+    second_year = history[:, MONTHS:2 * MONTHS]
+    level = first_year.mean(axis=1)
+    trend = (second_year.mean(axis=1) - level) / MONTHS
+    seasonal = first_year - level[:, None]
+
+    errors = numpy.empty_like(history)
+    for t in range(length):
+        season = t % MONTHS
+        prediction = level + trend + seasonal[:, season]
+        errors[:, t] = history[:, t] - prediction
+        previous_level = level
+        level = _ALPHA * (history[:, t] - seasonal[:, season]) + (1 - _ALPHA) * (level + trend)
+        trend = _BETA * (level - previous_level) + (1 - _BETA) * trend
+        seasonal[:, season] = _GAMMA * (history[:, t] - level) + (1 - _GAMMA) * seasonal[:, season]
+
+    steps = numpy.arange(1, horizon + 1)
+    forecast = level[:, None] + trend[:, None] * steps + seasonal[:, (length + steps - 1) % MONTHS]
+    # i primi 12 errori servono solo a inizializzare la stagionalità
+    return forecast, errors[:, MONTHS:]
+
+
+def simulate(
+    baseline: numpy.ndarray,
+    residuals: numpy.ndarray,
+    paths: int,
+    level_smoothing: float,
+    seed: int | None = None,
+) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Scenari Monte Carlo attorno alla previsione, calcolati come operazioni su array (voci, mesi, scenari).
+
+    Gli shock sono normali correlati tra voci con la covarianza dei residui, così i totali tengono conto di
+    costi e ricavi che si muovono insieme. La covarianza ha rango al più pari ai mesi di storico: gli shock
+    vengono generati nello spazio ridotto dei suoi fattori e poi proiettati sulle voci con un solo prodotto
+    matriciale. Con `level_smoothing` > 0 ogni shock si propaga ai mesi successivi come nei modelli ETS:
+    errore_h = e_h + alpha * somma(e_1 .. e_h-1).
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray]: percentili per voce (percentili, voci, mesi) e del risultato (percentili, mesi)
+    """
+    lines, horizon = baseline.shape
+    rng = numpy.random.default_rng(seed)
+    factor = _covariance_factor(residuals)
+    rank = factor.shape[1]
+
+    shocks = rng.standard_normal((rank, horizon, paths), dtype=numpy.float32)
+    if level_smoothing:
+        accumulated = numpy.cumsum(shocks, axis=1)
+        accumulated -= shocks
+        shocks += numpy.float32(level_smoothing) * accumulated
+    scenarios = (factor @ shocks.reshape(rank, horizon * paths)).reshape(lines, horizon, paths)
+    scenarios += baseline.astype(numpy.float32)[:, :, None]
+
+    # risultato = ricavi - costi = -(somma dei saldi DARE - AVERE)
+    results = -scenarios.sum(axis=0)
+    return _percentiles(scenarios), _percentiles(results)
+
+
+def forecast_statement(
+    history: MonthlyHistory,
+    horizon: int,
+    paths: int,
+    seed: int | None = None,
+) -> Forecast:
+    """
+    Previsione di `horizon` mesi dopo lo storico: Holt-Winters se ci sono almeno due anni completi,
+    altrimenti trend lineare più stagionalità.
+    """
+    amounts = history.amounts
+    if amounts.shape[1] < 2:
+        raise ValueError("At least two months of history are required for a forecast")
+    if amounts.shape[1] >= 2 * MONTHS:
+        baseline, residuals = fit_holt_winters(amounts, horizon)
+        level_smoothing = _ALPHA
+    else:
+        baseline, residuals = fit_linear_seasonal(amounts, horizon)
+        level_smoothing = 0.0
+
+    bands, total_bands = simulate(baseline, residuals, paths, level_smoothing, seed)
+
+    start_year, start_month = history.start
+    first = start_year * MONTHS + start_month - 1 + amounts.shape[1]
+    periods = [divmod(index, MONTHS) for index in range(first, first + horizon)]
+    return Forecast(
+        cee_ids=history.cee_ids,
+        periods=[(year, month + 1) for year, month in periods],
+        baseline=baseline,
+        bands=bands,
+        total_bands=total_bands,
+        paths=paths,
+    )
+
+
+async def forecast_organization(
+    organization_id: str,
+    last_year: int | None = None,
+    history_years: int = 3,
+    horizon: int = 24,
+    paths: int = 10000,
+) -> Forecast:
+    """
+    Previsione dei prossimi `horizon` mesi dallo storico riclassificato degli ultimi `history_years` anni
+    fino a `last_year` compreso (di default l'ultimo anno con un conto economico), caricato con una sola query.
+    """
+    if last_year is None:
+        latest = await prisma.incomestatement.find_first(
+            where={"organizationId": organization_id}, order={"year": "desc"}
+        )
+        if not latest:
+            raise ValueError("No income statement found for the organization")
+        last_year = latest.year
+
+    years = list(range(last_year - history_years + 1, last_year + 1))
+    balances = await load_account_balances(organization_id, years)
+    history = _trim_empty_months(monthly_history(balances, years))
+    return forecast_statement(history, horizon, paths)
+
+
+def _seasonal_indices(detrended: numpy.ndarray, length: int) -> numpy.ndarray:
+    """Media per mese dell'anno dei valori senza trend, centrata a zero"""
+    month_of_year = numpy.arange(length) % MONTHS
+    counts = numpy.bincount(month_of_year, minlength=MONTHS)
+    sums = numpy.zeros((detrended.shape[0], MONTHS))
+    numpy.add.at(sums.T, month_of_year, detrended.T)
+    seasonal = numpy.divide(sums, counts, out=numpy.zeros_like(sums), where=counts > 0)
+    return seasonal - seasonal.mean(axis=1, keepdims=True)
+
+
+def _covariance_factor(residuals: numpy.ndarray) -> numpy.ndarray:
+    """
+    Fattore F (voci, rango) della covarianza dei residui, covarianza = F @ F.T. Con più voci che mesi la
+    covarianza è singolare e Cholesky fallirebbe: si usa la decomposizione spettrale tenendo solo gli
+    autovalori positivi.
+    """
+    lines, length = residuals.shape
+    if length < 2 or lines == 0:
+        return numpy.zeros((lines, 1), dtype=numpy.float32)
+    centered = residuals - residuals.mean(axis=1, keepdims=True)
+    eigenvalues, eigenvectors = numpy.linalg.eigh(centered @ centered.T / (length - 1))
+    keep = eigenvalues > max(eigenvalues.max(), 0) * 1e-9
+    if not keep.any():
+        return numpy.zeros((lines, 1), dtype=numpy.float32)
+    return (eigenvectors[:, keep] * numpy.sqrt(eigenvalues[keep])).astype(numpy.float32)
+
+
+def _percentiles(scenarios: numpy.ndarray) -> numpy.ndarray:
+    """
+    Percentili sull'ultimo asse (scenari), con interpolazione lineare come `numpy.percentile`. L'ordinamento
+    completo sull'asse contiguo è molto più veloce di `numpy.percentile`, che seleziona i percentili uno
+    per volta su un asse non contiguo.
+    """
+    scenarios.sort(axis=-1)
+    positions = numpy.array(PERCENTILES) / 100 * (scenarios.shape[-1] - 1)
+    lower = numpy.floor(positions).astype(int)
+    upper = numpy.minimum(lower + 1, scenarios.shape[-1] - 1)
+    weight = (positions - lower).astype(numpy.float32)
+    bands = scenarios[..., lower] * (1 - weight) + scenarios[..., upper] * weight
+    return numpy.moveaxis(bands, -1, 0)
+
+
+def _trim_empty_months(history: MonthlyHistory) -> MonthlyHistory:
+    """
+    Toglie i mesi senza valori all'inizio (anni senza dati) e alla fine (anno in corso non ancora chiuso),
+    così il modello lavora solo sullo storico caricato e la previsione parte dall'ultimo mese disponibile.
+    """
+    filled = numpy.flatnonzero(numpy.abs(history.amounts).sum(axis=0) > 0)
+    if not len(filled):
+        return MonthlyHistory(cee_ids=history.cee_ids, start=history.start, amounts=history.amounts[:, :0])
+    first, last = filled[0], filled[-1] + 1
+    start_year, start_month = divmod(history.start[0] * MONTHS + history.start[1] - 1 + int(first), MONTHS)
+    return MonthlyHistory(
+        cee_ids=history.cee_ids,
+        start=(start_year, start_month + 1),
+        amounts=history.amounts[:, first:last],
+    )
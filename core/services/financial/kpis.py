@@ -0,0 +1,231 @@
+from datetime import datetime
+import numpy
+from core.services.cee_catalog import CEE_CODE_SEPARATOR, CeeCatalog, get_cee_catalog
+from core.services.prisma import prisma
+from core.services.financial.reclassification import (
+    MONTHS,
+    ReclassifiedStatement,
+    load_account_balances,
+    reclassify,
+)
+
+# componenti dei KPI: voci CEE del conto economico (art. 2425 c.c.), confrontate per segmenti del codice,
+# e segno che rende positivi ricavi e costi (nel riclassificato sono saldi DARE - AVERE)
+KPI_COMPONENTS = {
+    "revenue": (["A"], -1),
+    "sales": (["A.1"], -1),
+    "productionCosts": (["B"], 1),
+    "costOfSales": (["B.6", "B.11"], 1),
+    "personnel": (["B.9"], 1),
+    # ammortamenti, svalutazioni e accantonamenti: esclusi dall'EBITDA
+    "depreciation": (["B.10", "B.12", "B.13"], 1),
+}
+
+KPI_FIELDS = [
+    "revenue",
+    "ebitda",
+    "ebit",
+    "grossMargin",
+    "ebitdaMargin",
+    "ebitMargin",
+    "grossMarginRatio",
+    "costIncidence",
+    "personnelIncidence",
+    "revenueDelta",
+    "ebitdaDelta",
+]
+
+# impronta dei totali storicizzati di ogni mese, da cui sono calcolati i KPI: il roll-up riscrive un totale
+# solo se cambia, quindi se cambia l'ultimo aggiornamento o il numero di conti il mese va ricalcolato
+_MONTH_FINGERPRINTS_QUERY = """
+SELECT m."year" AS "year",
+       m."month" AS "month",
+       MAX(m."updatedAt") AS "sourceUpdatedAt",
+       COUNT(m."id")::int AS "sourceRows"
+FROM "HistoricalMonthlyBalance" m
+WHERE m."organizationId" = $1::uuid
+GROUP BY m."year", m."month"
+"""
+
+
+def compute_kpis(statement: ReclassifiedStatement, catalog: CeeCatalog) -> dict[str, numpy.ndarray]:
+    """
+    Calcola i KPI dei 12 mesi di un conto economico riclassificato, un array per KPI.
+
+    I rapporti valgono NaN quando il denominatore è zero. I delta sono calcolati solo all'interno
+    dell'anno, gennaio resta NaN.
+    """
+    codes = [catalog.by_id[cee_id].code if cee_id in catalog.by_id else "" for cee_id in statement.cee_ids]
+    kpis = kpis_from_components(component_weights(codes) @ statement.amounts)
+    kpis["revenueDelta"] = _deltas(kpis["revenue"])
+    kpis["ebitdaDelta"] = _deltas(kpis["ebitda"])
+    return kpis
+
+
+def component_weights(codes: list[str]) -> numpy.ndarray:
+    """
+    Matrice (componenti, voci) con il segno di ogni voce in ogni componente di `KPI_COMPONENTS`:
+    moltiplicata per gli importi delle voci dà i totali delle componenti.
+    """
+    return numpy.array(
+        [_code_mask(codes, prefixes) * sign for prefixes, sign in KPI_COMPONENTS.values()],
+        dtype=numpy.float64,
+    ).reshape(len(KPI_COMPONENTS), len(codes))
+
+
+def kpis_from_components(components: numpy.ndarray) -> dict[str, numpy.ndarray]:
+    """KPI a partire dai totali delle componenti, nell'ordine di `KPI_COMPONENTS` (prima dimensione)"""
+    values = dict(zip(KPI_COMPONENTS, components))
+    revenue = values["revenue"]
+    production_costs = values["productionCosts"]
+
+    ebitda = revenue - (production_costs - values["depreciation"])
+    ebit = revenue - production_costs
+    gross_margin = values["sales"] - values["costOfSales"]
+
+    return {
+        "revenue": revenue,
+        "ebitda": ebitda,
+        "ebit": ebit,
+        "grossMargin": gross_margin,
+        "ebitdaMargin": _ratio(ebitda, revenue),
+        "ebitMargin": _ratio(ebit, revenue),
+        "grossMarginRatio": _ratio(gross_margin, values["sales"]),
+        "costIncidence": _ratio(production_costs, revenue),
+        "personnelIncidence": _ratio(values["personnel"], revenue),
+    }
+
+
+async def refresh_income_statement_kpis(organization_id: str) -> int:
+    """
+    Ricalcola e salva i KPI dei soli mesi i cui totali storicizzati sono cambiati dall'ultimo calcolo.
+
+    Il mese successivo a uno cambiato viene ricalcolato anche lui perché i suoi delta dipendono dal
+    precedente. I KPI dei mesi che non hanno più valori vengono eliminati.
+
+    Returns:
+        int: numero di mesi ricalcolati
+    """
+    fingerprints = {
+        (row["year"], row["month"]): (_as_naive_datetime(row["sourceUpdatedAt"]), row["sourceRows"])
+        for row in await prisma.query_raw(_MONTH_FINGERPRINTS_QUERY, organization_id)
+    }
+    stored = {
+        (kpi.year, kpi.month): (_as_naive_datetime(kpi.sourceUpdatedAt), kpi.sourceRows)
+        for kpi in await prisma.incomestatementkpi.find_many(where={"organizationId": organization_id})
+    }
+
+    changed = {key for key, fingerprint in fingerprints.items() if stored.get(key) != fingerprint}
+    changed |= {_next_month(key) for key in changed if _next_month(key) in fingerprints}
+    stale = stored.keys() - fingerprints.keys()
+    if not changed and not stale:
+        return 0
+
+    changed_years = {year for year, _ in changed}
+    # per il delta di gennaio serve il dicembre dell'anno precedente
+    years = changed_years | {year - 1 for year, month in changed if month == 1 and (year - 1, MONTHS) in fingerprints}
+
+    catalog = await get_cee_catalog()
+    balances = await load_account_balances(organization_id, sorted(years))
+    kpis_by_year = {
+        year: compute_kpis(reclassify(organization_id, year, balances.select(balances.years == year)), catalog)
+        for year in years
+    }
+
+    async with prisma.tx() as transaction:
+        if stale:
+            await transaction.incomestatementkpi.delete_many(
+                where={
+                    "organizationId": organization_id,
+                    "OR": [{"year": year, "month": month} for year, month in stale],
+                }
+            )
+
+        for year, month in sorted(changed):
+            source_updated_at, source_rows = fingerprints[(year, month)]
+            data = {
+                field: _to_float(values[month - 1]) for field, values in kpis_by_year[year].items()
+            }
+            if month == 1 and (year - 1) in kpis_by_year:
+                previous = kpis_by_year[year - 1]
+                data["revenueDelta"] = _to_float(kpis_by_year[year]["revenue"][0] - previous["revenue"][-1])
+                data["ebitdaDelta"] = _to_float(kpis_by_year[year]["ebitda"][0] - previous["ebitda"][-1])
+            elif (year, month - 1) not in fingerprints:
+                # senza valori per il mese precedente il delta non ha senso
+                data["revenueDelta"] = None
+                data["ebitdaDelta"] = None
+            data["sourceUpdatedAt"] = source_updated_at
+            data["sourceRows"] = source_rows
+
+            await transaction.incomestatementkpi.upsert(
+                where={"organizationId_year_month": {"organizationId": organization_id, "year": year, "month": month}},
+                data={
+                    "create": {**data, "year": year, "month": month, "organizationId": organization_id},
+                    "update": data,
+                },
+            )
+
+    return len(changed)
+
+
+async def get_income_statement_kpis(organization_id: str, year: int, month: int | None = None):
+    """
+    KPI precalcolati dell'organizzazione per un anno o per un solo mese, aggiornati prima della lettura
+    se i valori sottostanti sono cambiati.
+    """
+    await refresh_income_statement_kpis(organization_id)
+
+    where = {"organizationId": organization_id, "year": year}
+    if month is not None:
+        where["month"] = month
+    return await prisma.incomestatementkpi.find_many(where=where, order={"month": "asc"})
+
+
+async def invalidate_income_statement_kpis(organization_id: str):
+    """
+    Elimina i KPI salvati, da chiamare quando cambia la riclassificazione dei conti (tabella di conversione):
+    in quel caso i valori del mese non cambiano ma i KPI sì.
+    """
+    await prisma.incomestatementkpi.delete_many(where={"organizationId": organization_id})
+
+
+def _code_mask(codes: list[str], prefixes: list[str]) -> numpy.ndarray:
+    """Voci il cui codice è uguale a uno dei prefissi o sotto di esso nella gerarchia (B -> B.7.a)"""
+    prefix_segments = [_segments(prefix) for prefix in prefixes]
+    return numpy.array(
+        [
+            any(segments[: len(prefix)] == prefix for prefix in prefix_segments)
+            for segments in map(_segments, codes)
+        ],
+        dtype=bool,
+    )
+
+
+def _segments(code: str) -> list[str]:
+    return [segment.strip().upper() for segment in code.split(CEE_CODE_SEPARATOR)]
+
+
+def _ratio(numerator: numpy.ndarray, denominator: numpy.ndarray) -> numpy.ndarray:
+    return numpy.divide(
+        numerator, denominator, out=numpy.full(numpy.shape(numerator), numpy.nan), where=denominator != 0
+    )
+
+
+def _deltas(values: numpy.ndarray) -> numpy.ndarray:
+    return numpy.concatenate([[numpy.nan], numpy.diff(values)])
+
+
+def _to_float(value) -> float | None:
+    return None if numpy.isnan(value) else float(value)
+
+
+def _next_month(key: tuple[int, int]) -> tuple[int, int]:
+    year, month = key
+    return (year + 1, 1) if month == MONTHS else (year, month + 1)
+
+
+def _as_naive_datetime(value) -> datetime:
+    # query_raw può restituire le date come stringhe ISO, i modelli come datetime con timezone
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.replace(tzinfo=None, microsecond=value.microsecond // 1000 * 1000)
@@ -0,0 +1,158 @@
+from dataclasses import dataclass
+import numpy
+import pandas
+from core.services.cee_catalog import get_cee_catalog
+from core.services.prisma import prisma
+
+MONTHS = 12
+
+# saldo di una riga di ValuesCostsRevenues: DARE - AVERE, oppure il saldo importato se mancano i movimenti
+BALANCE_SQL = 'CASE WHEN v."debit" = 0 AND v."credit" = 0 THEN v."balance" ELSE v."debit" - v."credit" END'
+
+# saldi mensili dei conti da considerare con i CEE di DARE/AVERE, letti dai totali storicizzati
+# (HistoricalMonthlyBalance, aggiornati dal roll-up) in un'unica query senza costruire i modelli Prisma
+_ACCOUNT_BALANCES_QUERY = """
+SELECT m."year" AS "year",
+       m."month" AS "month",
+       m."chartAccountId" AS "chartAccountId",
+       m."balance" AS "balance",
+       a."chartAccountCEEdebitId" AS "debitCeeId",
+       a."chartAccountCEEcreditId" AS "creditCeeId"
+FROM "HistoricalMonthlyBalance" m
+JOIN "ChartAccount" a ON a."id" = m."chartAccountId"
+WHERE m."organizationId" = $1::uuid
+  AND m."year" = ANY($2::int[])
+  AND a."toConsider" = true
+  AND a."deletedAt" IS NULL
+"""
+
+
+@dataclass
+class AccountBalances:
+    """Saldi mensili, un elemento per (conto, mese)"""
+
+    years: numpy.ndarray
+    months: numpy.ndarray
+    chart_account_ids: numpy.ndarray
+    balances: numpy.ndarray
+    debit_cee_ids: numpy.ndarray
+    credit_cee_ids: numpy.ndarray
+
+    def __len__(self):
+        return len(self.balances)
+
+    def select(self, mask: numpy.ndarray) -> "AccountBalances":
+        return AccountBalances(
+            years=self.years[mask],
+            months=self.months[mask],
+            chart_account_ids=self.chart_account_ids[mask],
+            balances=self.balances[mask],
+            debit_cee_ids=self.debit_cee_ids[mask],
+            credit_cee_ids=self.credit_cee_ids[mask],
+        )
+
+
+@dataclass
+class ReclassifiedStatement:
+    """
+    Conto economico riclassificato CEE: una riga per voce CEE, una colonna per mese (gennaio = 0).
+
+    Gli importi sono saldi DARE - AVERE, quindi positivi per i costi e negativi per i ricavi.
+    """
+
+    organization_id: str
+    year: int
+    cee_ids: list[str]
+    amounts: numpy.ndarray
+    unmapped: numpy.ndarray
+
+    @property
+    def totals(self) -> numpy.ndarray:
+        return self.amounts.sum(axis=1)
+
+    async def to_dict(self) -> dict:
+        catalog = await get_cee_catalog()
+        lines = []
+        for cee_id, amounts, total in zip(self.cee_ids, self.amounts.tolist(), self.totals.tolist()):
+            cee = catalog.by_id.get(cee_id)
+            lines.append({
+                "ceeId": cee_id,
+                "code": cee.code if cee else None,
+                "description": cee.description if cee else None,
+                "months": amounts,
+                "total": total,
+            })
+        return {
+            "organizationId": self.organization_id,
+            "year": self.year,
+            "lines": lines,
+            "unmapped": self.unmapped.tolist(),
+        }
+
+
+async def load_account_balances(organization_id: str, years: list[int]) -> AccountBalances:
+    """Carica con una sola query i saldi mensili dell'organizzazione per gli anni indicati"""
+    rows = await prisma.query_raw(_ACCOUNT_BALANCES_QUERY, organization_id, years)
+    return account_balances_from_rows(rows)
+
+
+def account_balances_from_rows(rows: list[dict]) -> AccountBalances:
+    """Converte le righe di una query con le colonne di `_ACCOUNT_BALANCES_QUERY` in array"""
+    df = pandas.DataFrame.from_records(
+        rows, columns=["year", "month", "chartAccountId", "balance", "debitCeeId", "creditCeeId"]
+    )
+    return AccountBalances(
+        years=df["year"].to_numpy(dtype=numpy.int64),
+        months=df["month"].to_numpy(dtype=numpy.int64),
+        chart_account_ids=df["chartAccountId"].to_numpy(dtype=object),
+        balances=df["balance"].to_numpy(dtype=numpy.float64),
+        debit_cee_ids=df["debitCeeId"].to_numpy(dtype=object),
+        credit_cee_ids=df["creditCeeId"].to_numpy(dtype=object),
+    )
+
+
+def resolve_cee_ids(balances: AccountBalances) -> numpy.ndarray:
+    """
+    Voce CEE di ogni saldo: quella di DARE se il saldo è positivo, altrimenti quella di AVERE.
+    Se il conto ha solo una delle due voci viene usata quella disponibile.
+    """
+    debit = balances.debit_cee_ids
+    credit = balances.credit_cee_ids
+    debit_missing = pandas.isna(debit)
+    credit_missing = pandas.isna(credit)
+    use_debit = ((balances.balances >= 0) & ~debit_missing) | credit_missing
+    return numpy.where(use_debit, debit, credit)
+
+
+def reclassify(organization_id: str, year: int, balances: AccountBalances) -> ReclassifiedStatement:
+    """Aggrega i saldi per voce CEE e mese con un'unica bincount sull'indice (voce, mese)"""
+    cee_codes, cee_ids = pandas.factorize(resolve_cee_ids(balances), use_na_sentinel=True)
+    month_index = balances.months - 1
+    mapped = cee_codes >= 0
+
+    amounts = numpy.bincount(
+        cee_codes[mapped] * MONTHS + month_index[mapped],
+        weights=balances.balances[mapped],
+        minlength=len(cee_ids) * MONTHS,
+    ).reshape(len(cee_ids), MONTHS)
+    unmapped = numpy.bincount(
+        month_index[~mapped], weights=balances.balances[~mapped], minlength=MONTHS
+    )
+
+    return ReclassifiedStatement(
+        organization_id=organization_id,
+        year=year,
+        cee_ids=list(cee_ids),
+        amounts=amounts,
+        unmapped=unmapped,
+    )
+
+
+async def get_reclassified_statement(organization_id: str, year: int, month: int | None = None) -> ReclassifiedStatement:
+    """
+    Conto economico riclassificato CEE dell'organizzazione per un anno o per un solo mese.
+    """
+    balances = await load_account_balances(organization_id, [year])
+    if month is not None:
+        balances = balances.select(balances.months == month)
+    return reclassify(organization_id, year, balances)
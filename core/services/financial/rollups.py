@@ -0,0 +1,165 @@
+from core.services.prisma import prisma
+from core.services.financial.reclassification import BALANCE_SQL
+from core.services.financial.budget import invalidate_budget_variance
+from core.services.response_cache import invalidate_organization_responses
+
+# Segna come storicizzate le righe nuove e restituisce i mesi (organizzazione, anno, mese) da ricalcolare.
+# `updatedAt` non viene toccato: il flag è interno al roll-up e non deve cambiare le impronte dei valori.
+_FLAG_NEW_VALUES_QUERY = """
+WITH flagged AS (
+    UPDATE "ValuesCostsRevenues" v
+    SET "isCalculatedIntoHistorical" = true
+    FROM "IncomeStatement" s
+    WHERE s."id" = v."incomeStatementId"
+      AND v."isCalculatedIntoHistorical" = false
+      AND v."isPreviousYear" = false
+    RETURNING s."organizationId", s."year", s."month"
+)
+SELECT DISTINCT "organizationId", "year", "month" FROM flagged
+"""
+
+# Ricalcola i totali di tutti i conti dei mesi indicati a partire dalle righe di ValuesCostsRevenues: i totali
+# dei conti non più presenti nel mese (ad esempio dopo il reimport del bilancio di verifica) vengono eliminati,
+# quelli esistenti vengono riscritti solo se cambiano. Restituisce gli (organizzazione, anno) modificati.
+_ROLL_UP_MONTHLY_QUERY = f"""
+WITH affected AS (
+    SELECT DISTINCT * FROM unnest($1::uuid[], $2::int[], $3::int[]) AS k("organizationId", "year", "month")
+),
+totals AS (
+    SELECT a."organizationId", v."chartAccountId", a."year", a."month",
+           SUM(v."debit") AS "debit", SUM(v."credit") AS "credit", SUM({BALANCE_SQL}) AS "balance"
+    FROM affected a
+    JOIN "IncomeStatement" s
+      ON s."organizationId" = a."organizationId" AND s."year" = a."year" AND s."month" = a."month"
+    JOIN "ValuesCostsRevenues" v
+      ON v."incomeStatementId" = s."id" AND v."isPreviousYear" = false
+    GROUP BY a."organizationId", v."chartAccountId", a."year", a."month"
+),
+deleted AS (
+    DELETE FROM "HistoricalMonthlyBalance" m
+    USING affected a
+    WHERE m."organizationId" = a."organizationId" AND m."year" = a."year" AND m."month" = a."month"
+      AND NOT EXISTS (
+          SELECT 1 FROM totals t
+          WHERE t."organizationId" = m."organizationId" AND t."chartAccountId" = m."chartAccountId"
+            AND t."year" = m."year" AND t."month" = m."month"
+      )
+    RETURNING m."organizationId", m."year"
+),
+upserted AS (
+    INSERT INTO "HistoricalMonthlyBalance"
+        ("id", "organizationId", "chartAccountId", "year", "month", "debit", "credit", "balance", "createdAt", "updatedAt")
+    SELECT gen_random_uuid(), t."organizationId", t."chartAccountId", t."year", t."month",
+           t."debit", t."credit", t."balance", now(), now()
+    FROM totals t
+    ON CONFLICT ("organizationId", "chartAccountId", "year", "month") DO UPDATE
+    SET "debit" = EXCLUDED."debit",
+        "credit" = EXCLUDED."credit",
+        "balance" = EXCLUDED."balance",
+        "updatedAt" = now()
+    WHERE ("HistoricalMonthlyBalance"."debit", "HistoricalMonthlyBalance"."credit", "HistoricalMonthlyBalance"."balance")
+          IS DISTINCT FROM (EXCLUDED."debit", EXCLUDED."credit", EXCLUDED."balance")
+    RETURNING "organizationId", "year"
+)
+SELECT "organizationId", "year" FROM deleted
+UNION
+SELECT "organizationId", "year" FROM upserted
+"""
+
+# Ricalcola i totali annuali degli anni i cui totali mensili sono appena cambiati, con le stesse regole
+_ROLL_UP_YEARLY_QUERY = """
+WITH affected AS (
+    SELECT DISTINCT * FROM unnest($1::uuid[], $2::int[]) AS k("organizationId", "year")
+),
+totals AS (
+    SELECT m."organizationId", m."chartAccountId", m."year",
+           SUM(m."debit") AS "debit", SUM(m."credit") AS "credit", SUM(m."balance") AS "balance"
+    FROM "HistoricalMonthlyBalance" m
+    JOIN affected a USING ("organizationId", "year")
+    GROUP BY m."organizationId", m."chartAccountId", m."year"
+),
+deleted AS (
+    DELETE FROM "HistoricalYearlyBalance" y
+    USING affected a
+    WHERE y."organizationId" = a."organizationId" AND y."year" = a."year"
+      AND NOT EXISTS (
+          SELECT 1 FROM totals t
+          WHERE t."organizationId" = y."organizationId" AND t."chartAccountId" = y."chartAccountId"
+            AND t."year" = y."year"
+      )
+)
+INSERT INTO "HistoricalYearlyBalance"
+    ("id", "organizationId", "chartAccountId", "year", "debit", "credit", "balance", "createdAt", "updatedAt")
+SELECT gen_random_uuid(), t."organizationId", t."chartAccountId", t."year", t."debit", t."credit", t."balance", now(), now()
+FROM totals t
+ON CONFLICT ("organizationId", "chartAccountId", "year") DO UPDATE
+SET "debit" = EXCLUDED."debit",
+    "credit" = EXCLUDED."credit",
+    "balance" = EXCLUDED."balance",
+    "updatedAt" = now()
+WHERE ("HistoricalYearlyBalance"."debit", "HistoricalYearlyBalance"."credit", "HistoricalYearlyBalance"."balance")
+      IS DISTINCT FROM (EXCLUDED."debit", EXCLUDED."credit", EXCLUDED."balance")
+"""
+
+_YEARLY_BALANCES_QUERY = """
+SELECT y."year" AS "year",
+       y."chartAccountId" AS "chartAccountId",
+       y."balance" AS "balance"
+FROM "HistoricalYearlyBalance" y
+JOIN "ChartAccount" a ON a."id" = y."chartAccountId"
+WHERE y."organizationId" = $1::uuid
+  AND y."year" = ANY($2::int[])
+  AND a."toConsider" = true
+  AND a."deletedAt" IS NULL
+"""
+
+
+async def roll_up_historical_balances(months: list[tuple[str, int, int]] | None = None) -> int:
+    """
+    Aggiorna i totali storici mensili e annuali dei mesi con righe di ValuesCostsRevenues non ancora storicizzate
+    e dei mesi indicati in `months` come (organizzazione, anno, mese).
+
+    `months` serve a chi sostituisce i valori di un mese: le righe eliminate non lasciano traccia nel flag,
+    quindi il mese va ricalcolato esplicitamente anche se il nuovo file non ha righe.
+
+    Returns:
+        int: numero di (organizzazione, anno) i cui totali sono cambiati
+    """
+    async with prisma.tx() as transaction:
+        flagged = await transaction.query_raw(_FLAG_NEW_VALUES_QUERY)
+        affected = {(row["organizationId"], row["year"], row["month"]) for row in flagged} | set(months or [])
+        if not affected:
+            return 0
+
+        changed = await transaction.query_raw(
+            _ROLL_UP_MONTHLY_QUERY,
+            [organization_id for organization_id, _, _ in affected],
+            [year for _, year, _ in affected],
+            [month for _, _, month in affected],
+        )
+        if changed:
+            await transaction.execute_raw(
+                _ROLL_UP_YEARLY_QUERY,
+                [row["organizationId"] for row in changed],
+                [row["year"] for row in changed],
+            )
+
+    # varianze di budget e risposte degli agenti sono calcolate sui totali storicizzati
+    for row in changed:
+        invalidate_budget_variance(row["organizationId"], row["year"])
+    for organization_id in {row["organizationId"] for row in changed}:
+        invalidate_organization_responses(organization_id)
+    return len(changed)
+
+
+async def schedule_historical_roll_up():
+    try:
+        changed = await roll_up_historical_balances()
+        print(f"Historical roll-up updated {changed} organization years")
+    except Exception as e:
+        print(f"Error rolling up historical balances: {e}")
+
+
+async def load_yearly_account_balances(organization_id: str, years: list[int]) -> list[dict]:
+    """Totali annuali storicizzati dei conti da considerare, una riga per (anno, conto)"""
+    return await prisma.query_raw(_YEARLY_BALANCES_QUERY, organization_id, years)
@@ -0,0 +1,214 @@
+import time
+import numpy
+import pandas
+from core.services.cee_catalog import CeeCatalog, get_cee_catalog
+from core.services.prisma import prisma
+from core.services.financial.kpis import _code_mask, component_weights, kpis_from_components
+from core.services.financial.reclassification import (
+    MONTHS,
+    AccountBalances,
+    load_account_balances,
+    resolve_cee_ids,
+)
+
+_CHART_ACCOUNT_CODES_QUERY = """
+SELECT a."id" AS "id", a."code" AS "code"
+FROM "ChartAccount" a
+JOIN "IncomeStatementConversionTable" t ON t."id" = a."incomeStatementConversionTableId"
+WHERE t."organizationId" = $1::uuid
+  AND a."deletedAt" IS NULL
+"""
+
+# un modello per (organizzazione, anno) resta in memoria per la durata di una sessione di pianificazione
+_MODEL_TTL_SECONDS = 1800
+_models: dict[tuple[str, int], tuple["WhatIfModel", float]] = {}
+
+
+class WhatIfModel:
+    """
+    Conto economico di un anno con il grafo delle dipendenze conti -> voci CEE -> componenti dei KPI.
+
+    I driver sono variazioni percentuali su una voce CEE (con tutte le voci sotto di essa) o su un conto.
+    Quando cambiano, vengono ricalcolate solo le voci raggiunte dal driver e le componenti dei KPI vengono
+    aggiornate con la sola differenza di quelle voci, senza riaggregare i saldi.
+    """
+
+    def __init__(self, organization_id: str, year: int, balances: AccountBalances, catalog: CeeCatalog, account_codes: dict[str, str]):
+        self.organization_id = organization_id
+        self.year = year
+
+        line_index, line_ids = pandas.factorize(resolve_cee_ids(balances), use_na_sentinel=True)
+        mapped = line_index >= 0
+        account_index, account_ids = pandas.factorize(balances.chart_account_ids[mapped])
+        line_index = line_index[mapped]
+        month_index = balances.months[mapped] - 1
+
+        self.line_ids = list(line_ids)
+        self.line_codes = [catalog.by_id[line_id].code if line_id in catalog.by_id else "" for line_id in self.line_ids]
+        self.account_position = {
+            account_codes.get(account_id, account_id): position for position, account_id in enumerate(account_ids)
+        }
+
+        # un conto può finire su voci diverse nei vari mesi (DARE o AVERE secondo il segno): il nodo
+        # intermedio del grafo è la coppia (conto, voce)
+        pair_index, pairs = pandas.factorize(account_index * len(line_ids) + line_index)
+        self.pair_account = pairs // max(len(line_ids), 1)
+        self.pair_line = pairs % max(len(line_ids), 1)
+        self.pair_base = numpy.bincount(
+            pair_index * MONTHS + month_index, weights=balances.balances[mapped], minlength=len(pairs) * MONTHS
+        ).reshape(len(pairs), MONTHS)
+        self.pairs_by_account = _group_positions(self.pair_account, len(account_ids))
+
+        self.account_multipliers = numpy.ones(len(account_ids))
+        self.line_multipliers = numpy.ones(len(line_ids))
+        self.line_account_totals = numpy.zeros((len(line_ids), MONTHS))
+        numpy.add.at(self.line_account_totals, self.pair_line, self.pair_base)
+        self.line_base = self.line_account_totals.copy()
+        self.line_values = self.line_account_totals.copy()
+
+        self.weights = component_weights(self.line_codes)
+        self.base_components = self.weights @ self.line_values
+        self.components = self.base_components.copy()
+
+        self.cee_drivers: dict[str, float] = {}
+        self.account_drivers: dict[str, float] = {}
+        self._prefix_masks: dict[str, numpy.ndarray] = {}
+
+    def set_drivers(self, cee_changes: dict[str, float], account_changes: dict[str, float]) -> list[str]:
+        """
+        Imposta i driver (variazioni in percentuale) e propaga solo quelli cambiati rispetto alla chiamata
+        precedente. I driver non più presenti tornano a zero.
+
+        Returns:
+            list[str]: id delle voci CEE ricalcolate
+
+        Raises:
+            ValueError: se una voce CEE o un conto non esistono nel conto economico dell'anno
+        """
+        unknown_accounts = [code for code in account_changes if code not in self.account_position]
+        if unknown_accounts:
+            raise ValueError(f"Unknown accounts: {', '.join(unknown_accounts)}")
+        unknown_cee = [code for code in cee_changes if not self._prefix_mask(code).any()]
+        if unknown_cee:
+            raise ValueError(f"Unknown CEE lines: {', '.join(unknown_cee)}")
+
+        affected = numpy.zeros(len(self.line_ids), dtype=bool)
+
+        for code in self.account_drivers.keys() | account_changes.keys():
+            percent = account_changes.get(code, 0.0)
+            if self.account_drivers.get(code, 0.0) == percent:
+                continue
+            position = self.account_position[code]
+            multiplier = 1 + percent / 100
+            pairs = self.pairs_by_account[position]
+            numpy.add.at(
+                self.line_account_totals,
+                self.pair_line[pairs],
+                self.pair_base[pairs] * (multiplier - self.account_multipliers[position]),
+            )
+            self.account_multipliers[position] = multiplier
+            affected[self.pair_line[pairs]] = True
+
+        changed_cee = [
+            code for code in self.cee_drivers.keys() | cee_changes.keys()
+            if self.cee_drivers.get(code, 0.0) != cee_changes.get(code, 0.0)
+        ]
+        if changed_cee:
+            cee_affected = numpy.logical_or.reduce([self._prefix_mask(code) for code in changed_cee])
+            multipliers = numpy.ones(int(cee_affected.sum()))
+            for code, percent in cee_changes.items():
+                multipliers *= numpy.where(self._prefix_mask(code)[cee_affected], 1 + percent / 100, 1.0)
+            self.line_multipliers[cee_affected] = multipliers
+            affected |= cee_affected
+
+        self.cee_drivers = {code: percent for code, percent in cee_changes.items() if percent}
+        self.account_drivers = {code: percent for code, percent in account_changes.items() if percent}
+
+        lines = numpy.flatnonzero(affected)
+        if len(lines):
+            values = self.line_account_totals[lines] * self.line_multipliers[lines, None]
+            self.components += self.weights[:, lines] @ (values - self.line_values[lines])
+            self.line_values[lines] = values
+        return [self.line_ids[line] for line in lines]
+
+    def to_dict(self, changed_line_ids: list[str] | None = None) -> dict:
+        baseline = kpis_from_components(self.base_components.sum(axis=1))
+        scenario = kpis_from_components(self.components.sum(axis=1))
+        changed = set(changed_line_ids or [])
+        return {
+            "organizationId": self.organization_id,
+            "year": self.year,
+            "drivers": {"cee": self.cee_drivers, "accounts": self.account_drivers},
+            "kpis": {
+                name: {
+                    "baseline": _to_float(baseline[name]),
+                    "scenario": _to_float(scenario[name]),
+                    "delta": _to_float(scenario[name] - baseline[name]),
+                }
+                for name in scenario
+            },
+            "lines": [
+                {
+                    "ceeId": line_id,
+                    "code": code,
+                    "baseline": float(self.line_base[index].sum()),
+                    "scenario": float(self.line_values[index].sum()),
+                }
+                for index, (line_id, code) in enumerate(zip(self.line_ids, self.line_codes))
+                if line_id in changed
+            ],
+        }
+
+    def _prefix_mask(self, code: str) -> numpy.ndarray:
+        mask = self._prefix_masks.get(code)
+        if mask is None:
+            mask = self._prefix_masks[code] = _code_mask(self.line_codes, [code])
+        return mask
+
+
+async def build_what_if_model(organization_id: str, year: int) -> WhatIfModel:
+    balances = await load_account_balances(organization_id, [year])
+    catalog = await get_cee_catalog()
+    rows = await prisma.query_raw(_CHART_ACCOUNT_CODES_QUERY, organization_id)
+    return WhatIfModel(organization_id, year, balances, catalog, {row["id"]: row["code"] for row in rows})
+
+
+async def run_what_if(
+    organization_id: str,
+    year: int,
+    cee_changes: dict[str, float] | None = None,
+    account_changes: dict[str, float] | None = None,
+) -> dict:
+    """
+    Applica i driver al conto economico dell'anno e restituisce KPI e voci ricalcolate.
+
+    Il modello dell'anno viene costruito una volta e riusato dalle chiamate successive, che propagano
+    solo i driver cambiati.
+    """
+    cached = _models.get((organization_id, year))
+    if cached and cached[1] > time.monotonic():
+        model = cached[0]
+    else:
+        model = await build_what_if_model(organization_id, year)
+    _models[(organization_id, year)] = (model, time.monotonic() + _MODEL_TTL_SECONDS)
+
+    changed = model.set_drivers(cee_changes or {}, account_changes or {})
+    return model.to_dict(changed)
+
+
+def invalidate_what_if_models(organization_id: str):
+    """Da chiamare quando cambiano i valori o la riclassificazione dell'organizzazione"""
+    for key in list(_models):
+        if key[0] == organization_id:
+            _models.pop(key, None)
+
+
+def _group_positions(groups: numpy.ndarray, size: int) -> list[numpy.ndarray]:
+    """Posizioni degli elementi di ogni gruppo, con un solo ordinamento"""
+    order = numpy.argsort(groups, kind="stable")
+    bounds = numpy.searchsorted(groups[order], numpy.arange(size + 1))
+    return [order[bounds[group]:bounds[group + 1]] for group in range(size)]
+
+
+def _to_float(value) -> float | None:
+    return None if numpy.isnan(value) else float(value)
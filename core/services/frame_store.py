@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import os
+import tempfile
+import pandas
+import pyarrow
+import pyarrow.ipc
+from prisma.models import Media
+from core.modules.media.service import s3_client
+from core.services.prisma import prisma
+from core.settings import settings
+
+FRAME_EXTENSION = ".arrow"
+
+
+def _frame_store_dir() -> str:
+    directory = settings.requrv_frame_store_dir or os.path.join(tempfile.gettempdir(), "requrv-frames")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def local_frame_path(media_id: str) -> str:
+    """Percorso locale della copia Arrow del file caricato come `media_id`"""
+    return os.path.join(_frame_store_dir(), media_id + FRAME_EXTENSION)
+
+
+class FrameWriter:
+    """
+    Scrive un file Arrow IPC blocco per blocco, senza tenere in memoria l'intero DataFrame.
+
+    Il file non è compresso così può essere letto in memory map senza copie. Viene scritto su un file
+    temporaneo e spostato in `path` solo se la scrittura termina senza errori.
+    """
+
+    def __init__(self, path: str, schema: pyarrow.Schema):
+        self.path = path
+        self.schema = schema
+        self._partial_path = path + ".partial"
+
+    def __enter__(self):
+        self._sink = pyarrow.OSFile(self._partial_path, "wb")
+        self._writer = pyarrow.ipc.new_file(self._sink, self.schema)
+        return self
+
+    def write(self, df: pandas.DataFrame):
+        table = pyarrow.Table.from_pandas(df[self.schema.names], preserve_index=False)
+        self._writer.write_table(table.cast(self.schema))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._writer.close()
+        self._sink.close()
+        if exc_type:
+            os.remove(self._partial_path)
+        else:
+            os.replace(self._partial_path, self.path)
+
+
+async def save_frame(media: Media, path: str):
+    """
+    Carica la copia Arrow sul bucket accanto al file originale e la collega al media.
+
+    La copia è solo una cache del file già importato: un errore viene registrato nei log e non fa fallire
+    l'import, il media resta senza `frameKey`.
+    """
+    frame_key = media.key + FRAME_EXTENSION
+    try:
+        await asyncio.to_thread(
+            s3_client.upload_file,
+            path,
+            settings.model_dump()["requrv_aws_bucket"],
+            frame_key,
+        )
+        await prisma.media.update(where={"id": media.id}, data={"frameKey": frame_key})
+    except Exception as e:
+        logging.error("Error saving frame for media %s: %s", media.id, e)
+
+
+async def open_frame(media_id: str) -> pyarrow.Table | None:
+    """
+    Restituisce la copia Arrow di un file caricato, letta in memory map (zero-copy).
+
+    Se il file non è ancora nella cache locale viene scaricato dal bucket una sola volta.
+    Restituisce None se per il media non esiste una copia Arrow.
+    """
+    path = local_frame_path(media_id)
+    if not os.path.exists(path):
+        media = await prisma.media.find_unique(where={"id": media_id})
+        if not media or not media.frameKey:
+            return None
+        await asyncio.to_thread(_download_frame, media.frameKey, path)
+
+    return read_frame(path)
+
+
+def read_frame(path: str) -> pyarrow.Table:
+    """Legge un file Arrow IPC in memory map: le colonne puntano direttamente al file su disco"""
+    source = pyarrow.memory_map(path, "r")
+    return pyarrow.ipc.open_file(source).read_all()
+
+
+def _download_frame(frame_key: str, path: str):
+    partial_path = path + ".partial"
+    s3_client.download_file(settings.model_dump()["requrv_aws_bucket"], frame_key, partial_path)
+    os.replace(partial_path, path)
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from langfuse import Langfuse
+from core.services.prisma import prisma
+from core.settings import settings
+
+# prompt usati dagli agenti, caricati all'avvio
+KNOWN_PROMPTS = ["requrv-hub-core"]
+
+# dopo questo intervallo un prompt letto viene comunque restituito, ma ne parte l'aggiornamento in background
+PROMPT_MAX_AGE_SECONDS = 60
+# oltre questo tempo una chiamata a Langfuse viene abbandonata e resta in uso la copia in memoria
+FETCH_TIMEOUT_SECONDS = 10
+# un prompt mai caricato che Langfuse non restituisce non viene richiesto di nuovo in linea per questo tempo:
+# finché Langfuse non risponde le richieste falliscono subito invece di attendere ognuna il timeout
+FETCH_FAILURE_TTL_SECONDS = 30
+
+lang_client = Langfuse(
+    host=settings.requrv_langfuse_host,
+    public_key=settings.requrv_langfuse_public_key,
+    secret_key=settings.requrv_langfuse_secret_key,
+)
+
+
+class PromptNotAvailable(Exception):
+    pass
+
+
+@dataclass
+class CachedPrompt:
+    name: str
+    version: int
+    text: str
+    fetched_at: float
+
+
+class PromptRegistry:
+    """
+    Copia in memoria dei prompt Langfuse, servita senza chiamate di rete.
+
+    Le copie più vecchie di `PROMPT_MAX_AGE_SECONDS` vengono restituite lo stesso e aggiornate in
+    background (stale-while-revalidate); se Langfuse non risponde resta in uso l'ultima copia.
+    Le richieste contemporanee di un prompt non in memoria condividono una sola chiamata a Langfuse.
+    Un'organizzazione può fissare la versione di un prompt con un PromptVersionPin.
+    """
+
+    def __init__(self, client: Langfuse, names: list[str]):
+        self.client = client
+        self.names = names
+        # versione None = ultima versione in produzione
+        self._prompts: dict[tuple[str, int | None], CachedPrompt] = {}
+        self._pins: dict[tuple[str, str], int] = {}
+        self._refreshing: dict[tuple[str, int | None], asyncio.Task] = {}
+        # scadenza dell'ultimo caricamento fallito dei prompt mai caricati
+        self._failed_until: dict[tuple[str, int | None], float] = {}
+
+    async def preload(self):
+        """Carica i prompt noti e le versioni fissate, da chiamare all'avvio dell'applicazione"""
+        await self.load_pins()
+        keys = {(name, None) for name in self.names} | {(name, version) for (_, name), version in self._pins.items()}
+        await asyncio.gather(*(self._fetch(name, version) for name, version in keys))
+
+    async def refresh(self):
+        """Aggiorna tutti i prompt in memoria e le versioni fissate, per il job periodico"""
+        await self.load_pins()
+        keys = set(self._prompts) | {(name, None) for name in self.names} | {(name, version) for (_, name), version in self._pins.items()}
+        await asyncio.gather(*(self._fetch(name, version) for name, version in keys))
+
+    async def load_pins(self):
+        try:
+            pins = await prisma.promptversionpin.find_many()
+        except Exception as e:
+            logging.error("Error loading prompt version pins: %s", e)
+            return
+        self._pins = {(pin.organizationId, pin.name): pin.version for pin in pins}
+
+    def set_pin(self, organization_id: str, name: str, version: int | None):
+        """Aggiorna la versione fissata in memoria dopo la scrittura su db"""
+        if version is None:
+            self._pins.pop((organization_id, name), None)
+        else:
+            self._pins[(organization_id, name)] = version
+            self._revalidate(name, version)
+
+    async def get(self, name: str, organization_id: str | None = None) -> CachedPrompt:
+        """
+        Prompt dalla memoria, nella versione fissata per l'organizzazione o nell'ultima versione.
+
+        Langfuse viene chiamato in linea solo se il prompt non è mai stato caricato, al massimo una volta
+        ogni `FETCH_FAILURE_TTL_SECONDS` se non risponde; se la versione fissata non è ancora in memoria
+        viene usata l'ultima mentre la si carica.
+
+        Raises:
+            PromptNotAvailable: se il prompt non è in memoria e Langfuse non lo restituisce
+        """
+        version = self._pins.get((organization_id, name)) if organization_id else None
+        cached = self._prompts.get((name, version))
+        if cached is None and version is not None:
+            self._revalidate(name, version)
+            version = None
+            cached = self._prompts.get((name, None))
+
+        if cached is None:
+            if self._failed_until.get((name, version), 0) > time.monotonic():
+                raise PromptNotAvailable(f"Prompt {name} is not available")
+            # shield: se un chiamante viene annullato il caricamento continua per gli altri in attesa
+            cached = await asyncio.shield(self._revalidate(name, version))
+            if cached is None:
+                raise PromptNotAvailable(f"Prompt {name} is not available")
+        elif time.monotonic() - cached.fetched_at > PROMPT_MAX_AGE_SECONDS:
+            self._revalidate(name, version)
+        return cached
+
+    def _revalidate(self, name: str, version: int | None) -> asyncio.Task:
+        key = (name, version)
+        task = self._refreshing.get(key)
+        if task is None or task.done():
+            task = self._refreshing[key] = asyncio.create_task(self._fetch(name, version))
+        return task
+
+    async def _fetch(self, name: str, version: int | None) -> CachedPrompt | None:
+        try:
+            # cache del client disattivata: la cache è questa, il client serve solo per la chiamata
+            prompt = await asyncio.wait_for(
+                asyncio.to_thread(self.client.get_prompt, name, version=version, cache_ttl_seconds=0),
+                timeout=FETCH_TIMEOUT_SECONDS,
+            )
+        except Exception as e:
+            logging.error("Error fetching prompt %s (version %s): %s", name, version, e)
+            cached = self._prompts.get((name, version))
+            if cached is None:
+                self._failed_until[(name, version)] = time.monotonic() + FETCH_FAILURE_TTL_SECONDS
+            return cached
+
+        cached = CachedPrompt(name=name, version=prompt.version, text=prompt.compile(), fetched_at=time.monotonic())
+        self._prompts[(name, version)] = cached
+        self._failed_until.pop((name, version), None)
+        return cached
+
+
+prompt_registry = PromptRegistry(lang_client, KNOWN_PROMPTS)
+
+
+async def schedule_prompt_refresh():
+    await prompt_registry.refresh()
@@ -0,0 +1,87 @@
+import hashlib
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# le risposte restano valide finché non cambiano i dati dell'organizzazione; il TTL copre le modifiche
+# fatte da altri processi, che non passano dall'invalidazione in memoria
+RESPONSE_TTL_SECONDS = 3600
+MAX_RESPONSES_PER_SCOPE = 200
+
+_NOT_ALPHANUMERIC = re.compile(r"[^a-z0-9]+")
+
+
+@dataclass
+class CachedResponse:
+    question: str
+    output: str
+    expires_at: float
+
+
+class ResponseCache:
+    """
+    Risposte degli agenti per (agente, organizzazione, versione del prompt, versione dei dati).
+
+    Una domanda trova una risposta solo se è uguale a una già fatta dopo la normalizzazione (maiuscole,
+    accenti, punteggiatura e spazi). Niente somiglianza approssimata: nelle domande finanziarie una parola
+    ("aumentati"/"diminuiti") o un numero ("2023"/"2024", "Q1"/"Q2") cambiano la risposta.
+    """
+
+    def __init__(self):
+        self._scopes: dict[tuple, OrderedDict[str, CachedResponse]] = {}
+        self._data_versions: dict[str, int] = {}
+
+    def scope(self, agent: str, organization_id: str, prompt_version: int) -> tuple:
+        return (agent, organization_id, prompt_version, self._data_versions.get(organization_id, 0))
+
+    def get(self, scope: tuple, question: str) -> str | None:
+        responses = self._scopes.get(scope)
+        if not responses:
+            return None
+
+        key = _hash(normalize_question(question))
+        cached = responses.get(key)
+        if cached is None:
+            return None
+        if cached.expires_at <= time.monotonic():
+            del responses[key]
+            return None
+        responses.move_to_end(key)
+        return cached.output
+
+    def put(self, scope: tuple, question: str, output: str):
+        normalized = normalize_question(question)
+        key = _hash(normalized)
+        responses = self._scopes.setdefault(scope, OrderedDict())
+        responses[key] = CachedResponse(
+            question=normalized,
+            output=output,
+            expires_at=time.monotonic() + RESPONSE_TTL_SECONDS,
+        )
+        responses.move_to_end(key)
+        while len(responses) > MAX_RESPONSES_PER_SCOPE:
+            responses.popitem(last=False)
+
+    def invalidate_organization(self, organization_id: str):
+        """Da chiamare quando cambiano i dati finanziari dell'organizzazione"""
+        self._data_versions[organization_id] = self._data_versions.get(organization_id, 0) + 1
+        for scope in [scope for scope in self._scopes if scope[1] == organization_id]:
+            self._scopes.pop(scope, None)
+
+
+def normalize_question(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode()
+    return _NOT_ALPHANUMERIC.sub(" ", text).strip()
+
+
+def _hash(normalized: str) -> str:
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+response_cache = ResponseCache()
+
+
+def invalidate_organization_responses(organization_id: str):
+    response_cache.invalidate_organization(organization_id)
@@ -0,0 +1,121 @@
+import asyncio
+import time
+from collections import OrderedDict
+import httpx
+from core.settings import settings
+
+SEARCH_TIMEOUT_SECONDS = 10
+# i risultati di ricerca cambiano lentamente: un'ora evita di ripetere le stesse ricerche nelle conversazioni
+SEARCH_CACHE_TTL_SECONDS = 3600
+SEARCH_CACHE_SIZE = 1024
+# tentativi per ricerca su 429, 5xx ed errori di connessione, con attesa esponenziale (o il Retry-After di Brave)
+SEARCH_MAX_ATTEMPTS = 3
+SEARCH_BACKOFF_SECONDS = 0.5
+SEARCH_MAX_BACKOFF_SECONDS = 5
+
+
+class WebSearchError(Exception):
+    pass
+
+
+class WebSearchClient:
+    """
+    Client asincrono per la Brave Search API, su un pool di connessioni condiviso.
+
+    I risultati restano in una cache LRU con scadenza; ricerche identiche in corso nello stesso momento
+    condividono una sola richiesta. Le risposte 429 e 5xx e gli errori di rete vengono ritentati con backoff.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        url: str,
+        ttl_seconds: float = SEARCH_CACHE_TTL_SECONDS,
+        max_size: int = SEARCH_CACHE_SIZE,
+        max_attempts: int = SEARCH_MAX_ATTEMPTS,
+        backoff_seconds: float = SEARCH_BACKOFF_SECONDS,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.api_key = api_key
+        self.url = url
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.transport = transport
+        self._http_client: httpx.AsyncClient | None = None
+        self._cache: OrderedDict[tuple, tuple[list[dict], float]] = OrderedDict()
+        self._in_flight: dict[tuple, asyncio.Task] = {}
+
+    async def search(self, query: str, country: str = "it", lang: str = "it", count: int = 5) -> list[dict]:
+        """
+        Raises:
+            WebSearchError: se la richiesta fallisce o scade
+        """
+        key = (" ".join(query.lower().split()), country.lower(), lang.lower(), count)
+
+        cached = self._cache.get(key)
+        if cached and cached[1] > time.monotonic():
+            self._cache.move_to_end(key)
+            return cached[0]
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.create_task(self._fetch(key, query.strip()))
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # shield: se un chiamante viene annullato la richiesta continua per gli altri in attesa
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: tuple, query: str) -> list[dict]:
+        _, country, lang, count = key
+        for attempt in range(1, self.max_attempts + 1):
+            retry_after = None
+            try:
+                response = await self._client().get(
+                    self.url,
+                    headers={"X-Subscription-Token": self.api_key, "Accept": "application/json"},
+                    params={"q": query, "count": count, "country": country, "search_lang": lang},
+                )
+                if not _is_retryable(response.status_code) or attempt == self.max_attempts:
+                    response.raise_for_status()
+                    break
+                retry_after = _retry_after_seconds(response)
+            except httpx.TransportError as e:
+                # un timeout non si ritenta: la ricerca ha già atteso SEARCH_TIMEOUT_SECONDS
+                if isinstance(e, httpx.TimeoutException) or attempt == self.max_attempts:
+                    raise WebSearchError(f"Web search failed: {e}")
+            except httpx.HTTPError as e:
+                raise WebSearchError(f"Web search failed: {e}")
+
+            backoff = self.backoff_seconds * 2 ** (attempt - 1)
+            await asyncio.sleep(min(retry_after if retry_after is not None else backoff, SEARCH_MAX_BACKOFF_SECONDS))
+
+        results = response.json().get("web", {}).get("results", [])
+        self._cache[key] = (results, time.monotonic() + self.ttl_seconds)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return results
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(
+                timeout=SEARCH_TIMEOUT_SECONDS,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=10),
+                transport=self.transport,
+            )
+        return self._http_client
+
+
+def _is_retryable(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def _retry_after_seconds(response: httpx.Response) -> float | None:
+    try:
+        return max(float(response.headers["Retry-After"]), 0)
+    except (KeyError, ValueError):
+        return None
+
+
+web_search_client = WebSearchClient(settings.requrv_brave_api_key, settings.requrv_brave_search_url)
@@ -22,11 +22,17 @@ class Settings(BaseSettings):
     requrv_lago_api_key: str = Field("")
     requrv_lago_webhook_secret: str = Field("")
     requrv_brave_api_key: str = Field("")
+    requrv_brave_search_url: str = Field("https://api.search.brave.com/res/v1/web/search")
     requrv_aws_access_key_id: str = Field("")
     requrv_aws_secret_access_key: str = Field("")
     requrv_aws_endpoint: str = Field("")
     requrv_aws_region: str = Field("")
     requrv_aws_bucket: str = Field("")
+    requrv_frame_store_dir: str = Field("")
+    requrv_analytics_store_dir: str = Field("")
+    requrv_langfuse_host: str = Field("")
+    requrv_langfuse_public_key: str = Field("")
+    requrv_langfuse_secret_key: str = Field("")
     
     # OAuth2 settings
     requrv_google_client_id: str = Field("")
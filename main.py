@@ -16,12 +16,17 @@ from core.modules.auth.route import auth_router
 from core.modules.media.route import media_router
 from core.modules.auth.oauth import oauth_router
 from core.agents.incomeStatementAnalyser.route import income_statement_analyser_router 
+from core.agents.incomeStatementAnalyser.jobs import shutdown_import_job_workers
 from core.modules.langfuse.route import langfuse_router
 from core.modules.vector_db.route import vector_db_router
 from core.modules.subscription.route import schedule_subscription_termination, subscription_router
 from core.modules.webhook.route import webhook_router
 from core.modules.user.route import user_router
 from core.modules.seat.route import schedule_seat_termination, seat_router 
+from core.modules.budget.route import budget_router
+from core.modules.chat.route import chat_router
+from core.services.financial.rollups import schedule_historical_roll_up
+from core.services.prompts import prompt_registry, schedule_prompt_refresh
 
 from starlette.middleware.sessions import SessionMiddleware
 from core.settings import settings
@@ -42,7 +47,9 @@ check_environment_variables(required_env_vars)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await prisma.connect()
+    await prompt_registry.preload()
     yield
+    shutdown_import_job_workers()
 
 
 # -------------- APP -------------- #
@@ -53,6 +60,8 @@ scheduler = AsyncIOScheduler()
 
 scheduler.add_job(schedule_seat_termination, CronTrigger(hour=1, minute=0))  # Every day at 1:00 AM
 scheduler.add_job(schedule_subscription_termination, CronTrigger(hour=1, minute=0))  # Every minute
+scheduler.add_job(schedule_historical_roll_up, CronTrigger(minute="*/15"))  # Every 15 minutes
+scheduler.add_job(schedule_prompt_refresh, CronTrigger(minute="*"))  # Every minute
 scheduler.start()
 
 # -------------- MIDDLEWARE -------------- #
@@ -91,6 +100,8 @@ app.include_router(vector_db_router)
 app.include_router(subscription_router)
 app.include_router(webhook_router)
 app.include_router(seat_router)
+app.include_router(budget_router)
+app.include_router(chat_router)
 
 
 @app.get("/")
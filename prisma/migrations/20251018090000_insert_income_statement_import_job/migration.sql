@@ -0,0 +1,23 @@
+-- CreateEnum
+CREATE TYPE "ImportJobPhase" AS ENUM ('QUEUED', 'PARSING', 'WRITING', 'COMPLETED', 'FAILED');
+
+-- CreateTable
+CREATE TABLE "IncomeStatementImportJob" (
+    "id" UUID NOT NULL,
+    "year" INTEGER NOT NULL,
+    "phase" "ImportJobPhase" NOT NULL DEFAULT 'QUEUED',
+    "rowsProcessed" INTEGER NOT NULL DEFAULT 0,
+    "errors" TEXT[],
+    "organizationId" UUID NOT NULL,
+    "mediaId" UUID,
+    "createdAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" TIMESTAMP NOT NULL,
+
+    CONSTRAINT "IncomeStatementImportJob_pkey" PRIMARY KEY ("id")
+);
+
+-- AddForeignKey
+ALTER TABLE "IncomeStatementImportJob" ADD CONSTRAINT "IncomeStatementImportJob_organizationId_fkey" FOREIGN KEY ("organizationId") REFERENCES "Organization"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "IncomeStatementImportJob" ADD CONSTRAINT "IncomeStatementImportJob_mediaId_fkey" FOREIGN KEY ("mediaId") REFERENCES "Media"("id") ON DELETE SET NULL ON UPDATE CASCADE;
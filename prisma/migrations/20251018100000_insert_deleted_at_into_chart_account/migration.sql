@@ -0,0 +1,2 @@
+-- AlterTable
+ALTER TABLE "ChartAccount" ADD COLUMN     "deletedAt" TIMESTAMP;
@@ -0,0 +1,2 @@
+-- CreateIndex
+CREATE INDEX "ChartAccount_incomeStatementConversionTableId_createdAt_id_idx" ON "ChartAccount"("incomeStatementConversionTableId", "createdAt" DESC, "id" DESC);
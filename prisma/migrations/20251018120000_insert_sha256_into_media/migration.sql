@@ -0,0 +1,5 @@
+-- AlterTable
+ALTER TABLE "Media" ADD COLUMN     "sha256" TEXT;
+
+-- CreateIndex
+CREATE INDEX "Media_sha256_idx" ON "Media"("sha256");
@@ -0,0 +1,2 @@
+-- AlterTable
+ALTER TABLE "Media" ADD COLUMN     "frameKey" TEXT;
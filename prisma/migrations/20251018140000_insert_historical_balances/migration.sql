@@ -0,0 +1,48 @@
+-- CreateTable
+CREATE TABLE "HistoricalMonthlyBalance" (
+    "id" UUID NOT NULL,
+    "year" INTEGER NOT NULL,
+    "month" INTEGER NOT NULL,
+    "debit" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "credit" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "balance" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "organizationId" UUID NOT NULL,
+    "chartAccountId" UUID NOT NULL,
+    "createdAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" TIMESTAMP NOT NULL,
+
+    CONSTRAINT "HistoricalMonthlyBalance_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateTable
+CREATE TABLE "HistoricalYearlyBalance" (
+    "id" UUID NOT NULL,
+    "year" INTEGER NOT NULL,
+    "debit" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "credit" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "balance" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "organizationId" UUID NOT NULL,
+    "chartAccountId" UUID NOT NULL,
+    "createdAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" TIMESTAMP NOT NULL,
+
+    CONSTRAINT "HistoricalYearlyBalance_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE UNIQUE INDEX "HistoricalMonthlyBalance_organizationId_chartAccountId_year_month_key" ON "HistoricalMonthlyBalance"("organizationId", "chartAccountId", "year", "month");
+
+-- CreateIndex
+CREATE UNIQUE INDEX "HistoricalYearlyBalance_organizationId_chartAccountId_year_key" ON "HistoricalYearlyBalance"("organizationId", "chartAccountId", "year");
+
+-- AddForeignKey
+ALTER TABLE "HistoricalMonthlyBalance" ADD CONSTRAINT "HistoricalMonthlyBalance_organizationId_fkey" FOREIGN KEY ("organizationId") REFERENCES "Organization"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "HistoricalMonthlyBalance" ADD CONSTRAINT "HistoricalMonthlyBalance_chartAccountId_fkey" FOREIGN KEY ("chartAccountId") REFERENCES "ChartAccount"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "HistoricalYearlyBalance" ADD CONSTRAINT "HistoricalYearlyBalance_organizationId_fkey" FOREIGN KEY ("organizationId") REFERENCES "Organization"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "HistoricalYearlyBalance" ADD CONSTRAINT "HistoricalYearlyBalance_chartAccountId_fkey" FOREIGN KEY ("chartAccountId") REFERENCES "ChartAccount"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
@@ -0,0 +1,5 @@
+-- CreateIndex
+CREATE INDEX "IncomeStatement_organizationId_year_month_idx" ON "IncomeStatement"("organizationId", "year", "month");
+
+-- CreateIndex
+CREATE INDEX "ValuesCostsRevenues_incomeStatementId_idx" ON "ValuesCostsRevenues"("incomeStatementId");
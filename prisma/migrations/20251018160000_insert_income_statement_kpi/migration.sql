@@ -0,0 +1,30 @@
+-- CreateTable
+CREATE TABLE "IncomeStatementKpi" (
+    "id" UUID NOT NULL,
+    "year" INTEGER NOT NULL,
+    "month" INTEGER NOT NULL,
+    "revenue" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "ebitda" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "ebit" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "grossMargin" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "ebitdaMargin" DOUBLE PRECISION,
+    "ebitMargin" DOUBLE PRECISION,
+    "grossMarginRatio" DOUBLE PRECISION,
+    "costIncidence" DOUBLE PRECISION,
+    "personnelIncidence" DOUBLE PRECISION,
+    "revenueDelta" DOUBLE PRECISION,
+    "ebitdaDelta" DOUBLE PRECISION,
+    "sourceUpdatedAt" TIMESTAMP NOT NULL,
+    "sourceRows" INTEGER NOT NULL,
+    "organizationId" UUID NOT NULL,
+    "createdAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" TIMESTAMP NOT NULL,
+
+    CONSTRAINT "IncomeStatementKpi_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE UNIQUE INDEX "IncomeStatementKpi_organizationId_year_month_key" ON "IncomeStatementKpi"("organizationId", "year", "month");
+
+-- AddForeignKey
+ALTER TABLE "IncomeStatementKpi" ADD CONSTRAINT "IncomeStatementKpi_organizationId_fkey" FOREIGN KEY ("organizationId") REFERENCES "Organization"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
@@ -0,0 +1,25 @@
+-- CreateTable
+CREATE TABLE "BudgetLine" (
+    "id" UUID NOT NULL,
+    "year" INTEGER NOT NULL,
+    "month" INTEGER NOT NULL,
+    "amount" DOUBLE PRECISION NOT NULL DEFAULT 0,
+    "organizationId" UUID NOT NULL,
+    "chartAccountCEEId" UUID NOT NULL,
+    "createdAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" TIMESTAMP NOT NULL,
+
+    CONSTRAINT "BudgetLine_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE UNIQUE INDEX "BudgetLine_organizationId_chartAccountCEEId_year_month_key" ON "BudgetLine"("organizationId", "chartAccountCEEId", "year", "month");
+
+-- CreateIndex
+CREATE INDEX "BudgetLine_organizationId_year_idx" ON "BudgetLine"("organizationId", "year");
+
+-- AddForeignKey
+ALTER TABLE "BudgetLine" ADD CONSTRAINT "BudgetLine_organizationId_fkey" FOREIGN KEY ("organizationId") REFERENCES "Organization"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "BudgetLine" ADD CONSTRAINT "BudgetLine_chartAccountCEEId_fkey" FOREIGN KEY ("chartAccountCEEId") REFERENCES "ChartAccountCEE"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
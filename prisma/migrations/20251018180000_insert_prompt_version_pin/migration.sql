@@ -0,0 +1,17 @@
+-- CreateTable
+CREATE TABLE "PromptVersionPin" (
+    "id" UUID NOT NULL,
+    "name" TEXT NOT NULL,
+    "version" INTEGER NOT NULL,
+    "organizationId" UUID NOT NULL,
+    "createdAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" TIMESTAMP NOT NULL,
+
+    CONSTRAINT "PromptVersionPin_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE UNIQUE INDEX "PromptVersionPin_organizationId_name_key" ON "PromptVersionPin"("organizationId", "name");
+
+-- AddForeignKey
+ALTER TABLE "PromptVersionPin" ADD CONSTRAINT "PromptVersionPin_organizationId_fkey" FOREIGN KEY ("organizationId") REFERENCES "Organization"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
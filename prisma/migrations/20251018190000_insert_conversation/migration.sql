@@ -0,0 +1,44 @@
+-- CreateTable
+CREATE TABLE "Conversation" (
+    "id" UUID NOT NULL,
+    "agent" TEXT NOT NULL,
+    "systemPrompt" TEXT,
+    "summary" TEXT,
+    "summaryTokens" INTEGER NOT NULL DEFAULT 0,
+    "userId" UUID NOT NULL,
+    "organizationId" UUID,
+    "createdAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" TIMESTAMP NOT NULL,
+
+    CONSTRAINT "Conversation_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateTable
+CREATE TABLE "ConversationTurn" (
+    "id" UUID NOT NULL,
+    "prompt" TEXT NOT NULL,
+    "output" TEXT NOT NULL,
+    "messages" JSONB NOT NULL,
+    "tokens" INTEGER NOT NULL,
+    "compacted" BOOLEAN NOT NULL DEFAULT false,
+    "conversationId" UUID NOT NULL,
+    "createdAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" TIMESTAMP NOT NULL,
+
+    CONSTRAINT "ConversationTurn_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE INDEX "Conversation_userId_updatedAt_idx" ON "Conversation"("userId", "updatedAt" DESC);
+
+-- CreateIndex
+CREATE INDEX "ConversationTurn_conversationId_compacted_createdAt_idx" ON "ConversationTurn"("conversationId", "compacted", "createdAt");
+
+-- AddForeignKey
+ALTER TABLE "Conversation" ADD CONSTRAINT "Conversation_userId_fkey" FOREIGN KEY ("userId") REFERENCES "User"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "Conversation" ADD CONSTRAINT "Conversation_organizationId_fkey" FOREIGN KEY ("organizationId") REFERENCES "Organization"("id") ON DELETE SET NULL ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "ConversationTurn" ADD CONSTRAINT "ConversationTurn_conversationId_fkey" FOREIGN KEY ("conversationId") REFERENCES "Conversation"("id") ON DELETE CASCADE ON UPDATE CASCADE;
@@ -0,0 +1,6 @@
+from core.settings import settings
+
+# il client S3 viene creato all'import di core.modules.media.service: senza endpoint boto3 rifiuta la
+# configurazione. Nessuna chiamata raggiunge questo indirizzo durante i test.
+settings.requrv_aws_endpoint = settings.requrv_aws_endpoint or "http://s3.test"
+settings.requrv_aws_region = settings.requrv_aws_region or "eu-west-1"
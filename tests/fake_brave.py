@@ -0,0 +1,60 @@
+"""
+Server Brave Search finto per i test del WebSearchClient.
+
+Nei test viene usato in-process con `httpx.ASGITransport`; per provarlo con l'applicazione si avvia con
+`python tests/fake_brave.py` e REQURV_BRAVE_SEARCH_URL=http://127.0.0.1:8765/res/v1/web/search.
+"""
+import asyncio
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+API_KEY = "brave-test-key"
+SEARCH_PATH = "/res/v1/web/search"
+
+
+class FakeBrave:
+    def __init__(self, delay_seconds: float = 0):
+        self.delay_seconds = delay_seconds
+        self.queries: list[str] = []
+        # risposte di errore da restituire prima dei risultati, come (status, headers)
+        self.failures: list[tuple[int, dict]] = []
+        self.app = Starlette(routes=[Route(SEARCH_PATH, self.search)])
+
+    def fail(self, status_code: int, times: int = 1, headers: dict | None = None):
+        self.failures.extend([(status_code, headers or {})] * times)
+
+    async def search(self, request: Request) -> JSONResponse:
+        if request.headers.get("X-Subscription-Token") != API_KEY:
+            return JSONResponse({"error": "unauthorized"}, status_code=401)
+
+        query = request.query_params["q"]
+        self.queries.append(query)
+        if self.delay_seconds:
+            await asyncio.sleep(self.delay_seconds)
+        if self.failures:
+            status_code, headers = self.failures.pop(0)
+            return JSONResponse({"error": "failure"}, status_code=status_code, headers=headers)
+
+        count = int(request.query_params.get("count", 5))
+        return JSONResponse(
+            {
+                "web": {
+                    "results": [
+                        {
+                            "title": f"{query} {position}",
+                            "url": f"https://example.com/{position}",
+                            "description": f"Result {position} for {query}",
+                        }
+                        for position in range(1, count + 1)
+                    ]
+                }
+            }
+        )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(FakeBrave().app, host="127.0.0.1", port=8765)
@@ -0,0 +1,24 @@
+from core.agents import factory
+
+BASE_URL = "http://gateway.test/v1"
+
+
+def test_provider_is_shared_per_team_key(monkeypatch):
+    monkeypatch.setattr(factory, "_providers", factory.OrderedDict())
+
+    provider = factory.get_openai_provider("sk-team-1", BASE_URL)
+
+    assert factory.get_openai_provider("sk-team-1", BASE_URL) is provider
+    assert factory.get_openai_provider("sk-team-2", BASE_URL) is not provider
+
+
+def test_providers_are_bounded(monkeypatch):
+    monkeypatch.setattr(factory, "_providers", factory.OrderedDict())
+    monkeypatch.setattr(factory, "MAX_CACHED_PROVIDERS", 3)
+
+    first = factory.get_openai_provider("sk-team-0", BASE_URL)
+    for index in range(1, 5):
+        factory.get_openai_provider(f"sk-team-{index}", BASE_URL)
+
+    assert list(factory._providers) == [(f"sk-team-{index}", BASE_URL) for index in (2, 3, 4)]
+    assert factory.get_openai_provider("sk-team-0", BASE_URL) is not first
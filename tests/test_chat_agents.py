@@ -0,0 +1,65 @@
+import asyncio
+import importlib
+import time
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+from pydantic_ai import Agent
+from core.modules.chat import route as chat_route
+from core.services.prompts import CachedPrompt, prompt_registry
+from core.settings import settings
+
+USER_ID = "00000000-0000-0000-0000-000000000001"
+ORGANIZATION_ID = "00000000-0000-0000-0000-000000000002"
+TEAM_KEY = "sk-team-test"
+
+
+class _Users:
+    def __init__(self, user):
+        self.user = user
+
+    async def find_unique(self, where, include=None):
+        return self.user if where["id"] == USER_ID else None
+
+
+@pytest.fixture
+def chat_user(monkeypatch):
+    user = SimpleNamespace(
+        id=USER_ID,
+        organizationId=ORGANIZATION_ID,
+        owner=None,
+        organization=SimpleNamespace(id=ORGANIZATION_ID, team_key=TEAM_KEY),
+    )
+    monkeypatch.setattr(chat_route, "prisma", SimpleNamespace(user=_Users(user)))
+    monkeypatch.setattr(settings, "requrv_hive_endpoint", "http://gateway.test/v1")
+    # prompt già in memoria: nessuna chiamata a Langfuse
+    monkeypatch.setitem(
+        prompt_registry._prompts,
+        ("requrv-hub-core", None),
+        CachedPrompt(name="requrv-hub-core", version=1, text="You are a test agent.", fetched_at=time.monotonic()),
+    )
+    # l'income-statement-analyser legge team key e organizzazione con una sua query, qui dalla cache
+    analyser = importlib.import_module("core.agents.incomeStatementAnalyser.run")
+    monkeypatch.setitem(analyser._user_team_cache, USER_ID, (TEAM_KEY, ORGANIZATION_ID, time.monotonic() + 60))
+    return user
+
+
+@pytest.mark.parametrize("agent_name", list(chat_route.AGENT_MODULES))
+def test_get_chat_agent_builds_every_agent(chat_user, agent_name):
+    agent, organization_id = asyncio.run(chat_route.get_chat_agent(agent_name, USER_ID))
+
+    assert isinstance(agent, Agent)
+    assert organization_id == ORGANIZATION_ID
+
+
+def test_get_chat_agent_unknown_agent(chat_user):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(chat_route.get_chat_agent("unknown", USER_ID))
+    assert error.value.status_code == 404
+
+
+def test_get_chat_agent_without_team_key(chat_user):
+    chat_user.organization.team_key = None
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(chat_route.get_chat_agent("core", USER_ID))
+    assert error.value.status_code == 403
@@ -0,0 +1,82 @@
+import time
+from types import SimpleNamespace
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from core.modules.chat import route as chat_route
+from core.services.prompts import CachedPrompt, PromptNotAvailable
+from core.services.response_cache import ResponseCache
+
+USER_ID = "00000000-0000-0000-0000-000000000001"
+ORGANIZATION_ID = "00000000-0000-0000-0000-000000000002"
+PROMPT = CachedPrompt(name="requrv-hub-core", version=1, text="You are a test agent.", fetched_at=time.monotonic())
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def get_chat_agent(agent_name, user_id):
+        return SimpleNamespace(model=None), ORGANIZATION_ID
+
+    monkeypatch.setattr(chat_route.auth, "verify_token", lambda *args, **kwargs: SimpleNamespace(sub=USER_ID))
+    monkeypatch.setattr(chat_route, "get_chat_agent", get_chat_agent)
+    # risposte già in cache: i turni vengono serviti senza chiamare il modello
+    cache = ResponseCache()
+    monkeypatch.setattr(chat_route, "response_cache", cache)
+    scope = cache.scope("core", ORGANIZATION_ID, PROMPT.version)
+    cache.put(scope, "first question", "first answer")
+    cache.put(scope, "second question", "second answer")
+
+    app = FastAPI()
+    app.include_router(chat_route.chat_router)
+    return TestClient(app)
+
+
+def _prompt_registry(monkeypatch, *results):
+    calls = iter(results)
+
+    async def get(name, organization_id=None):
+        result = next(calls)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(chat_route.prompt_registry, "get", get)
+
+
+def _receive_until_end(websocket) -> list[dict]:
+    events = [websocket.receive_json()]
+    while events[-1]["type"] not in ("done", "error", "cancelled"):
+        events.append(websocket.receive_json())
+    return events
+
+
+def test_unavailable_prompt_sends_error_and_keeps_socket(client, monkeypatch):
+    _prompt_registry(monkeypatch, PromptNotAvailable("Prompt requrv-hub-core not available"), PROMPT)
+
+    with client.websocket_connect("/chat/core/ws?token=test") as websocket:
+        websocket.send_json({"prompt": "first question"})
+        assert websocket.receive_json() == {"type": "error", "detail": "Prompt requrv-hub-core not available"}
+
+        websocket.send_json({"prompt": "first question"})
+        assert _receive_until_end(websocket)[-1]["output"] == "first answer"
+
+
+def test_unexpected_start_error_sends_error(client, monkeypatch):
+    _prompt_registry(monkeypatch, RuntimeError("database unavailable"))
+
+    with client.websocket_connect("/chat/core/ws?token=test") as websocket:
+        websocket.send_json({"prompt": "first question"})
+        assert websocket.receive_json() == {"type": "error", "detail": "Chat run not available"}
+
+
+def test_back_to_back_prompts_are_all_answered(client, monkeypatch):
+    _prompt_registry(monkeypatch, PROMPT, PROMPT)
+
+    with client.websocket_connect("/chat/core/ws?token=test") as websocket:
+        websocket.send_json({"prompt": "first question"})
+        websocket.send_json({"prompt": "second question"})
+        # la prima risposta può finire o essere annullata dal secondo prompt, che riceve sempre la sua
+        first = _receive_until_end(websocket)
+        assert first[-1]["type"] in ("done", "cancelled")
+        second = _receive_until_end(websocket)
+        assert second[-1] == {"type": "done", "output": "second answer", "cached": True}
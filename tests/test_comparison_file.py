@@ -0,0 +1,75 @@
+import io
+import time
+import tracemalloc
+from core.agents.incomeStatementAnalyser.service import (
+    COMPARISON_FRAME_SCHEMA,
+    iter_comparison_file_chunks,
+    parse_comparison_file_chunk,
+)
+from core.services.frame_store import FrameWriter
+
+CSV_CONTENT_TYPE = "text/csv"
+HEADER = "Conto,Descrizione Conto,Tipo,Valorizzazione,DARE Voce,Descrizione_DARE,AVERE Voce,Descrizione_AVERE\n"
+
+
+def comparison_csv(rows: int) -> io.BytesIO:
+    """File di confronto sintetico: un conto per riga, con 500 voci CEE condivise"""
+    lines = [HEADER]
+    for row in range(rows):
+        cee = row % 500
+        lines.append(
+            f"{row:08d},Conto {row},Conto Economico,Costi,"
+            f"B7.{cee},Servizi {cee},{'A1.' + str(cee) if row % 3 else ''},{'Ricavi ' + str(cee) if row % 3 else ''}\n"
+        )
+    return io.BytesIO("".join(lines).encode())
+
+
+# picco di memoria Python ammesso per leggere un file di 200k righe (~15 MB); caricato tutto insieme ne usa ~150
+STREAMING_MEMORY_CEILING_BYTES = 32 * 1024 * 1024
+
+
+def parse_comparison_file(file_object: io.BytesIO, frame_writer: FrameWriter | None = None) -> tuple[int, int]:
+    accounts = rows = 0
+    for chunk in iter_comparison_file_chunks(file_object, CSV_CONTENT_TYPE):
+        _, chart_accounts_to_create, chunk_rows = parse_comparison_file_chunk(chunk, frame_writer)
+        accounts += len(chart_accounts_to_create)
+        rows += chunk_rows
+    return accounts, rows
+
+
+def test_parse_comparison_file():
+    accounts, rows = parse_comparison_file(comparison_csv(1000))
+
+    assert (accounts, rows) == (1000, 1000)
+
+
+def test_parse_comparison_file_scales_linearly():
+    # benchmark: il tempo per riga a 100k righe non deve crescere rispetto a 1k e 10k
+    seconds_per_row = {}
+    for rows in (1_000, 10_000, 100_000):
+        file_object = comparison_csv(rows)
+        timings = []
+        for _ in range(3):
+            started = time.perf_counter()
+            parse_comparison_file(file_object)
+            timings.append(time.perf_counter() - started)
+        seconds_per_row[rows] = min(timings) / rows
+
+    timings = {rows: f"{value * 1e6:.2f} us/row" for rows, value in seconds_per_row.items()}
+    assert seconds_per_row[100_000] < 3 * seconds_per_row[10_000], timings
+    assert seconds_per_row[100_000] < 3 * seconds_per_row[1_000], timings
+
+
+def test_parse_comparison_file_memory_is_bounded(tmp_path):
+    file_object = comparison_csv(200_000)
+
+    tracemalloc.start()
+    try:
+        with FrameWriter(str(tmp_path / "comparison.arrow"), COMPARISON_FRAME_SCHEMA) as frame_writer:
+            accounts, rows = parse_comparison_file(file_object, frame_writer)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert (accounts, rows) == (200_000, 200_000)
+    assert peak < STREAMING_MEMORY_CEILING_BYTES, f"peak {peak / 1e6:.1f} MB"
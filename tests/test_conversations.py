@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+from core.modules.chat import route as chat_route
+
+USER_ID = "00000000-0000-0000-0000-000000000001"
+NOW = datetime(2025, 10, 18, 12, 0)
+
+
+def _conversation(user_id=USER_ID):
+    return SimpleNamespace(
+        id="00000000-0000-0000-0000-000000000010",
+        agent="core",
+        title="Which costs increased the most this year?",
+        systemPrompt="You are a financial assistant.",
+        summary="The user asked about costs.",
+        summaryTokens=8,
+        userId=user_id,
+        createdAt=NOW,
+        updatedAt=NOW,
+        turns=[
+            SimpleNamespace(
+                id="00000000-0000-0000-0000-000000000011",
+                prompt="Which costs increased the most this year?",
+                output="Rent.",
+                messages=[{"kind": "request"}],
+                tokens=12,
+                createdAt=NOW,
+            )
+        ],
+    )
+
+
+class _Conversations:
+    def __init__(self, conversation):
+        self.conversation = conversation
+
+    async def find_many(self, where, order=None, take=None):
+        return [self.conversation] if where["userId"] == self.conversation.userId else []
+
+    async def find_unique(self, where, include=None):
+        return self.conversation if where["id"] == self.conversation.id else None
+
+
+@pytest.fixture
+def conversation(monkeypatch):
+    conversation = _conversation()
+    monkeypatch.setattr(chat_route, "prisma", SimpleNamespace(conversation=_Conversations(conversation)))
+    return conversation
+
+
+def test_list_conversations_hides_internal_fields(conversation):
+    result = asyncio.run(chat_route.list_conversations(token=None, payload=SimpleNamespace(sub=USER_ID)))
+
+    assert [item.model_dump() for item in result] == [
+        {
+            "id": conversation.id,
+            "agent": "core",
+            "title": conversation.title,
+            "createdAt": NOW,
+            "updatedAt": NOW,
+        }
+    ]
+
+
+def test_get_conversation_hides_internal_fields(conversation):
+    result = asyncio.run(
+        chat_route.get_conversation(conversation.id, token=None, payload=SimpleNamespace(sub=USER_ID))
+    ).model_dump()
+
+    assert set(result) == {"id", "agent", "title", "createdAt", "updatedAt", "turns"}
+    assert set(result["turns"][0]) == {"id", "prompt", "output", "createdAt"}
+
+
+def test_get_conversation_of_another_user(conversation):
+    conversation.userId = "00000000-0000-0000-0000-000000000003"
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(chat_route.get_conversation(conversation.id, token=None, payload=SimpleNamespace(sub=USER_ID)))
+    assert error.value.status_code == 404
@@ -0,0 +1,140 @@
+import asyncio
+import io
+import os
+import queue
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from types import SimpleNamespace
+import pytest
+from fastapi import BackgroundTasks, UploadFile
+from core.agents.incomeStatementAnalyser import jobs
+
+HEADER = "Conto,Descrizione Conto,Tipo,Valorizzazione,DARE Voce,Descrizione_DARE,AVERE Voce,Descrizione_AVERE\n"
+CHUNKS = 10
+
+
+@pytest.fixture
+def comparison_file(tmp_path):
+    path = tmp_path / "comparison.csv"
+    rows = "".join(f"{row:08d},Conto {row},Conto Economico,Costi,B7,Servizi,,\n" for row in range(CHUNKS * 5000))
+    path.write_text(HEADER + rows)
+    return str(path)
+
+
+@pytest.fixture
+def thread_workers(monkeypatch):
+    # il worker gira in un thread invece che in un processo del pool, con code ed eventi locali
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(jobs, "_get_process_pool", lambda: executor)
+    monkeypatch.setattr(jobs, "_get_queue_manager", lambda: SimpleNamespace(Queue=queue.Queue, Event=threading.Event))
+
+    parsed = []
+    parse = jobs.parse_comparison_file_chunk
+
+    def counting_parse(chunk, frame_writer=None):
+        parsed.append(len(chunk))
+        return parse(chunk, frame_writer)
+
+    monkeypatch.setattr(jobs, "parse_comparison_file_chunk", counting_parse)
+    yield parsed
+    executor.shutdown(wait=True)
+
+
+def test_parse_in_worker_reads_every_chunk(comparison_file, tmp_path, thread_workers):
+    async def read_all():
+        async with aclosing(jobs._parse_in_worker(comparison_file, "text/csv", str(tmp_path / "frame"))) as chunks:
+            return [rows async for _, _, rows in chunks]
+
+    assert asyncio.run(read_all()) == [5000] * CHUNKS
+
+
+def test_parse_in_worker_stops_after_failed_write(comparison_file, tmp_path, thread_workers):
+    async def fail_on_first_write():
+        async with aclosing(jobs._parse_in_worker(comparison_file, "text/csv", str(tmp_path / "frame"))) as chunks:
+            async for _ in chunks:
+                raise RuntimeError("database write failed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(fail_on_first_write())
+
+    # oltre al blocco scritto, solo quelli già in coda o in lettura quando la scrittura è fallita
+    assert len(thread_workers) <= 2 + jobs._IMPORT_JOB_QUEUE_SIZE < CHUNKS
+
+
+def test_parse_in_worker_fails_when_worker_dies(comparison_file, tmp_path, thread_workers, monkeypatch):
+    # un worker ucciso non invia il marcatore di fine
+    def killed_worker(path, content_type, frame_path, queue, stop):
+        raise MemoryError("worker killed")
+
+    monkeypatch.setattr(jobs, "_parse_comparison_file_worker", killed_worker)
+    monkeypatch.setattr(jobs, "_IMPORT_JOB_POLL_SECONDS", 0.05)
+
+    async def read_all():
+        async with aclosing(jobs._parse_in_worker(comparison_file, "text/csv", str(tmp_path / "frame"))) as chunks:
+            return [chunk async for chunk in chunks]
+
+    with pytest.raises(MemoryError):
+        asyncio.run(asyncio.wait_for(read_all(), timeout=5))
+
+
+class _FailingJobs:
+    async def create(self, data):
+        raise RuntimeError("database unavailable")
+
+    async def update(self, where, data, include=None):
+        raise RuntimeError("database unavailable")
+
+
+def test_local_copy_is_removed_when_job_is_not_created(tmp_path, monkeypatch):
+    async def prepare_comparison_file_upload(user_id, year, file, reimport):
+        return "organization-id", SimpleNamespace(id="media-id"), None
+
+    monkeypatch.setattr(jobs, "prepare_comparison_file_upload", prepare_comparison_file_upload)
+    monkeypatch.setattr(jobs, "prisma", SimpleNamespace(incomestatementimportjob=_FailingJobs()))
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    file = UploadFile(io.BytesIO(HEADER.encode()), filename="comparison.csv")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(jobs.upload_comparison_file_job_service("user-id", 2024, file, BackgroundTasks()))
+    assert os.listdir(tmp_path) == []
+
+
+def test_job_failure_is_logged_when_database_is_down(comparison_file, monkeypatch, caplog):
+    monkeypatch.setattr(jobs, "prisma", SimpleNamespace(incomestatementimportjob=_FailingJobs()))
+
+    asyncio.run(jobs.run_comparison_file_import_job("job-id", comparison_file, "text/csv"))
+
+    assert not os.path.exists(comparison_file)
+    assert "Error updating import job job-id" in caplog.text
+
+
+class _Jobs:
+    def __init__(self):
+        self.phases = []
+
+    async def update(self, where, data, include=None):
+        self.phases.append(data["phase"])
+        return SimpleNamespace(
+            id=where["id"], organizationId="organization-id", year=2024, mediaId="media-id",
+            media=SimpleNamespace(id="media-id", key="uploads/comparison.csv"),
+        )
+
+
+def test_job_completes_when_frame_upload_fails(comparison_file, thread_workers, monkeypatch, caplog):
+    import core.services.frame_store as frame_store
+
+    async def import_comparison_file(organization_id, year, media_id, parsed_chunks, on_chunk_imported=None):
+        async for _ in parsed_chunks:
+            pass
+
+    job_table = _Jobs()
+    monkeypatch.setattr(jobs, "prisma", SimpleNamespace(incomestatementimportjob=job_table))
+    monkeypatch.setattr(jobs, "import_comparison_file", import_comparison_file)
+    monkeypatch.setattr(frame_store, "s3_client", None)
+
+    asyncio.run(jobs.run_comparison_file_import_job("job-id", comparison_file, "text/csv"))
+
+    assert job_table.phases[-1] == jobs.ImportJobPhase.COMPLETED
+    assert "Error saving frame for media media-id" in caplog.text
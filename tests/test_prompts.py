@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from core.services import prompts
+from core.services.prompts import PromptNotAvailable, PromptRegistry
+
+
+class _Langfuse:
+    def __init__(self, delay_seconds: float = 0, available: bool = True):
+        self.delay_seconds = delay_seconds
+        self.available = available
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_prompt(self, name, version=None, cache_ttl_seconds=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay_seconds)
+        if not self.available:
+            raise ConnectionError("Langfuse unavailable")
+        return SimpleNamespace(version=version or 3, compile=lambda: f"{name} text")
+
+
+def test_concurrent_misses_share_one_fetch():
+    client = _Langfuse(delay_seconds=0.05)
+    registry = PromptRegistry(client, ["requrv-hub-core"])
+
+    async def get_together():
+        return await asyncio.gather(*(registry.get("requrv-hub-core") for _ in range(10)))
+
+    results = asyncio.run(get_together())
+
+    assert client.calls == 1
+    assert {prompt.version for prompt in results} == {3}
+
+
+def test_unavailable_prompt_fails_fast_until_retry():
+    client = _Langfuse(available=False)
+    registry = PromptRegistry(client, ["requrv-hub-core"])
+
+    async def get_twice():
+        for _ in range(2):
+            with pytest.raises(PromptNotAvailable):
+                await registry.get("requrv-hub-core")
+
+    asyncio.run(get_twice())
+    assert client.calls == 1
+
+    # scaduta la finestra il prompt viene richiesto di nuovo
+    client.available = True
+    registry._failed_until = {key: 0 for key in registry._failed_until}
+    prompt = asyncio.run(registry.get("requrv-hub-core"))
+
+    assert prompt.text == "requrv-hub-core text"
+    assert client.calls == 2
+
+
+def test_refresh_retries_prompts_never_loaded(monkeypatch):
+    monkeypatch.setattr(prompts.prisma, "promptversionpin", SimpleNamespace(find_many=_no_pins), raising=False)
+    client = _Langfuse(available=False)
+    registry = PromptRegistry(client, ["requrv-hub-core"])
+    asyncio.run(registry.preload())
+
+    client.available = True
+    asyncio.run(registry.refresh())
+
+    assert asyncio.run(registry.get("requrv-hub-core")).version == 3
+
+
+async def _no_pins():
+    return []
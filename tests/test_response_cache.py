@@ -0,0 +1,44 @@
+import pytest
+from core.services.response_cache import ResponseCache
+
+ORGANIZATION_ID = "00000000-0000-0000-0000-000000000002"
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache()
+
+
+@pytest.fixture
+def scope(cache):
+    return cache.scope("core", ORGANIZATION_ID, 1)
+
+
+@pytest.mark.parametrize(
+    "asked, cached",
+    [
+        ("Which costs increased the most this year?", "Which costs decreased the most this year?"),
+        ("What was the EBITDA in 2023?", "What was the EBITDA in 2024?"),
+        ("Revenue in Q1?", "Revenue in Q2?"),
+        ("Quali costi sono aumentati di più?", "Quali costi sono diminuiti di più?"),
+        ("Revenue above 10000 euro", "Revenue above 100000 euro"),
+    ],
+)
+def test_near_miss_questions_are_not_served(cache, scope, asked, cached):
+    cache.put(scope, cached, "cached answer")
+
+    assert cache.get(scope, asked) is None
+
+
+def test_same_question_after_normalization_is_served(cache, scope):
+    cache.put(scope, "Qual è l'EBITDA del 2024?", "answer")
+
+    assert cache.get(scope, "  qual e l EBITDA del 2024 ") == "answer"
+
+
+def test_invalidation_changes_scope(cache, scope):
+    cache.put(scope, "What was the EBITDA in 2024?", "answer")
+    cache.invalidate_organization(ORGANIZATION_ID)
+
+    assert cache.get(scope, "What was the EBITDA in 2024?") is None
+    assert cache.get(cache.scope("core", ORGANIZATION_ID, 1), "What was the EBITDA in 2024?") is None
@@ -0,0 +1,96 @@
+import asyncio
+import io
+from types import SimpleNamespace
+import pandas
+import pytest
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+from core.agents.incomeStatementAnalyser import trial_balance
+from core.agents.incomeStatementAnalyser.trial_balance import _parse_amounts, parse_trial_balance_chunk
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("1.234", 1234.0),
+        ("-12.345.678", -12345678.0),
+        ("1.234,56", 1234.56),
+        ("1234,5", 1234.5),
+        ("1.5", 1.5),
+        ("1.23", 1.23),
+        ("1234.56", 1234.56),
+        ("", 0.0),
+        ("n/d", 0.0),
+        (1.234, 1.234),
+        (None, 0.0),
+    ],
+)
+def test_parse_amounts(value, expected):
+    column = pandas.Series([value], dtype=object)
+
+    assert _parse_amounts(column, column.index).tolist() == [expected]
+
+
+def test_parse_trial_balance_chunk():
+    chunk = pandas.DataFrame(
+        {
+            "Conto": ["01", "02", "01", "99", None],
+            "Dare": ["1.234", "10,50", "1", "5", "7"],
+            "Avere": ["0", "1.000,00", None, "0", "0"],
+        }
+    )
+
+    values, unknown_codes = parse_trial_balance_chunk(chunk, {"01": "account-1", "02": "account-2"})
+
+    assert values.to_dict("records") == [
+        {"chartAccountId": "account-1", "debit": 1235.0, "credit": 0.0, "balance": 1235.0},
+        {"chartAccountId": "account-2", "debit": 10.5, "credit": 1000.0, "balance": -989.5},
+    ]
+    assert unknown_codes == {"99"}
+
+
+class _FindUnique:
+    def __init__(self, record):
+        self.record = record
+
+    async def find_unique(self, where, include=None):
+        return self.record
+
+
+def test_upload_succeeds_when_percentages_fail(monkeypatch, caplog):
+    organization = SimpleNamespace(id="organization-id")
+
+    async def ok(*args, **kwargs):
+        return None
+
+    async def chart_account_ids(organization_id):
+        return {"01": "account-1"}
+
+    async def upload_file_to_s3(file, who_uploaded_it_user_id):
+        return SimpleNamespace(id="media-id")
+
+    async def import_trial_balance(*args):
+        return SimpleNamespace(id="income-statement-id"), 1, set()
+
+    async def fill_percentages(organization_id, years):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(
+        trial_balance,
+        "prisma",
+        SimpleNamespace(
+            user=_FindUnique(SimpleNamespace(id="user-id", organizationId=organization.id, owner=None)),
+            organization=_FindUnique(organization),
+        ),
+    )
+    monkeypatch.setattr(trial_balance, "_load_chart_account_ids", chart_account_ids)
+    monkeypatch.setattr(trial_balance, "upload_file_to_s3", upload_file_to_s3)
+    monkeypatch.setattr(trial_balance, "import_trial_balance", import_trial_balance)
+    monkeypatch.setattr(trial_balance, "roll_up_historical_balances", ok)
+    monkeypatch.setattr(trial_balance, "fill_percentages", fill_percentages)
+    file = UploadFile(io.BytesIO(b"Conto,Dare\n01,1\n"), filename="trial.csv", headers=Headers({"content-type": "text/csv"}))
+
+    result = asyncio.run(trial_balance.upload_trial_balance_service("user-id", 2024, 1, file))
+
+    assert result["rowsImported"] == 1
+    assert "Error filling percentages after trial balance import" in caplog.text
@@ -0,0 +1,107 @@
+import asyncio
+import httpx
+import pytest
+from core.services.web_search import WebSearchClient, WebSearchError
+from fake_brave import API_KEY, SEARCH_PATH, FakeBrave
+
+SEARCH_URL = f"http://brave.test{SEARCH_PATH}"
+
+
+@pytest.fixture
+def brave():
+    return FakeBrave()
+
+
+def _client(brave: FakeBrave, api_key: str = API_KEY, **kwargs) -> WebSearchClient:
+    return WebSearchClient(
+        api_key, SEARCH_URL, backoff_seconds=0.01, transport=httpx.ASGITransport(app=brave.app), **kwargs
+    )
+
+
+def test_search_returns_results(brave):
+    results = asyncio.run(_client(brave).search("fatturato medio ristoranti", count=3))
+
+    assert [result["url"] for result in results] == [f"https://example.com/{position}" for position in (1, 2, 3)]
+
+
+def test_identical_searches_are_coalesced(brave):
+    brave.delay_seconds = 0.05
+    client = _client(brave)
+
+    async def search_together():
+        return await asyncio.gather(*(client.search("inflazione 2024") for _ in range(10)))
+
+    results = asyncio.run(search_together())
+
+    assert brave.queries == ["inflazione 2024"]
+    assert all(result == results[0] for result in results)
+
+
+def test_results_are_cached_by_normalized_query(brave):
+    client = _client(brave)
+
+    async def search_twice():
+        first = await client.search("Inflazione  2024")
+        second = await client.search(" inflazione 2024 ")
+        other = await client.search("inflazione 2024", country="de")
+        return first, second, other
+
+    first, second, _ = asyncio.run(search_twice())
+
+    assert first == second
+    assert brave.queries == ["Inflazione  2024", "inflazione 2024"]
+
+
+def test_expired_results_are_fetched_again(brave):
+    client = _client(brave, ttl_seconds=0)
+
+    async def search_twice():
+        await client.search("inflazione 2024")
+        await client.search("inflazione 2024")
+
+    asyncio.run(search_twice())
+
+    assert len(brave.queries) == 2
+
+
+@pytest.mark.parametrize("status_code", [429, 500, 503])
+def test_retryable_errors_are_retried_with_backoff(brave, status_code):
+    brave.fail(status_code, times=2)
+
+    results = asyncio.run(_client(brave).search("tassi BCE"))
+
+    assert len(results) == 5
+    assert len(brave.queries) == 3
+
+
+def test_retry_after_is_honoured(brave, monkeypatch):
+    brave.fail(429, headers={"Retry-After": "0.2"})
+    waits = []
+    sleep = asyncio.sleep
+
+    async def recording_sleep(seconds):
+        waits.append(seconds)
+        await sleep(0)
+
+    monkeypatch.setattr("core.services.web_search.asyncio.sleep", recording_sleep)
+    asyncio.run(_client(brave).search("tassi BCE"))
+
+    assert waits == [0.2]
+
+
+def test_gives_up_after_max_attempts(brave):
+    brave.fail(503, times=5)
+
+    with pytest.raises(WebSearchError):
+        asyncio.run(_client(brave, max_attempts=3).search("tassi BCE"))
+    assert len(brave.queries) == 3
+
+
+def test_client_errors_are_not_retried(brave):
+    with pytest.raises(WebSearchError):
+        asyncio.run(_client(brave, api_key="wrong-key").search("tassi BCE"))
+    brave.fail(400)
+    with pytest.raises(WebSearchError):
+        asyncio.run(_client(brave).search("tassi BCE"))
+
+    assert brave.queries == ["tassi BCE"]